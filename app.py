@@ -1,39 +1,99 @@
 import logging
 import os
-import threading
-import uuid
-from queue import Queue
+from functools import partial
+from tempfile import SpooledTemporaryFile
 
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Request, render_template, request, jsonify
 from werkzeug.utils import secure_filename
 
 from modules.prcs_async_log import create_sse_stream, process_upload_async, process_nspd_async, \
     process_nspd_border_async
-from modules.prcs_flow import create_nmap_output_template, merge_nmap_output_template, ProcessingError
+from modules.prcs_flow import create_nmap_output_template, merge_nmap_output_template, ProcessingError, \
+    JobQueueFullError
+from modules.prcs_event_log import get_event_log
 from modules.prcs_geojson import process_geojson
 from modules.prcs_gpx import process_gpx
+from modules.prcs_job_queue import get_job_queue, public_job, check_job_backends, JOB_TARGETS
+from modules.prcs_jobs import get_job_executor, get_job_registry
 from modules.prcs_kml import process_kml
+from modules.prcs_multipart import UploadFeed, read_multipart_uploads
 from modules.prcs_shp import process_zip
 from modules.prcs_topojson import process_topojson
-from modules.prcs_upload import download_index_json, upload_index_json, ensure_folder, get_current_day_folder_path, \
-    BASE_FOLDER_PATH
+from modules.prcs_storage import download_index_json_with_revision, update_index_json, ensure_folder
+from modules.prcs_upload import get_current_day_folder_path, BASE_FOLDER_PATH
 from modules.prcs_wkt import process_wkt
+from config import JOB_QUEUE_BACKEND, JOB_EVENT_BUS, UPLOAD_MEMORY_LIMIT, UPLOAD_STREAMING
+
+
+class UploadRequest(Request):
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        # Части multipart до UPLOAD_MEMORY_LIMIT остаются в памяти, а не во временном файле werkzeug
+        return SpooledTemporaryFile(max_size=UPLOAD_MEMORY_LIMIT, mode='rb+')
+
+
+check_job_backends()
 
 app = Flask(__name__, template_folder='web/templates', static_folder='web/static')
+app.request_class = UploadRequest
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 ALLOWED_EXTENSIONS = {'zip', 'geojson', 'gpx', 'kml', 'kmz', 'topojson', 'wkt'}
-
-# Session-based log queues
-log_queues = {}
+JOBS_PAGE_DEFAULT = 50
+JOBS_PAGE_MAX = 200
 
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
+def keep_upload(file, job_id, filename):
+    """
+    Источник файла для задачи: содержимое в памяти, если файл не больше UPLOAD_MEMORY_LIMIT, иначе путь временного
+    файла. Задачи очереди SQLite выполняет другой процесс, поэтому для них файл всегда сохраняется на диск.
+    """
+    if JOB_QUEUE_BACKEND != 'sqlite':
+        data = file.stream.read(UPLOAD_MEMORY_LIMIT + 1)
+        if len(data) <= UPLOAD_MEMORY_LIMIT:
+            return data
+        file.stream.seek(0)
+
+    temp_path = os.path.join("/tmp", f"{job_id}_{filename}")
+    file.save(temp_path)
+    return temp_path
+
+
+def start_job(job, target, *args, temp_files=()):
+    """Ставит задачу в общий пул или очередь SQLite; при заполненной очереди отвечает 429 с Retry-After"""
+    registry = get_job_registry()
+    try:
+        if JOB_QUEUE_BACKEND == 'sqlite':
+            kind = next(kind for kind, kind_target in JOB_TARGETS.items() if kind_target is target)
+            get_job_queue().enqueue(job.id, kind, list(args))
+            # Задачу выполняет процесс worker.py, состояние хранится в очереди
+            registry.remove(job.id)
+        else:
+            get_job_executor().submit(partial(registry.run, job.id, target), job.log_queue, job.id, *args,
+                                      cancel_event=job.cancel_event)
+    except JobQueueFullError as e:
+        registry.remove(job.id)
+        job.log_queue.put(None)
+        for source, _ in temp_files:
+            if isinstance(source, str) and os.path.exists(source):
+                os.remove(source)
+        logger.warning("Очередь задач заполнена, запрос отклонен")
+        return jsonify({'error': e.message}), 429, {'Retry-After': str(e.retry_after)}
+
+    return jsonify({'session_id': job.id})
+
+
+def get_sse_jobs():
+    """Источник логов для SSE: журнал SQLite доступен в любом процессе, реестр — только в принявшем задачу"""
+    return get_event_log() if JOB_EVENT_BUS == 'sqlite' else get_job_registry()
+
+
 @app.route('/', methods=['GET', 'POST'])
 def index():
     if request.method == 'POST':
@@ -76,9 +136,8 @@ def index():
 
             logger.info("Загрузка текущего файла index.json")
             try:
-                current_index = download_index_json()
-                if current_index is None:
-                    current_index = create_nmap_output_template()
+                snapshot = download_index_json_with_revision()
+                if snapshot[0] is None:
                     logger.info("Создан новый файл index.json")
                 else:
                     logger.info("✓ Загружен")
@@ -140,8 +199,7 @@ def index():
             if processed_files:
                 logger.info("Загрузка результатов в Блокнот картографа")
                 try:
-                    final_index = merge_nmap_output_template(current_index, new_data_to_merge)
-                    upload_index_json(final_index)
+                    update_index_json(new_data_to_merge, snapshot)
                     logger.info("✓ Загружен")
                 except ProcessingError as e:
                     logger.error(f"Ошибка сохранения: {e.message}")
@@ -157,16 +215,80 @@ def index():
 @app.route('/stream-logs/<session_id>')
 def stream_logs(session_id):
     """SSE endpoint for streaming logs in real-time"""
-    return create_sse_stream(session_id, log_queues)
+    # Браузер передает номер последней полученной записи при переподключении
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id', '0')
+    return create_sse_stream(session_id, get_sse_jobs(), int(last_event_id) if last_event_id.isdigit() else 0)
+
+
+@app.route('/stats/jobs')
+def jobs_stats():
+    """Счетчики задач в памяти для мониторинга"""
+    if JOB_QUEUE_BACKEND == 'sqlite':
+        return jsonify({**get_job_registry().stats(), 'sqlite_queue': get_job_queue().counts()})
+    return jsonify({**get_job_registry().stats(), 'executor_queued': get_job_executor().queued()})
+
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    """Состояние задачи, результаты по файлам и время выполнения для клиентов без SSE"""
+    job = get_job_registry().get(job_id)
+    if job is not None:
+        return jsonify(job.to_dict())
+    if JOB_QUEUE_BACKEND == 'sqlite':
+        queued_job = get_job_queue().get(job_id)
+        if queued_job is not None:
+            return jsonify(public_job(queued_job))
+    return jsonify({'error': 'Job not found'}), 404
+
+
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    """Отмена задачи: конвертация прерывается, результаты не сохраняются, временные файлы удаляются"""
+    if JOB_QUEUE_BACKEND == 'sqlite':
+        queued_job = get_job_queue().cancel(job_id)
+        if queued_job is None:
+            return jsonify({'error': 'Job not found'}), 404
+        return jsonify(public_job(queued_job)), 202
+
+    job = get_job_registry().cancel(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    if not job.report['cancelled']:
+        return jsonify({'error': 'Job already finished'}), 409
+    # Задача из очереди ожидания завершается сразу и освобождает место в очереди
+    get_job_executor().cancel_pending(job.cancel_event)
+    return jsonify(job.to_dict(include_files=False)), 202
+
+
+@app.route('/jobs')
+def jobs_list():
+    """Список задач с пагинацией: offset, limit (не больше JOBS_PAGE_MAX), необязательный фильтр state"""
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    limit = min(max(request.args.get('limit', JOBS_PAGE_DEFAULT, type=int), 1), JOBS_PAGE_MAX)
+    if JOB_QUEUE_BACKEND == 'sqlite':
+        # Задачи выполняет worker.py, в реестре процесса их нет
+        total, queued_jobs = get_job_queue().list(offset, limit, request.args.get('state') or None)
+        jobs = [public_job(queued_job) for queued_job in queued_jobs]
+    else:
+        total, registry_jobs = get_job_registry().list(offset, limit, request.args.get('state') or None)
+        jobs = [job.to_dict(include_files=False) for job in registry_jobs]
+    return jsonify({
+        'total': total,
+        'offset': offset,
+        'limit': limit,
+        'jobs': jobs,
+    })
 
 
 @app.route('/upload-async', methods=['POST'])
 def upload_async():
     """Эндпоинт асинхронной загрузки, который обрабатывает файлы и транслирует логи"""
 
-    session_id = str(uuid.uuid4())
-    log_queue = Queue()
-    log_queues[session_id] = log_queue
+    job = get_job_registry().create()
+
+    boundary = request.mimetype_params.get('boundary')
+    if UPLOAD_STREAMING and JOB_QUEUE_BACKEND != 'sqlite' and request.mimetype == 'multipart/form-data' and boundary:
+        return upload_async_streaming(job, boundary.encode('latin-1'))
 
     uploaded_files = request.files.getlist('files')
     uploaded_files = [f for f in uploaded_files if f.filename != '']
@@ -175,56 +297,55 @@ def upload_async():
     for file in uploaded_files:
         if file and allowed_file(file.filename):
             filename = secure_filename(file.filename)
-            temp_path = os.path.join("/tmp", f"{session_id}_{filename}")
-            file.save(temp_path)
-            temp_files.append((temp_path, filename))
+            temp_files.append((keep_upload(file, job.id, filename), filename))
+
+    return start_job(job, process_upload_async, temp_files, temp_files=temp_files)
 
-    thread = threading.Thread(
-        target=process_upload_async,
-        args=(log_queue, session_id, temp_files)
-    )
-    thread.daemon = True
-    thread.start()
 
-    return jsonify({'session_id': session_id})
+def upload_async_streaming(job, boundary):
+    """
+    Задача запускается до чтения тела запроса, а файлы передаются ей по мере приема, поэтому первые файлы
+    конвертируются, пока следующие еще загружаются
+    """
+    feed = UploadFeed()
+    response = start_job(job, process_upload_async, feed)
+    if isinstance(response, tuple):
+        return response
+
+    def accept(filename):
+        return secure_filename(filename) if allowed_file(filename) else None
+
+    try:
+        read_multipart_uploads(request.stream, boundary, feed, job.id, accept)
+    except Exception as e:
+        logger.warning(f"Прием файлов задачи {job.id} прерван: {e}")
+        # Неполная загрузка не сохраняется: задача отменяется и удаляет уже принятые файлы
+        feed.abort()
+        if get_job_registry().cancel(job.id) is not None:
+            get_job_executor().cancel_pending(job.cancel_event)
+    finally:
+        feed.close()
+    return response
 
 
 @app.route('/upload-nspd-async', methods=['POST'])
 def upload_nspd_async():
     """Эндпоинт асинхронной загрузки номера НСПД"""
 
-    session_id = str(uuid.uuid4())
-    log_queue = Queue()
-    log_queues[session_id] = log_queue
+    job = get_job_registry().create()
 
     registry_number = request.form.get('registry_number')
-    thread = threading.Thread(
-        target=process_nspd_async,
-        args=(log_queue, session_id, registry_number)
-    )
-    thread.daemon = True
-    thread.start()
-
-    return jsonify({'session_id': session_id})
+    return start_job(job, process_nspd_async, registry_number)
 
 
 @app.route('/upload-nspd-border-async', methods=['POST'])
 def upload_nspd_border_async():
     """Эндпоинт асинхронной загрузки границ муниципальных образований из НСПД"""
 
-    session_id = str(uuid.uuid4())
-    log_queue = Queue()
-    log_queues[session_id] = log_queue
+    job = get_job_registry().create()
 
     registry_number = request.form.get('registry_number')
-    thread = threading.Thread(
-        target=process_nspd_border_async,
-        args=(log_queue, session_id, registry_number)
-    )
-    thread.daemon = True
-    thread.start()
-
-    return jsonify({'session_id': session_id})
+    return start_job(job, process_nspd_border_async, registry_number)
 
 
 if __name__ == '__main__':
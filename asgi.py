@@ -0,0 +1,190 @@
+"""
+ASGI-режим для большого числа одновременных SSE-потоков. Поток /stream-logs/<session_id> обслуживается корутиной
+в цикле событий и не занимает поток сервера, пока ждет записей лога. Остальные запросы выполняет Flask-приложение
+в пуле из ASGI_WSGI_THREADS потоков; тело запроса передается ему по частям, как при запуске через WSGI-сервер.
+
+    uvicorn asgi:app --host 0.0.0.0 --port 5555
+"""
+import asyncio
+import io
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import parse_qs
+
+from werkzeug.exceptions import ClientDisconnected
+
+from app import app as flask_app, get_sse_jobs
+from config import ASGI_WSGI_THREADS
+from modules.prcs_async_log import sse_events_async, SSE_HEADERS
+
+
+STREAM_PREFIX = '/stream-logs/'
+
+
+class _RequestBody(io.RawIOBase):
+    """Тело запроса для потока Flask: очередная часть запрашивается у receive() в цикле событий при чтении"""
+
+    def __init__(self, receive: Callable, loop: asyncio.AbstractEventLoop):
+        self._receive = receive
+        self._loop = loop
+        self._buffer = b''
+        self._more_body = True
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer: Any) -> int:
+        while not self._buffer and self._more_body:
+            message = asyncio.run_coroutine_threadsafe(self._receive(), self._loop).result()
+            if message['type'] == 'http.disconnect':
+                raise ClientDisconnected()
+            self._buffer = message.get('body', b'')
+            self._more_body = message.get('more_body', False)
+        size = min(len(buffer), len(self._buffer))
+        buffer[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
+
+
+def _environ(scope: Dict[str, Any], body: io.BufferedReader) -> Dict[str, Any]:
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1] or 80),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        # Тело читается до конца потока: при chunked-передаче Content-Length нет
+        'wsgi.input_terminated': True,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'], environ['REMOTE_PORT'] = scope['client'][0], str(scope['client'][1])
+    for name, value in scope.get('headers') or []:
+        name, value = name.decode('latin-1'), value.decode('latin-1')
+        if name == 'content-length':
+            key = 'CONTENT_LENGTH'
+        elif name == 'content-type':
+            key = 'CONTENT_TYPE'
+        else:
+            key = 'HTTP_' + name.upper().replace('-', '_')
+        environ[key] = f"{environ[key]},{value}" if key in environ and key.startswith('HTTP_') else value
+    return environ
+
+
+class WsgiBridge:
+    """
+    Запуск WSGI-приложения из ASGI: каждый запрос выполняется в своем потоке пула, поэтому медленный запрос
+    не задерживает остальные. Тело запроса читается по мере получения, ответ отправляется по частям.
+    """
+
+    def __init__(self, wsgi_app: Callable, threads: int = ASGI_WSGI_THREADS):
+        self.wsgi_app = wsgi_app
+        self._executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='asgi-wsgi')
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+        loop = asyncio.get_running_loop()
+        body = io.BufferedReader(_RequestBody(receive, loop))
+        await loop.run_in_executor(self._executor, self._run, _environ(scope, body), send, loop)
+
+    def _run(self, environ: Dict[str, Any], send: Callable, loop: asyncio.AbstractEventLoop) -> None:
+        # Выполняется в потоке пула; сообщения ответа отправляются через цикл событий
+        response: List[Any] = []
+        started = False
+
+        def send_message(message: Dict[str, Any]) -> None:
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        def start_response(status: str, headers: List[Tuple[str, str]], exc_info: Optional[tuple] = None) -> None:
+            if exc_info is not None and started:
+                raise exc_info[1].with_traceback(exc_info[2])
+            response[:] = [status, headers]
+
+        def start() -> None:
+            status, headers = response
+            send_message({'type': 'http.response.start', 'status': int(status.split(' ', 1)[0]),
+                          'headers': [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                                      for name, value in headers]})
+
+        chunks: Iterable[bytes] = self.wsgi_app(environ, start_response)
+        try:
+            for chunk in chunks:
+                if not started:
+                    start()
+                    started = True
+                if chunk:
+                    send_message({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            if not started:
+                start()
+            send_message({'type': 'http.response.body', 'body': b'', 'more_body': False})
+        finally:
+            if hasattr(chunks, 'close'):
+                chunks.close()
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False)
+
+
+wsgi_app = WsgiBridge(flask_app)
+
+
+def _last_event_id(scope: Dict[str, Any]) -> int:
+    # Как в app.stream_logs: заголовок Last-Event-ID или параметр last_event_id
+    headers = dict(scope.get('headers') or [])
+    value = headers.get(b'last-event-id', b'').decode('latin-1')
+    if not value:
+        value = parse_qs(scope.get('query_string', b'').decode('latin-1')).get('last_event_id', ['0'])[0]
+    return int(value) if value.isdigit() else 0
+
+
+async def stream_logs(scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+    session_id = scope['path'][len(STREAM_PREFIX):]
+    headers = [(b'content-type', b'text/event-stream; charset=utf-8')]
+    headers += [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in SSE_HEADERS.items()]
+
+    async def stream() -> None:
+        await send({'type': 'http.response.start', 'status': 200, 'headers': headers})
+        async for chunk in sse_events_async(session_id, get_sse_jobs(), _last_event_id(scope)):
+            await send({'type': 'http.response.body', 'body': chunk.encode('utf-8'), 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+
+    async def disconnected() -> None:
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    # Поток прерывается сразу после отключения клиента, не дожидаясь очередного heartbeat
+    tasks = {asyncio.ensure_future(stream()), asyncio.ensure_future(disconnected())}
+    done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    for task in pending:
+        task.cancel()
+    for task in done:
+        task.result()
+
+
+async def lifespan(receive: Callable, send: Callable) -> None:
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            wsgi_app.shutdown()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+    elif scope['type'] == 'http' and scope['path'].startswith(STREAM_PREFIX):
+        await stream_logs(scope, receive, send)
+    else:
+        await wsgi_app(scope, receive, send)
@@ -7,5 +7,134 @@
 
 YANDEX_DISK_API_KEY = "YOUR_YANDEX_DISK_API_KEY"
 
+# Адрес REST API Диска; для нагрузочных тестов без сети укажите адрес локальной заглушки modules/prcs_disk_stub.py
+YANDEX_DISK_API_URL = "https://cloud-api.yandex.net/v1/disk/resources"
 
+"""
+Параметры HTTP-клиента Яндекс Диска: размер пула keep-alive соединений, таймауты (подключение, чтение) в секундах
+и повторы запросов при сетевых ошибках и ответах 429/5xx с экспоненциальной задержкой
+"""
+
+YANDEX_DISK_POOL_SIZE = 10
+YANDEX_DISK_TIMEOUT = (5, 60)
+YANDEX_DISK_RETRIES = 3
+YANDEX_DISK_BACKOFF = 0.5
+
+# Время в секундах, в течение которого подтвержденное существование папки на Диске не перепроверяется
+YANDEX_DISK_FOLDER_CACHE_TTL = 600
+
+"""
+Хранилище index.json: "yandex" — Яндекс Диск, "local" — папка STORAGE_LOCAL_ROOT на локальном диске,
+"memory" — память процесса (для нагрузочных тестов и бенчмарков без сети)
+"""
+
+STORAGE_BACKEND = "yandex"
+STORAGE_LOCAL_ROOT = "/tmp/nmap_utils_storage"
+
+"""
+Сжатие index.json при загрузке (Content-Encoding: gzip). Яндекс Диск сохраняет тело запроса как есть, поэтому
+включайте только для хранилищ, которые распаковывают gzip сами (например, заглушка modules/prcs_disk_stub.py).
+Скачивание принимает gzip всегда: requests запрашивает его по умолчанию и распаковывает ответ потоково.
+"""
+
+YANDEX_DISK_GZIP_UPLOAD = False
+
+"""
+Пул обработки асинхронных задач (/upload-async и загрузки из НСПД): число одновременно выполняемых задач,
+максимальное число задач, ожидающих в очереди, и значение заголовка Retry-After в секундах для ответа 429,
+когда очередь заполнена
+"""
+
+JOB_WORKERS = 4
+JOB_QUEUE_SIZE = 50
+JOB_RETRY_AFTER = 10
+
+"""
+Число процессов для конвертации файлов. 0 — конвертация выполняется в потоке задачи; больше 0 — в пуле процессов,
+чтобы разбор GPX/KML и циклы по объектам не конкурировали за GIL и масштабировались по ядрам
+"""
+
+FILE_PROCESS_WORKERS = 0
+
+"""
+Параллельная конвертация файлов одной загрузки: общий пул потоков конвертации и предел одновременно
+конвертируемых файлов одной задачи, чтобы одна большая загрузка не занимала весь пул
+"""
+
+FILE_THREAD_WORKERS = 8
+SESSION_FILE_CONCURRENCY = 4
+
+"""
+Предельный размер файла в байтах, который /upload-async передает задаче в памяти, без записи во временный файл.
+Файлы больше предела и все файлы задач очереди SQLite (JOB_QUEUE_BACKEND = "sqlite") сохраняются в /tmp
+"""
+
+UPLOAD_MEMORY_LIMIT = 8 * 1024 * 1024
+
+"""
+Потоковый прием /upload-async: задача запускается до окончания загрузки, и каждый принятый файл сразу передается
+на конвертацию. Не используется с очередью SQLite, где файлы принимаются целиком до постановки задачи в очередь
+"""
+
+UPLOAD_STREAMING = True
+
+"""
+Реестр задач: время в секундах, через которое завершенная задача и ее лог удаляются из памяти, а также
+предельное число задач и записей лога в памяти, после которого в первую очередь удаляются самые старые
+завершенные задачи
+"""
+
+JOB_TTL = 3600
+JOB_REGISTRY_MAX_JOBS = 1000
+JOB_REGISTRY_MAX_RECORDS = 200000
+
+"""
+Лог задачи для SSE: число последних записей, которые хранятся для повторной отправки при переподключении
+(Last-Event-ID) и для нескольких вкладок, и интервал в секундах между heartbeat-комментариями в простаивающем
+соединении, чтобы прокси не закрывали его во время долгих задач
+"""
+
+JOB_EVENT_BUFFER_SIZE = 2000
+SSE_HEARTBEAT_INTERVAL = 15
+
+"""
+ASGI-режим (uvicorn asgi:app): число потоков, в которых параллельно выполняются запросы к Flask-приложению.
+Тело запроса передается Flask по частям по мере получения. SSE-соединения эти потоки не занимают
+"""
+
+ASGI_WSGI_THREADS = 32
+
+"""
+Очередь задач: "memory" — пул потоков процесса веб-приложения (JOB_WORKERS), "sqlite" — файл JOB_QUEUE_DB, который
+разбирают отдельные процессы worker.py. Задачи в SQLite переживают перезапуск веб-приложения и обработчиков: задача,
+аренду которой обработчик не продлевал JOB_LEASE_TIMEOUT секунд, возвращается в очередь, пока не сделано
+JOB_MAX_ATTEMPTS попыток. WORKER_POLL_INTERVAL — пауза в секундах между проверками пустой очереди
+"""
+
+JOB_QUEUE_BACKEND = "memory"
+JOB_QUEUE_DB = "/tmp/nmap_utils_jobs.sqlite3"
+JOB_LEASE_TIMEOUT = 300
+JOB_MAX_ATTEMPTS = 3
+WORKER_POLL_INTERVAL = 1
+
+"""
+Транспорт лога задач для SSE: "memory" — буфер в памяти процесса, "sqlite" — журнал в файле JOB_EVENT_DB, общий
+для процессов. Включайте "sqlite", когда веб-приложение запущено в нескольких процессах (gunicorn -w N) или задачи
+выполняет worker.py: SSE-запрос может попасть в процесс, который задачу не выполняет. При JOB_QUEUE_BACKEND = "sqlite"
+другое значение не допускается: приложение и worker.py не запустятся. JOB_EVENT_POLL_INTERVAL — период опроса
+журнала в секундах
+"""
+
+JOB_EVENT_BUS = "memory"
+JOB_EVENT_DB = "/tmp/nmap_utils_events.sqlite3"
+JOB_EVENT_POLL_INTERVAL = 0.2
+
+"""
+Кэш запросов к НСПД в файле NSPD_CACHE_DB: результат по слою и реестровому номеру хранится NSPD_CACHE_TTL секунд,
+в кэше не больше NSPD_CACHE_MAX_ENTRIES записей (вытесняются давно не запрашивавшиеся)
+"""
 
+NSPD_CACHE_ENABLED = True
+NSPD_CACHE_DB = "/tmp/nmap_utils_nspd_cache.sqlite3"
+NSPD_CACHE_TTL = 7 * 24 * 3600
+NSPD_CACHE_MAX_ENTRIES = 1000
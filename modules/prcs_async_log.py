@@ -1,71 +1,142 @@
-import os
+import asyncio
 import logging
 import json
-from datetime import datetime
+import sqlite3
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from contextvars import ContextVar, Token, copy_context
 from queue import Queue
-from typing import List, Tuple, Dict, Any, Callable, Generator
+from typing import List, Tuple, Dict, Any, AsyncGenerator, Callable, Generator, Optional, Union
 from flask import Response
-from modules.prcs_flow import create_nmap_output_template, merge_nmap_output_template, ProcessingError
-from modules.prcs_shp import process_zip
-from modules.prcs_geojson import process_geojson
-from modules.prcs_gpx import process_gpx
-from modules.prcs_kml import process_kml
-from modules.prcs_topojson import process_topojson
-from modules.prcs_wkt import process_wkt
-from modules.prcs_nspd_locality import process_nspd_locality
-from modules.prcs_nspd_border import process_nspd_border
-from modules.prcs_upload import (
-    download_index_json,
-    upload_index_json,
-    ensure_folder,
-    get_current_day_folder_path,
-    BASE_FOLDER_PATH
-)
+from modules.prcs_flow import create_nmap_output_template, merge_nmap_output_template, ProcessingError, \
+    report_job, report_file, is_cancelled, results_saved, mark_results_saved, Source
+from modules.prcs_formats import FILE_PROCESSORS, get_file_extension, process_file
+from modules.prcs_multipart import UploadFeed
+from modules.prcs_nspd_cache import get_nspd_cache
+from modules.prcs_nspd_locality import process_nspd_locality, NSPD_LAYER as NSPD_LOCALITY_LAYER
+from modules.prcs_nspd_border import process_nspd_border, NSPD_LAYER as NSPD_BORDER_LAYER
+from modules.prcs_storage import download_index_json_with_revision, update_index_json, ensure_folder
+from modules.prcs_upload import get_current_day_folder_path, BASE_FOLDER_PATH, TRANSFER_LOGGER_NAME
+from config import YANDEX_DISK_POOL_SIZE, FILE_THREAD_WORKERS, SESSION_FILE_CONCURRENCY, SSE_HEARTBEAT_INTERVAL, \
+    NSPD_CACHE_ENABLED
 
 logger = logging.getLogger(__name__)
 
+# Логгеры, сообщения которых попадают в лог задачи
+JOB_LOGGERS = (logger, logging.getLogger(TRANSFER_LOGGER_NAME))
+
 ALLOWED_EXTENSIONS = {'zip', 'geojson', 'gpx', 'kml', 'kmz', 'topojson', 'wkt'}
+# Период проверки отмены задачи, пока файлы конвертируются (секунды)
+CANCEL_POLL_INTERVAL = 0.5
+# Период проверки новых файлов потоковой загрузки, пока другие файлы конвертируются (секунды)
+FEED_POLL_INTERVAL = 0.05
+
+# Подготовка хранилища и скачивание index.json выполняются в фоне, пока задача парсит файлы
+_storage_executor = ThreadPoolExecutor(max_workers=YANDEX_DISK_POOL_SIZE, thread_name_prefix='storage-prepare')
+# index.json скачивается одновременно с проверкой папок: отдельный пул, чтобы подготовка не ждала саму себя
+_index_executor = ThreadPoolExecutor(max_workers=YANDEX_DISK_POOL_SIZE, thread_name_prefix='storage-index')
+
+# Файлы одной загрузки конвертируются параллельно, не более SESSION_FILE_CONCURRENCY одновременно на задачу
+_file_executor = ThreadPoolExecutor(max_workers=FILE_THREAD_WORKERS, thread_name_prefix='file-convert')
+
+
+# Идентификатор задачи, в лог которой попадают записи текущего потока или контекста
+_current_job: ContextVar[Optional[str]] = ContextVar('current_job', default=None)
+
+_time_cache: Tuple[int, str] = (-1, '')
 
-FILE_PROCESSORS: Dict[str, Tuple[Callable[[str], Dict[str, Any]], str]] = {
-    '.zip': (process_zip, 'Shapefile'),
-    '.geojson': (process_geojson, 'GeoJSON'),
-    '.gpx': (process_gpx, 'GPX'),
-    '.kml': (process_kml, 'KML/KMZ'),
-    '.kmz': (process_kml, 'KML/KMZ'),
-    '.topojson': (process_topojson, 'TopoJSON'),
-    '.wkt': (process_wkt, 'WKT'),
-}
 
+class JobLogDispatcher(logging.Handler):
+    """
+    Один обработчик на все задачи: запись доставляется только в лог задачи, указанной в _current_job, поэтому
+    параллельные задачи не получают сообщения друг друга, а стоимость записи не зависит от числа задач.
+    """
 
-class QueueHandler(logging.Handler):
+    def __init__(self):
+        super().__init__(logging.INFO)
+        self.setFormatter(logging.Formatter('%(message)s'))
+        self._logs: Dict[str, Any] = {}
 
-    def __init__(self, log_queue: Queue):
-        super().__init__()
-        self.log_queue = log_queue
+    def register(self, job_id: str, log_queue: Any) -> None:
+        self._logs[job_id] = log_queue
+
+    def unregister(self, job_id: str) -> None:
+        self._logs.pop(job_id, None)
 
     def emit(self, record: logging.LogRecord) -> None:
-        log_entry = {
-            'time': datetime.now().strftime('%H:%M:%S'),
-            'level': record.levelname.lower(),
-            'message': self.format(record)
-        }
-        self.log_queue.put(log_entry)
+        job_id = _current_job.get()
+        if job_id is None:
+            return
+        log_queue = self._logs.get(job_id)
+        if log_queue is not None:
+            log_queue.put(make_log_entry(record.levelname.lower(), self.format(record), created=record.created))
+
+
+def _format_time(created: float) -> str:
+    # Время записи форматируется не чаще раза в секунду
+    global _time_cache
+    second = int(created)
+    cached_second, formatted = _time_cache
+    if cached_second != second:
+        formatted = time.strftime('%H:%M:%S', time.localtime(second))
+        _time_cache = (second, formatted)
+    return formatted
+
+
+def make_log_entry(level: str, message: str, created: Optional[float] = None, **extra: Any) -> Dict[str, Any]:
+    log_entry = {
+        'time': _format_time(time.time() if created is None else created),
+        'level': level,
+        'message': message
+    }
+    log_entry.update(extra)
+    return log_entry
+
+
+_dispatcher = JobLogDispatcher()
+for _job_logger in JOB_LOGGERS:
+    _job_logger.addHandler(_dispatcher)
+
+
+def _submit_in_job_context(executor: ThreadPoolExecutor, fn: Callable[..., Any], *args: Any) -> Future:
+    # Потоки пулов не наследуют контекст, поэтому задача передает его явно, чтобы логи попадали в ее лог
+    return executor.submit(copy_context().run, fn, *args)
 
 
 def allowed_file(filename: str) -> bool:
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
-def _get_file_extension(filename: str) -> str:
-    return '.' + filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
+def _setup_logging(log_queue: Queue, session_id: str) -> Token:
+    _dispatcher.register(session_id, log_queue)
+    return _current_job.set(session_id)
+
+
+def _teardown_logging(token: Token) -> None:
+    _dispatcher.unregister(_current_job.get())
+    _current_job.reset(token)
+
+
+def _log_job_error(message: str) -> None:
+    # Ошибка, прервавшая задачу или сохранение, попадает и в лог, и в отчет задачи
+    logger.error(message)
+    report_job(error=message)
+
+
+def _upload_aborted(feed: UploadFeed) -> bool:
+    # Тело запроса принято не полностью: результаты неполной загрузки не сохраняются
+    if not feed.aborted:
+        return False
+    _log_job_error("Прием файлов прерван, результаты не сохраняются")
+    return True
 
 
-def _setup_logging(log_queue: Queue) -> QueueHandler:
-    queue_handler = QueueHandler(log_queue)
-    queue_handler.setLevel(logging.INFO)
-    queue_handler.setFormatter(logging.Formatter('%(message)s'))
-    logger.addHandler(queue_handler)
-    return queue_handler
+def _job_cancelled() -> bool:
+    # Отмененная задача не сохраняет результаты в хранилище
+    if not is_cancelled():
+        return False
+    logger.warning("✗ Задача отменена, результаты не сохраняются")
+    return True
 
 
 def _ensure_storage_folders() -> None:
@@ -78,201 +149,387 @@ def _ensure_storage_folders() -> None:
     logger.info("✓ Папка для текущей даты есть")
 
 
-def _load_current_index() -> Dict[str, Any]:
+def _load_current_index() -> Tuple[Optional[Dict[str, Any]], int]:
     logger.info("Загрузка текущего файла index.json")
-    current_index = download_index_json()
+    snapshot = download_index_json_with_revision()
 
-    if current_index is None:
-        current_index = create_nmap_output_template()
+    if snapshot[0] is None:
         logger.info("Создан новый файл index.json")
     else:
         logger.info("✓ Загружен")
 
-    return current_index
+    return snapshot
 
 
-def _process_single_file(temp_path: str, filename: str) -> Dict[str, Any]:
-    extension = _get_file_extension(filename)
+def _prepare_storage() -> Tuple[Optional[Dict[str, Any]], int]:
+    # Отсутствующая папка дня не мешает скачиванию: index.json в ней тогда тоже нет
+    index_future = _submit_in_job_context(_index_executor, _load_current_index)
+    try:
+        _ensure_storage_folders()
+    except ProcessingError:
+        wait([index_future])
+        _log_job_error("Добавьте свой OAuth-токен Яндекс.Диска в config.py")
+        raise
+
+    try:
+        return index_future.result()
+    except ProcessingError as e:
+        _log_job_error(f"Не удалось загрузить файл index.json: {e.message}")
+        raise
+
+
+def _start_storage_preparation() -> Future:
+    return _submit_in_job_context(_storage_executor, _prepare_storage)
+
+
+def _storage_failed(storage_future: Future) -> bool:
+    return storage_future.done() and storage_future.exception() is not None
+
+
+def _wait_storage(storage_future: Future) -> Optional[Tuple[Optional[Dict[str, Any]], int]]:
+    # Ошибка подготовки хранилища уже записана в лог задачи
+    try:
+        return storage_future.result()
+    except ProcessingError:
+        return None
+
+
+def _save_index(new_data: Dict[str, Any], snapshot: Tuple[Optional[Dict[str, Any]], int]) -> None:
+    if results_saved():
+        # Повтор задачи из очереди SQLite после сбоя обработчика: новые идентификаторы продублировали бы объекты
+        logger.info("✓ Результаты уже сохранены предыдущей попыткой")
+        return
+    logger.info("Загрузка результатов в Блокнот картографа")
+    attempts = update_index_json(new_data, snapshot)
+    mark_results_saved()
+    if attempts > 1:
+        logger.info(f"index.json изменен параллельно, данные объединены повторно (попыток: {attempts})")
+    logger.info("✓ Загружен")
+
+
+def _process_single_file(source: Source, filename: str) -> Dict[str, Any]:
+    extension = get_file_extension(filename)
 
     if extension not in FILE_PROCESSORS:
         raise ValueError(f"Неподдерживаемый тип файла: {extension}")
 
-    processor, format_name = FILE_PROCESSORS[extension]
-    logger.info(f"Парсинг и конвертация {format_name}")
+    _, format_name = FILE_PROCESSORS[extension]
+    logger.info(f"{filename}: парсинг и конвертация {format_name}")
 
-    return processor(temp_path)
+    return process_file(source, filename)
 
 
-def process_upload_async(log_queue: Queue, session_id: str, temp_files: List[Tuple[str, str]]) -> None:
-    queue_handler = _setup_logging(log_queue)
+def _convert_file(index: int, source: Source, filename: str) -> Optional[Dict[str, Any]]:
+    # Выполняется в пуле конвертации; None — файл пропущен, причина уже записана в лог и отчет задачи
+    logger.info(f"📄 Обработка: {filename}")
+    started = time.perf_counter()
+    reason = None
 
     try:
-        if not temp_files:
-            logger.error("Не выбраны файлы для загрузки")
-            return
+        result = _process_single_file(source, filename)
+        logger.info(f"✓ {filename} сконвертирован в index.json")
+        return result
+
+    except ProcessingError as e:
+        reason = e.message
+        logger.error(f"✗ {filename}: {e.message}")
+    except ValueError as e:
+        reason = str(e)
+        logger.error(f"✗ {filename}: {str(e)}")
+    except Exception as e:
+        reason = f"Неожиданная ошибка - {str(e)}"
+        logger.error(f"✗ {filename}: Неожиданная ошибка - {str(e)}")
+    finally:
+        report_file({
+            "index": index,
+            "name": filename,
+            "status": "skipped" if reason is not None else "processed",
+            "reason": reason,
+            "elapsed": round(time.perf_counter() - started, 3),
+        })
+    return None
+
+
+def _convert_files(feed: UploadFeed, storage_future: Future) -> Optional[List[Optional[Dict[str, Any]]]]:
+    """
+    Конвертирует файлы параллельно, держа в работе не больше SESSION_FILE_CONCURRENCY файлов задачи. Файлы
+    запускаются по мере поступления в feed, результаты возвращаются в порядке загрузки. Если подготовка хранилища
+    завершилась ошибкой или задача отменена, новые файлы не запускаются, их временные файлы удаляются, а функция
+    возвращает None после завершения уже запущенных. Временный файл удаляется сразу после конвертации, если
+    feed не оставляет файлы вызывающему.
+    """
+    results: Dict[int, Optional[Dict[str, Any]]] = {}
+    running: Dict[Future, Tuple[int, Source]] = {}
+    next_index = 0
+
+    while True:
+        arrived, closed = feed.wait(next_index, timeout=0)
+        if _storage_failed(storage_future) or is_cancelled() or feed.aborted:
+            feed.discard()
+            _remove_temp_files(feed, arrived)
+            next_index += len(arrived)
+            arrived, closed = [], True
+
+        for source, filename in arrived[:SESSION_FILE_CONCURRENCY - len(running)]:
+            future = _submit_in_job_context(_file_executor, _convert_file, next_index, source, filename)
+            running[future] = (next_index, source)
+            next_index += 1
+
+        if not running:
+            if closed and next_index >= len(feed):
+                break
+            # Ожидание следующего файла, который еще загружается
+            feed.wait(next_index, timeout=CANCEL_POLL_INTERVAL)
+            continue
+
+        waiting = set(running)
+        if not storage_future.done():
+            waiting.add(storage_future)
+        # Ожидание ограничено, чтобы отмена задачи освобождала временные файлы, не дожидаясь конвертации,
+        # а файлы, поступившие во время загрузки, запускались без задержки
+        timeout = CANCEL_POLL_INTERVAL if closed or len(running) >= SESSION_FILE_CONCURRENCY else FEED_POLL_INTERVAL
+        done, _ = wait(waiting, timeout=timeout, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future in running:
+                index, source = running.pop(future)
+                results[index] = future.result()
+                feed.remove(source)
+
+    if _storage_failed(storage_future) or is_cancelled() or feed.aborted:
+        return None
+    return [results[index] for index in range(next_index)]
+
+
+def _as_feed(temp_files: Union[UploadFeed, List[Tuple[Source, str]]]) -> UploadFeed:
+    # Файлы, принятые целиком до запуска задачи, — завершенный feed
+    if isinstance(temp_files, UploadFeed):
+        return temp_files
+    return UploadFeed.of(temp_files)
+
+
+def process_upload_async(log_queue: Queue, session_id: str,
+                         temp_files: Union[UploadFeed, List[Tuple[Source, str]]]) -> None:
+    """
+    temp_files — пары (источник, имя файла): содержимое небольших файлов в памяти или путь временного файла;
+    при потоковом приеме — UploadFeed, который пополняется, пока запрос еще загружается.
+    """
+    log_token = _setup_logging(log_queue, session_id)
+    feed = _as_feed(temp_files)
 
-        try:
-            _ensure_storage_folders()
-        except ProcessingError as e:
-            logger.error(f"Добавьте свой OAuth-токен Яндекс.Диска в config.py")
+    try:
+        if _upload_aborted(feed) or _job_cancelled():
+            feed.discard()
+            _remove_temp_files(feed, feed.wait(0, timeout=0)[0])
             return
-
-        try:
-            current_index = _load_current_index()
-        except ProcessingError as e:
-            logger.error(f"Не удалось загрузить файл index.json: {e.message}")
+        if feed.closed and not len(feed):
+            _log_job_error("Не выбраны файлы для загрузки")
             return
 
-        new_data = create_nmap_output_template()
-        logger.info(f"Обработка {len(temp_files)} файл(ов)")
-
-        processed_count = 0
-        skipped_count = 0
+        # index.json скачивается параллельно с парсингом и нужен только при итоговом объединении
+        storage_future = _start_storage_preparation()
 
-        for temp_path, filename in temp_files:
-            logger.info(f"📄 Обработка: {filename}")
+        if feed.closed:
+            logger.info(f"Обработка {len(feed)} файл(ов)")
+        else:
+            logger.info("Обработка файлов по мере загрузки")
+        results = _convert_files(feed, storage_future)
+        if _upload_aborted(feed) or _job_cancelled():
+            return
+        if results is None:
+            _wait_storage(storage_future)
+            return
+        if not results:
+            _log_job_error("Не выбраны файлы для загрузки")
+            return
 
-            try:
-                result = _process_single_file(temp_path, filename)
+        # Объединяем в порядке загрузки: при совпадении идентификаторов побеждает файл, загруженный позже
+        new_data = create_nmap_output_template()
+        for result in results:
+            if result is not None:
                 new_data = merge_nmap_output_template(new_data, result)
-                logger.info(f"✓ {filename} сконвертирован в index.json")
-                processed_count += 1
 
-            except ProcessingError as e:
-                logger.error(f"✗ {filename}: {e.message}")
-                skipped_count += 1
-            except ValueError as e:
-                logger.error(f"✗ {filename}: {str(e)}")
-                skipped_count += 1
-            except Exception as e:
-                logger.error(f"✗ {filename}: Неожиданная ошибка - {str(e)}")
-                skipped_count += 1
-            finally:
-                if os.path.exists(temp_path):
-                    os.remove(temp_path)
+        processed_count = sum(1 for result in results if result is not None)
+        skipped_count = len(results) - processed_count
+        report_job(processed=processed_count, skipped=skipped_count)
+
+        snapshot = _wait_storage(storage_future)
+        if snapshot is None or _job_cancelled():
+            return
 
         if processed_count > 0:
-            logger.info("Загрузка результатов в Блокнот картографа")
             try:
-                final_index = merge_nmap_output_template(current_index, new_data)
-                upload_index_json(final_index)
-                logger.info("✓ Загружен")
+                _save_index(new_data, snapshot)
             except ProcessingError as e:
-                logger.error(f"Ошибка сохранения: {e.message}")
+                _log_job_error(f"Ошибка сохранения: {e.message}")
 
         logger.info(f"Завершено: {processed_count} успешно, {skipped_count} пропущено")
 
     finally:
-        logger.removeHandler(queue_handler)
+        _teardown_logging(log_token)
         log_queue.put(None)
 
 
-def create_sse_stream(session_id: str, log_queues: Dict[str, Queue]) -> Response:
+def _remove_temp_files(feed: UploadFeed, temp_files: List[Tuple[Source, str]]) -> None:
+    # Временный файл удаляется, содержимое в памяти освобождается вместе со списком файлов задачи
+    for source, _ in temp_files:
+        feed.remove(source)
+
+
+SSE_END = "event: end\ndata: {}\n\n"
+SSE_HEARTBEAT = ": heartbeat\n\n"
+SSE_HEADERS = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+
+
+def _sse_chunk(events: List[Tuple[int, Dict[str, Any]]], closed: bool) -> str:
+    # Записи с id, затем событие end после последней записи или heartbeat, если записей нет
+    chunk = "".join(f"id: {event_id}\ndata: {json.dumps(log_entry)}\n\n" for event_id, log_entry in events)
+    if not events:
+        chunk = SSE_END if closed else SSE_HEARTBEAT
+    return chunk
+
+
+def create_sse_stream(session_id: str, registry: Any, last_event_id: int = 0) -> Response:
+    """
+    Поток SSE лога задачи. Каждая запись отправляется с id, поэтому браузер при переподключении передает
+    Last-Event-ID и получает только пропущенные записи. Пока новых записей нет, отправляется heartbeat-комментарий.
+    Завершение лога (или неизвестная задача) отмечается событием end.
+    """
     def generate() -> Generator[str, None, None]:
-        if session_id not in log_queues:
+        job = registry.get(session_id)
+        if job is None:
+            yield SSE_END
             return
 
-        log_queue = log_queues[session_id]
-
+        after = last_event_id
         while True:
-            log_entry = log_queue.get()
-
-            if log_entry is None:
-                if session_id in log_queues:
-                    del log_queues[session_id]
+            events, closed = job.log_queue.wait(after, timeout=SSE_HEARTBEAT_INTERVAL)
+            yield _sse_chunk(events, closed)
+            if events:
+                after = events[-1][0]
+            elif closed:
                 break
 
-            yield f"data: {json.dumps(log_entry)}\n\n"
+    return Response(generate(), mimetype='text/event-stream', headers=SSE_HEADERS)
+
+
+async def sse_events_async(session_id: str, registry: Any, last_event_id: int = 0) -> AsyncGenerator[str, None]:
+    """Тот же поток SSE для ASGI-режима: ожидание записей — корутина, а не заблокированный поток сервера"""
+    # Журнал SQLite читается запросом к файлу, поэтому поиск задачи не выполняется в цикле событий
+    job = await asyncio.to_thread(registry.get, session_id)
+    if job is None:
+        yield SSE_END
+        return
+
+    after = last_event_id
+    while True:
+        events, closed = await job.log_queue.wait_async(after, timeout=SSE_HEARTBEAT_INTERVAL)
+        yield _sse_chunk(events, closed)
+        if events:
+            after = events[-1][0]
+        elif closed:
+            break
+
+
+def _nspd_lookup(layer: str, registry_number: str, lookup: Callable[[str], Dict[str, Any]]) -> Dict[str, Any]:
+    # Результат НСПД берется из кэша; ошибка кэша не мешает запросу к НСПД
+    if not NSPD_CACHE_ENABLED:
+        return lookup(registry_number)
+    cache = get_nspd_cache()
+    try:
+        result = cache.get(layer, registry_number)
+    except sqlite3.Error as e:
+        logger.warning(f"Кэш НСПД недоступен: {e}")
+        return lookup(registry_number)
+    if result is not None:
+        logger.info(f"Кэш НСПД: {registry_number} найден, запрос к НСПД не нужен")
+        return result
+
+    logger.info(f"Кэш НСПД: {registry_number} не найден, запрос к НСПД")
+    result = lookup(registry_number)
+    try:
+        cache.put(layer, registry_number, result)
+    except sqlite3.Error as e:
+        logger.warning(f"Не удалось сохранить {registry_number} в кэш НСПД: {e}")
+    return result
 
-    return Response(generate(), mimetype='text/event-stream')
 
 def process_nspd_async(log_queue: Queue, session_id: str, registry_number: str) -> None:
-    queue_handler = _setup_logging(log_queue)
+    log_token = _setup_logging(log_queue, session_id)
 
     try:
         if not registry_number:
-            logger.error("Не указан реестровый номер")
+            _log_job_error("Не указан реестровый номер")
             return
-
-        try:
-            _ensure_storage_folders()
-        except ProcessingError as e:
-            logger.error(f"Добавьте свой OAuth-токен Яндекс.Диска в config.py")
+        if _job_cancelled():
             return
 
-        try:
-            current_index = _load_current_index()
-        except ProcessingError as e:
-            logger.error(f"Не удалось загрузить файл index.json: {e.message}")
-            return
+        # index.json скачивается параллельно с запросом к НСПД
+        storage_future = _start_storage_preparation()
 
         new_data = create_nmap_output_template()
         logger.info(f"Обработка реестрового номера: {registry_number}")
 
         try:
-            result = process_nspd_locality(registry_number)
+            result = _nspd_lookup(NSPD_LOCALITY_LAYER, registry_number, process_nspd_locality)
             new_data = merge_nmap_output_template(new_data, result)
             logger.info(f"✓ Данные для {registry_number} получены и сконвертированы")
-            
-            logger.info("Загрузка результатов в Блокнот картографа")
+            report_job(processed=1)
+
+            snapshot = _wait_storage(storage_future)
+            if snapshot is None or _job_cancelled():
+                return
+
             try:
-                final_index = merge_nmap_output_template(current_index, new_data)
-                upload_index_json(final_index)
-                logger.info("✓ Загружен")
+                _save_index(new_data, snapshot)
             except ProcessingError as e:
-                logger.error(f"Ошибка сохранения: {e.message}")
+                _log_job_error(f"Ошибка сохранения: {e.message}")
 
         except ProcessingError as e:
-            logger.error(f"✗ Ошибка: {e.message}")
+            _log_job_error(f"✗ Ошибка: {e.message}")
         except Exception as e:
-            logger.error(f"✗ Неожиданная ошибка: {str(e)}")
+            _log_job_error(f"✗ Неожиданная ошибка: {str(e)}")
 
     finally:
-        logger.removeHandler(queue_handler)
+        _teardown_logging(log_token)
         log_queue.put(None)
 
 
 def process_nspd_border_async(log_queue: Queue, session_id: str, registry_number: str) -> None:
-    queue_handler = _setup_logging(log_queue)
+    log_token = _setup_logging(log_queue, session_id)
 
     try:
         if not registry_number:
-            logger.error("Не указан реестровый номер")
+            _log_job_error("Не указан реестровый номер")
             return
-
-        try:
-            _ensure_storage_folders()
-        except ProcessingError as e:
-            logger.error(f"Добавьте свой OAuth-токен Яндекс.Диска в config.py")
+        if _job_cancelled():
             return
 
-        try:
-            current_index = _load_current_index()
-        except ProcessingError as e:
-            logger.error(f"Не удалось загрузить файл index.json: {e.message}")
-            return
+        # index.json скачивается параллельно с запросом к НСПД
+        storage_future = _start_storage_preparation()
 
         new_data = create_nmap_output_template()
         logger.info(f"Обработка муниципального образования: {registry_number}")
 
         try:
-            result = process_nspd_border(registry_number)
+            result = _nspd_lookup(NSPD_BORDER_LAYER, registry_number, process_nspd_border)
             new_data = merge_nmap_output_template(new_data, result)
             logger.info(f"✓ Данные МО для {registry_number} получены и сконвертированы")
-            
-            logger.info("Загрузка результатов в Блокнот картографа")
+            report_job(processed=1)
+
+            snapshot = _wait_storage(storage_future)
+            if snapshot is None or _job_cancelled():
+                return
+
             try:
-                final_index = merge_nmap_output_template(current_index, new_data)
-                upload_index_json(final_index)
-                logger.info("✓ Загружен")
+                _save_index(new_data, snapshot)
             except ProcessingError as e:
-                logger.error(f"Ошибка сохранения: {e.message}")
+                _log_job_error(f"Ошибка сохранения: {e.message}")
 
         except ProcessingError as e:
-            logger.error(f"✗ Ошибка: {e.message}")
+            _log_job_error(f"✗ Ошибка: {e.message}")
         except Exception as e:
-            logger.error(f"✗ Неожиданная ошибка: {str(e)}")
+            _log_job_error(f"✗ Неожиданная ошибка: {str(e)}")
 
     finally:
-        logger.removeHandler(queue_handler)
+        _teardown_logging(log_token)
         log_queue.put(None)
@@ -0,0 +1,376 @@
+"""
+Локальная заглушка REST API Яндекс Диска для нагрузочных тестов и бенчмарков без сети. Реализует подмножество API,
+которое использует prcs_upload: GET/PUT ресурса, выдачу ссылок /download и /upload и сами ссылки. Поддерживает
+задержку ответа, ограничение пропускной способности, внедрение ответов 409/429/5xx и учет запросов. Ссылки
+на скачивание отдают gzip при Accept-Encoding: gzip, ссылки на загрузку принимают Content-Encoding: gzip.
+
+Запуск: python -m modules.prcs_disk_stub --port 8765 --latency 0.05 --fault 429=0.05 --fault 503=0.01
+и YANDEX_DISK_API_URL = "http://127.0.0.1:8765/v1/disk/resources" в config.py
+"""
+import argparse
+import gzip
+import json
+import logging
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Dict, Any, Optional, Tuple
+from urllib.parse import urlsplit, parse_qs
+
+logger = logging.getLogger(__name__)
+
+
+API_PREFIX = "/v1/disk/resources"
+HREF_PREFIX = "/hrefs/"
+CONTROL_ROUTES = ("_stats", "_reset")
+
+# Ссылка одноразовая; неиспользованные ссылки удаляются через HREF_TTL секунд, чтобы не копились при долгой нагрузке
+HREF_TTL = 600
+
+# Папки, которые на настоящем Диске есть всегда
+DEFAULT_FOLDERS = ("", "Приложения")
+
+
+def normalize_path(path: str) -> str:
+    if path.startswith("disk:"):
+        path = path[len("disk:"):]
+    return path.strip("/")
+
+
+def parent_path(path: str) -> str:
+    return path.rsplit("/", 1)[0] if "/" in path else ""
+
+
+class DiskStubState:
+    """Содержимое заглушки и счетчики запросов; все изменения под одной блокировкой"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.folders = set(DEFAULT_FOLDERS)
+        self.files: Dict[str, Tuple[bytes, int]] = {}
+        self.hrefs: Dict[str, Tuple[str, str, float]] = {}
+        self.revision = 0
+        self.requests = Counter()
+        self.statuses = Counter()
+        self.faults = Counter()
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def next_revision(self) -> int:
+        # Ревизии Диска монотонно растут
+        self.revision = max(self.revision + 1, time.time_ns() // 1000)
+        return self.revision
+
+    def issue_href(self, method: str, path: str) -> str:
+        now = time.monotonic()
+        for expired in [token for token, (_, _, issued) in self.hrefs.items() if now - issued > HREF_TTL]:
+            del self.hrefs[expired]
+        token = uuid.uuid4().hex
+        self.hrefs[token] = (method, path, now)
+        return token
+
+    def take_href(self, token: str) -> Tuple[Optional[str], Optional[str]]:
+        method, path, _ = self.hrefs.pop(token, (None, None, None))
+        return method, path
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                "requests": dict(self.requests),
+                "statuses": {str(status): count for status, count in self.statuses.items()},
+                "faults": {str(status): count for status, count in self.faults.items()},
+                "total_requests": sum(self.requests.values()),
+                "bytes_in": self.bytes_in,
+                "bytes_out": self.bytes_out,
+                "files": len(self.files),
+                "folders": len(self.folders),
+            }
+
+    def reset_stats(self) -> None:
+        with self.lock:
+            self.requests.clear()
+            self.statuses.clear()
+            self.faults.clear()
+            self.bytes_in = 0
+            self.bytes_out = 0
+
+
+class DiskStubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Заголовки и тело пишутся отдельно; без TCP_NODELAY keep-alive запросы ждут отложенный ACK
+    disable_nagle_algorithm = True
+    server: "DiskStubHTTPServer"
+
+    def log_message(self, format: str, *args) -> None:
+        logger.debug(format % args)
+
+    @property
+    def state(self) -> DiskStubState:
+        return self.server.state
+
+    def _route(self) -> str:
+        path = urlsplit(self.path).path
+        if path.startswith(HREF_PREFIX):
+            return "href"
+        if path.startswith(API_PREFIX):
+            return path[len(API_PREFIX):].strip("/") or "resource"
+        return path.strip("/")
+
+    def _query(self) -> Dict[str, str]:
+        return {key: values[0] for key, values in parse_qs(urlsplit(self.path).query).items()}
+
+    def _throttle(self, size: int) -> None:
+        if self.server.bandwidth:
+            time.sleep(size / self.server.bandwidth)
+
+    def _read_body(self) -> bytes:
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        self._throttle(len(body))
+        with self.state.lock:
+            self.state.bytes_in += len(body)
+        return body
+
+    def _send(self, status: int, body: bytes = b"", content_type: str = "application/json",
+              headers: Optional[Dict[str, str]] = None) -> None:
+        self._throttle(len(body))
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+        if self._route() not in CONTROL_ROUTES:
+            with self.state.lock:
+                self.state.statuses[status] += 1
+                self.state.bytes_out += len(body)
+
+    def _send_json(self, status: int, payload: Dict[str, Any], headers: Optional[Dict[str, str]] = None) -> None:
+        self._send(status, json.dumps(payload, ensure_ascii=False).encode("utf-8"), headers=headers)
+
+    def _send_error(self, status: int, error: str) -> None:
+        self._send_json(status, {"error": error, "message": error, "description": error})
+
+    def _href(self, token: str) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}{HREF_PREFIX}{token}"
+
+    def _inject_fault(self) -> bool:
+        for status, probability in self.server.faults.items():
+            if random.random() < probability:
+                with self.state.lock:
+                    self.state.faults[status] += 1
+                headers = {"Retry-After": str(self.server.retry_after)} if status == 429 else None
+                self._read_body()
+                self._send_json(status, {"error": "InjectedFault", "message": f"Injected {status}"}, headers=headers)
+                return True
+        return False
+
+    def _handle(self, method: str) -> None:
+        route = self._route()
+        # Служебные маршруты заглушки не учитываются и не замедляются
+        if route not in CONTROL_ROUTES:
+            with self.state.lock:
+                self.state.requests[f"{method} {route}"] += 1
+            if self.server.latency:
+                time.sleep(self.server.latency)
+            if self._inject_fault():
+                return
+
+        handler = getattr(self, f"_{method.lower()}_{route.replace('/', '_')}", None)
+        if handler is None:
+            self._read_body()
+            self._send_error(404, "NotFound")
+            return
+        handler()
+
+    def do_GET(self) -> None:
+        self._handle("GET")
+
+    def do_PUT(self) -> None:
+        self._handle("PUT")
+
+    def do_POST(self) -> None:
+        self._handle("POST")
+
+    def _get_resource(self) -> None:
+        path = normalize_path(self._query().get("path", ""))
+        with self.state.lock:
+            if path in self.state.files:
+                content, revision = self.state.files[path]
+                payload = {"type": "file", "path": f"disk:/{path}", "size": len(content), "revision": revision}
+            elif path in self.state.folders:
+                payload = {"type": "dir", "path": f"disk:/{path}", "revision": self.state.revision}
+            else:
+                payload = None
+        if payload is None:
+            self._send_error(404, "DiskNotFoundError")
+        else:
+            self._send_json(200, payload)
+
+    def _put_resource(self) -> None:
+        path = normalize_path(self._query().get("path", ""))
+        with self.state.lock:
+            if parent_path(path) not in self.state.folders:
+                status, error = 409, "DiskPathDoesntExistsError"
+            elif path in self.state.folders or path in self.state.files:
+                status, error = 409, "DiskPathPointsToExistentDirectoryError"
+            else:
+                self.state.folders.add(path)
+                self.state.next_revision()
+                status, error = 201, None
+        if error:
+            self._send_error(status, error)
+        else:
+            self._send_json(201, {"href": f"{API_PREFIX}?path=disk:/{path}", "method": "GET"})
+
+    def _get_download(self) -> None:
+        path = normalize_path(self._query().get("path", ""))
+        with self.state.lock:
+            token = self.state.issue_href("GET", path) if path in self.state.files else None
+        if token is None:
+            self._send_error(404, "DiskNotFoundError")
+        else:
+            self._send_json(200, {"href": self._href(token), "method": "GET", "templated": False})
+
+    def _get_upload(self) -> None:
+        query = self._query()
+        path = normalize_path(query.get("path", ""))
+        overwrite = query.get("overwrite", "false").lower() == "true"
+        with self.state.lock:
+            if parent_path(path) not in self.state.folders:
+                token, error = None, "DiskPathDoesntExistsError"
+            elif path in self.state.files and not overwrite:
+                token, error = None, "DiskResourceAlreadyExistsError"
+            else:
+                token, error = self.state.issue_href("PUT", path), None
+        if error:
+            self._send_error(409, error)
+        else:
+            self._send_json(200, {"href": self._href(token), "method": "PUT", "templated": False})
+
+    def _get_href(self) -> None:
+        token = urlsplit(self.path).path[len(HREF_PREFIX):]
+        with self.state.lock:
+            method, path = self.state.take_href(token)
+            content = self.state.files[path][0] if method == "GET" and path in self.state.files else None
+        if content is None:
+            self._send(404)
+        elif "gzip" in self.headers.get("Accept-Encoding", ""):
+            self._send(200, gzip.compress(content, compresslevel=5), content_type="application/octet-stream",
+                       headers={"Content-Encoding": "gzip"})
+        else:
+            self._send(200, content, content_type="application/octet-stream")
+
+    def _put_href(self) -> None:
+        token = urlsplit(self.path).path[len(HREF_PREFIX):]
+        body = self._read_body()
+        if self.headers.get("Content-Encoding") == "gzip":
+            try:
+                body = gzip.decompress(body)
+            except (OSError, EOFError):
+                self._send_error(400, "BadRequest")
+                return
+        with self.state.lock:
+            method, path = self.state.take_href(token)
+            if method == "PUT":
+                self.state.files[path] = (body, self.state.next_revision())
+        self._send(201 if method == "PUT" else 404)
+
+    def _get__stats(self) -> None:
+        self._send_json(200, self.state.stats())
+
+    def _post__reset(self) -> None:
+        self._read_body()
+        self.state.reset_stats()
+        self._send(204)
+
+
+class DiskStubHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], latency: float = 0.0, bandwidth: Optional[float] = None,
+                 faults: Optional[Dict[int, float]] = None, retry_after: int = 0):
+        super().__init__(address, DiskStubHandler)
+        self.state = DiskStubState()
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.faults = faults or {}
+        self.retry_after = retry_after
+
+
+class DiskStubServer:
+    """
+    Заглушка в фоновом потоке: DiskStubServer(latency=0.02, faults={429: 0.1}).start(), затем api_base_url
+    подставляется вместо адреса API Диска. bandwidth — байт в секунду для тел запросов и ответов.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0,
+                 bandwidth: Optional[float] = None, faults: Optional[Dict[int, float]] = None, retry_after: int = 0):
+        self.httpd = DiskStubHTTPServer((host, port), latency=latency, bandwidth=bandwidth, faults=faults,
+                                        retry_after=retry_after)
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def state(self) -> DiskStubState:
+        return self.httpd.state
+
+    @property
+    def api_base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}{API_PREFIX}"
+
+    def start(self) -> "DiskStubServer":
+        self._thread = threading.Thread(target=self.httpd.serve_forever, kwargs={"poll_interval": 0.05},
+                                        name="disk-stub", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self) -> "DiskStubServer":
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+
+def _parse_fault(value: str) -> Tuple[int, float]:
+    status, probability = value.split("=", 1)
+    return int(status), float(probability)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Локальная заглушка REST API Яндекс Диска")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="задержка каждого ответа, секунд")
+    parser.add_argument("--bandwidth", type=float, default=None, help="пропускная способность, байт в секунду")
+    parser.add_argument("--fault", type=_parse_fault, action="append", default=[],
+                        help="внедрение ошибок вида STATUS=PROBABILITY, например 429=0.05")
+    parser.add_argument("--retry-after", type=int, default=0, help="значение Retry-After для ответов 429")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    httpd = DiskStubHTTPServer((args.host, args.port), latency=args.latency, bandwidth=args.bandwidth,
+                               faults=dict(args.fault), retry_after=args.retry_after)
+    logger.info(f"Disk stub listening on http://{args.host}:{args.port}{API_PREFIX}")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        logger.info(json.dumps(httpd.state.stats(), ensure_ascii=False))
+        httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+"""
+Журнал логов задач в SQLite для JOB_EVENT_BUS = "sqlite". Записи задачи дописываются в общий файл с
+последовательными номерами, поэтому SSE-поток может обслуживать любой процесс веб-приложения (gunicorn -w N),
+а задачу — процесс worker.py. Журнал задачи удаляется через JOB_TTL секунд после завершения.
+"""
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import weakref
+from typing import Any, Dict, List, Optional, Tuple
+from config import JOB_EVENT_DB, JOB_EVENT_POLL_INTERVAL, JOB_TTL
+
+logger = logging.getLogger(__name__)
+
+# Предел числа параметров одного запроса SQLite в старых сборках
+_HEADS_BATCH = 500
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS streams (
+    job_id TEXT PRIMARY KEY,
+    created REAL NOT NULL,
+    closed REAL
+);
+CREATE TABLE IF NOT EXISTS events (
+    job_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    entry TEXT NOT NULL,
+    PRIMARY KEY (job_id, seq)
+);
+CREATE INDEX IF NOT EXISTS streams_closed ON streams (closed);
+"""
+
+
+class SQLiteEventBuffer:
+    """
+    Лог одной задачи в журнале SQLite с интерфейсом EventBuffer: put() дописывает запись (None завершает лог),
+    wait() опрашивает журнал, пока не появятся записи новее after.
+    """
+
+    def __init__(self, event_log: 'SQLiteEventLog', job_id: str):
+        self.event_log = event_log
+        self.job_id = job_id
+
+    def __len__(self) -> int:
+        # Записи хранятся на диске и не учитываются в пределе памяти реестра задач
+        return 0
+
+    @property
+    def closed(self) -> bool:
+        return self.event_log.read(self.job_id, after=0, limit=0)[1]
+
+    def put(self, entry: Optional[Dict[str, Any]]) -> None:
+        if entry is None:
+            self.event_log.close(self.job_id)
+        else:
+            self.event_log.append(self.job_id, entry)
+
+    def wait(self, after: int, timeout: Optional[float] = None) -> Tuple[List[Tuple[int, Dict[str, Any]]], bool]:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            events, closed = self.event_log.read(self.job_id, after)
+            if events or closed:
+                return events, closed
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return [], False
+            time.sleep(self.event_log.poll_interval if remaining is None
+                       else min(self.event_log.poll_interval, remaining))
+
+    async def wait_async(self, after: int,
+                         timeout: Optional[float] = None) -> Tuple[List[Tuple[int, Dict[str, Any]]], bool]:
+        # Журнал читается в пуле потоков; пока новых записей нет, корутина ждет общего опроса журнала
+        events, closed = await asyncio.to_thread(self.event_log.read, self.job_id, after)
+        if events or closed:
+            return events, closed
+        poller = self.event_log.async_poller()
+        future = poller.wait(self.job_id, after)
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            return [], False
+        finally:
+            poller.discard(self.job_id, after, future)
+        return await asyncio.to_thread(self.event_log.read, self.job_id, after)
+
+
+class _AsyncPoller:
+    """
+    Общий опрос журнала для SSE-корутин одного цикла событий: раз в poll_interval один запрос проверяет все
+    ожидаемые логи и будит корутины, для которых появились записи или лог завершен. Пока ожидающих нет,
+    журнал не опрашивается.
+    """
+
+    def __init__(self, event_log: 'SQLiteEventLog', loop: asyncio.AbstractEventLoop):
+        self.event_log = event_log
+        self.loop = loop
+        self._waiters: Dict[str, List[Tuple[int, asyncio.Future]]] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def wait(self, job_id: str, after: int) -> asyncio.Future:
+        future = self.loop.create_future()
+        self._waiters.setdefault(job_id, []).append((after, future))
+        if self._task is None or self._task.done():
+            self._task = self.loop.create_task(self._run())
+        return future
+
+    def discard(self, job_id: str, after: int, future: asyncio.Future) -> None:
+        waiters = self._waiters.get(job_id, [])
+        if (after, future) in waiters:
+            waiters.remove((after, future))
+        if not waiters:
+            self._waiters.pop(job_id, None)
+
+    async def _run(self) -> None:
+        while self._waiters:
+            await asyncio.sleep(self.event_log.poll_interval)
+            job_ids = list(self._waiters)
+            try:
+                heads = await asyncio.to_thread(self.event_log.heads, job_ids)
+            except sqlite3.Error as e:
+                logger.warning(f"Журнал логов задач недоступен: {e}")
+                continue
+            for job_id in job_ids:
+                last_seq, closed = heads.get(job_id, (0, True))
+                for after, future in self._waiters.get(job_id, []):
+                    if (last_seq > after or closed) and not future.done():
+                        future.set_result(None)
+
+
+class SQLiteEventLog:
+    """
+    Файл журнала, общий для процессов одной машины. Соединения открываются по одному на поток, номер записи
+    вычисляется в том же операторе INSERT, поэтому параллельные записи одной задачи не получают одинаковых номеров.
+    """
+
+    def __init__(self, path: str = JOB_EVENT_DB, poll_interval: float = JOB_EVENT_POLL_INTERVAL,
+                 ttl: float = JOB_TTL):
+        self.path = path
+        self.poll_interval = poll_interval
+        self.ttl = ttl
+        self._local = threading.local()
+        self._pollers: 'weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, _AsyncPoller]' = \
+            weakref.WeakKeyDictionary()
+        self._pollers_lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        connection = self._connection()
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.executescript(_SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            self._local.connection = connection
+        return connection
+
+    def open(self, job_id: str) -> SQLiteEventBuffer:
+        """Регистрирует лог задачи (повторная регистрация не сбрасывает записи) и удаляет устаревшие логи"""
+        connection = self._connection()
+        connection.execute("INSERT OR IGNORE INTO streams (job_id, created) VALUES (?, ?)", (job_id, time.time()))
+        self.purge()
+        return SQLiteEventBuffer(self, job_id)
+
+    def get(self, job_id: str) -> Optional['EventLogJob']:
+        # Интерфейс реестра задач для create_sse_stream
+        row = self._connection().execute("SELECT 1 FROM streams WHERE job_id = ?", (job_id,)).fetchone()
+        return EventLogJob(job_id, SQLiteEventBuffer(self, job_id)) if row is not None else None
+
+    def append(self, job_id: str, entry: Dict[str, Any]) -> None:
+        self._connection().execute(
+            "INSERT INTO events (job_id, seq, entry) "
+            "VALUES (?, (SELECT COALESCE(MAX(seq), 0) + 1 FROM events WHERE job_id = ?), ?)",
+            (job_id, job_id, json.dumps(entry)))
+
+    def close(self, job_id: str) -> None:
+        self._connection().execute("UPDATE streams SET closed = ? WHERE job_id = ? AND closed IS NULL",
+                                   (time.time(), job_id))
+
+    def read(self, job_id: str, after: int, limit: int = 1000) -> Tuple[List[Tuple[int, Dict[str, Any]]], bool]:
+        """Записи с номерами больше after (не больше limit) и признак завершения лога"""
+        connection = self._connection()
+        # Признак читается до записей: записи, добавленные перед завершением, не теряются
+        row = connection.execute("SELECT closed FROM streams WHERE job_id = ?", (job_id,)).fetchone()
+        closed = row is None or row[0] is not None
+        if limit <= 0:
+            return [], closed
+        rows = connection.execute("SELECT seq, entry FROM events WHERE job_id = ? AND seq > ? ORDER BY seq LIMIT ?",
+                                  (job_id, after, limit)).fetchall()
+        events = [(seq, json.loads(entry)) for seq, entry in rows]
+        return events, closed and len(events) < limit
+
+    def heads(self, job_ids: List[str]) -> Dict[str, Tuple[int, bool]]:
+        """Номер последней записи и признак завершения для каждого известного лога из job_ids"""
+        connection = self._connection()
+        heads = {}
+        for start in range(0, len(job_ids), _HEADS_BATCH):
+            batch = job_ids[start:start + _HEADS_BATCH]
+            rows = connection.execute(
+                "SELECT job_id, closed IS NOT NULL, "
+                "(SELECT COALESCE(MAX(seq), 0) FROM events WHERE events.job_id = streams.job_id) "
+                f"FROM streams WHERE job_id IN ({', '.join('?' * len(batch))})", batch).fetchall()
+            heads.update({job_id: (last_seq, bool(closed)) for job_id, closed, last_seq in rows})
+        return heads
+
+    def async_poller(self) -> _AsyncPoller:
+        """Общий опрос журнала для корутин текущего цикла событий"""
+        loop = asyncio.get_running_loop()
+        with self._pollers_lock:
+            poller = self._pollers.get(loop)
+            if poller is None:
+                poller = self._pollers[loop] = _AsyncPoller(self, loop)
+            return poller
+
+    def purge(self) -> int:
+        """Удаляет логи задач, завершенных раньше чем ttl секунд назад; возвращает число удаленных логов"""
+        connection = self._connection()
+        expired = [row[0] for row in connection.execute("SELECT job_id FROM streams WHERE closed < ?",
+                                                        (time.time() - self.ttl,))]
+        for job_id in expired:
+            connection.execute("BEGIN IMMEDIATE")
+            connection.execute("DELETE FROM events WHERE job_id = ?", (job_id,))
+            connection.execute("DELETE FROM streams WHERE job_id = ?", (job_id,))
+            connection.execute("COMMIT")
+        return len(expired)
+
+
+class EventLogJob:
+
+    def __init__(self, job_id: str, log_queue: SQLiteEventBuffer):
+        self.id = job_id
+        self.log_queue = log_queue
+
+
+_event_log: Optional[SQLiteEventLog] = None
+_event_log_lock = threading.Lock()
+
+
+def get_event_log() -> SQLiteEventLog:
+    global _event_log
+    if _event_log is None:
+        with _event_log_lock:
+            if _event_log is None:
+                _event_log = SQLiteEventLog()
+    return _event_log
+
+
+def set_event_log(event_log: Optional[SQLiteEventLog]) -> None:
+    global _event_log
+    with _event_log_lock:
+        _event_log = event_log
@@ -1,14 +1,37 @@
-from typing import Dict, Any, Optional
+import io
+import os
+import threading
+from contextvars import ContextVar
+from typing import Dict, Any, BinaryIO, Callable, Optional, Union
 
 ERR_JSON_PARSE = "ERR_JSON_PARSE"
 ERR_STRUCT_INVALID = "ERR_STRUCT_INVALID"
 ERR_LOGIC = "ERR_LOGIC"
 ERR_NETWORK = "ERR_NETWORK"
 ERR_SHAPEFILE = "ERR_SHAPEFILE"
+ERR_CONFLICT = "ERR_CONFLICT"
+ERR_BUSY = "ERR_BUSY"
+ERR_CANCELLED = "ERR_CANCELLED"
 
 KEY_PATHS = "paths"
 KEY_POINTS = "points"
 
+# Источник данных конвертера: путь к файлу, содержимое файла в памяти или открытый двоичный файл
+Source = Union[str, bytes, BinaryIO]
+
+# Ревизия отсутствующего index.json: ревизии хранилищ всегда положительные
+REVISION_ABSENT = 0
+
+# Отчет выполняемой задачи (результаты по файлам, счетчики, ошибка), который отдает GET /jobs/<id>
+current_job_report: ContextVar[Optional[Dict[str, Any]]] = ContextVar('current_job_report', default=None)
+
+# Токен отмены выполняемой задачи, устанавливается через DELETE /jobs/<id>
+current_job_cancel: ContextVar[Optional[threading.Event]] = ContextVar('current_job_cancel', default=None)
+
+# Вызывается после сохранения результатов задачи: обработчик очереди SQLite записывает отметку в очередь,
+# чтобы повтор задачи после сбоя обработчика не сохранял результаты второй раз
+current_job_saved: ContextVar[Optional[Callable[[], None]]] = ContextVar('current_job_saved', default=None)
+
 
 class ProcessingError(Exception):
     def __init__(self, code: str, message: str, details: Optional[str] = None):
@@ -18,6 +41,22 @@ class ProcessingError(Exception):
         super().__init__(self.message)
 
 
+class IndexConflictError(ProcessingError):
+    def __init__(self, message: str):
+        super().__init__(ERR_CONFLICT, message)
+
+
+class JobQueueFullError(ProcessingError):
+    def __init__(self, retry_after: int):
+        self.retry_after = retry_after
+        super().__init__(ERR_BUSY, f"Job queue is full, retry in {retry_after} s")
+
+
+class JobCancelledError(ProcessingError):
+    def __init__(self):
+        super().__init__(ERR_CANCELLED, "Задача отменена")
+
+
 def validate_shp(data: Dict[str, Any]) -> bool:
     if not isinstance(data, dict):
         return False
@@ -50,3 +89,66 @@ def merge_nmap_output_template(current_index: Dict[str, Any], new_data: Dict[str
 
 def create_nmap_output_template() -> Dict[str, Any]:
     return {KEY_PATHS: {}, KEY_POINTS: {}}
+
+
+def report_job(**fields: Any) -> None:
+    report = current_job_report.get()
+    if report is not None:
+        report.update(fields)
+
+
+def report_file(outcome: Dict[str, Any]) -> None:
+    report = current_job_report.get()
+    if report is not None:
+        report["files"].append(outcome)
+
+
+def results_saved() -> bool:
+    """Результаты задачи уже сохранены, например предыдущей попыткой задачи из очереди SQLite"""
+    report = current_job_report.get()
+    return report is not None and bool(report.get("saved"))
+
+
+def mark_results_saved() -> None:
+    report_job(saved=True)
+    on_saved = current_job_saved.get()
+    if on_saved is not None:
+        on_saved()
+
+
+def is_cancelled() -> bool:
+    cancel = current_job_cancel.get()
+    return cancel is not None and cancel.is_set()
+
+
+def check_cancelled() -> None:
+    """Вызывается конвертерами между объектами: прерывает отмененную задачу"""
+    if is_cancelled():
+        raise JobCancelledError()
+
+
+def source_name(source: Source, filename: Optional[str] = None) -> str:
+    """Имя файла для описаний объектов: filename, если передано, иначе имя файла пути"""
+    if filename:
+        return os.path.basename(filename)
+    return os.path.basename(source) if isinstance(source, str) else ""
+
+
+def open_source(source: Source) -> Union[str, BinaryIO]:
+    """Путь возвращается как есть, содержимое в памяти — как BytesIO, открытый файл — с начала"""
+    if isinstance(source, str):
+        return source
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return io.BytesIO(source)
+    if source.seekable():
+        source.seek(0)
+    return source
+
+
+def read_source(source: Source) -> bytes:
+    if isinstance(source, str):
+        with open(source, 'rb') as f:
+            return f.read()
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return bytes(source)
+    return open_source(source).read()
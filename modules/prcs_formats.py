@@ -0,0 +1,274 @@
+"""
+Выбор конвертера по расширению файла и запуск конвертации. При FILE_PROCESS_WORKERS > 0 разбор выполняется
+в пуле процессов: XML-разбор и циклы по объектам не держат GIL потоков задач, а аварийное завершение процесса
+затрагивает только обрабатываемый файл. Координаты линий возвращаются из процесса через разделяемую память,
+через нее же процессу передается отмена задачи.
+"""
+import logging
+import multiprocessing
+import threading
+import uuid
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing.shared_memory import SharedMemory
+from typing import Dict, Any, Callable, List, Optional, Tuple
+import numpy as np
+from config import FILE_PROCESS_WORKERS
+from .prcs_flow import ProcessingError, JobCancelledError, ERR_LOGIC, ERR_CANCELLED, KEY_PATHS, Source, \
+    current_job_cancel, read_source, source_name
+from .prcs_shp import process_zip
+from .prcs_geojson import process_geojson
+from .prcs_gpx import process_gpx
+from .prcs_kml import process_kml
+from .prcs_topojson import process_topojson
+from .prcs_wkt import process_wkt
+
+logger = logging.getLogger(__name__)
+
+
+FILE_PROCESSORS: Dict[str, Tuple[Callable[[Source, Optional[str]], Dict[str, Any]], str]] = {
+    '.zip': (process_zip, 'Shapefile'),
+    '.geojson': (process_geojson, 'GeoJSON'),
+    '.gpx': (process_gpx, 'GPX'),
+    '.kml': (process_kml, 'KML/KMZ'),
+    '.kmz': (process_kml, 'KML/KMZ'),
+    '.topojson': (process_topojson, 'TopoJSON'),
+    '.wkt': (process_wkt, 'WKT'),
+}
+
+KEY_SHARED_PATHS = "shared_paths"
+
+# Период проверки отмены задачи, пока файл конвертируется в процессе пула (секунды)
+CANCEL_POLL_INTERVAL = 0.5
+
+
+def get_file_extension(filename: str) -> str:
+    return '.' + filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
+
+
+# Линии в разделяемой памяти: имя блока, ключи в исходном порядке, размерности точек и смещения в блоке.
+# Размерность 0 означает, что линия передана обычным списком (точки разной размерности или не числа)
+SharedPaths = Tuple[str, List[str], np.ndarray, np.ndarray]
+
+
+def pack_result(result: Dict[str, Any], block_name: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Выполняется в процессе пула. Координаты всех линий записываются одним массивом float64 в блок разделяемой
+    памяти, через pickle передаются только ключи, размерности и смещения, а также точки и метаданные.
+    block_name задает основной процесс, чтобы освободить блок, даже если результат до него не дошел.
+    """
+    keys, dimensions, sizes, arrays, rest = [], [], [], [], {}
+    for key, coords in result.get(KEY_PATHS, {}).items():
+        keys.append(key)
+        dimension = len(coords[0]) if coords else 0
+        if dimension and all(len(point) == dimension for point in coords):
+            try:
+                array = np.asarray(coords, dtype=np.float64).ravel()
+            except (TypeError, ValueError):
+                array = None
+            if array is not None:
+                arrays.append(array)
+                dimensions.append(dimension)
+                sizes.append(array.size)
+                continue
+        rest[key] = coords
+        dimensions.append(0)
+        sizes.append(0)
+
+    if not arrays:
+        return {**result, KEY_PATHS: rest, KEY_SHARED_PATHS: None}
+
+    offsets = np.zeros(len(keys) + 1, dtype=np.int64)
+    np.cumsum(sizes, out=offsets[1:])
+    block = SharedMemory(name=block_name, create=True, size=max(int(offsets[-1]) * 8, 1))
+    try:
+        values = np.ndarray((int(offsets[-1]),), dtype=np.float64, buffer=block.buf)
+        np.concatenate(arrays, out=values)
+        del values
+    except BaseException:
+        block.close()
+        block.unlink()
+        raise
+    block.close()
+
+    shared: SharedPaths = (block.name, keys, np.asarray(dimensions, dtype=np.int64), offsets)
+    return {**result, KEY_PATHS: rest, KEY_SHARED_PATHS: shared}
+
+
+def unpack_result(packed: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Выполняется в основном процессе: отображает блок разделяемой памяти, строит списки координат прямо из него
+    и освобождает блок. Порядок линий совпадает с результатом конвертера.
+    """
+    result = {key: value for key, value in packed.items() if key != KEY_SHARED_PATHS}
+    shared = packed.get(KEY_SHARED_PATHS)
+    if shared is None:
+        return result
+
+    name, keys, dimensions, offsets = shared
+    rest = packed[KEY_PATHS]
+    block = SharedMemory(name=name)
+    try:
+        values = np.ndarray((int(offsets[-1]),), dtype=np.float64, buffer=block.buf)
+        paths = {}
+        for index, key in enumerate(keys):
+            dimension = int(dimensions[index])
+            if dimension:
+                paths[key] = values[offsets[index]:offsets[index + 1]].reshape(-1, dimension).tolist()
+            else:
+                paths[key] = rest[key]
+        del values
+    finally:
+        block.close()
+        block.unlink()
+
+    result[KEY_PATHS] = paths
+    return result
+
+
+def _release_shared_block(name: str) -> None:
+    # Освобождает блок, если он еще существует: unpack_result мог уже освободить его, а процесс пула — не создать
+    try:
+        block = SharedMemory(name=name)
+    except FileNotFoundError:
+        return
+    block.close()
+    block.unlink()
+
+
+class _SharedCancelFlag:
+    """
+    Токен отмены задачи в процессе пула: контекст задачи в процесс не передается, поэтому check_cancelled
+    читает байт разделяемой памяти, который основной процесс выставляет при отмене
+    """
+
+    def __init__(self, name: str):
+        self._block = SharedMemory(name=name)
+
+    def is_set(self) -> bool:
+        return bool(self._block.buf[0])
+
+    def close(self) -> None:
+        self._block.close()
+
+
+def _process_in_worker(extension: str, source: Source, filename: Optional[str], block_name: Optional[str] = None,
+                       cancel_name: Optional[str] = None) -> Tuple[Optional[Dict[str, Any]], Optional[tuple]]:
+    # Выполняется в процессе пула; ProcessingError передается полями, чтобы не зависеть от pickle исключений
+    processor, _ = FILE_PROCESSORS[extension]
+    cancel = _SharedCancelFlag(cancel_name) if cancel_name else None
+    cancel_token = current_job_cancel.set(cancel)
+    try:
+        return pack_result(processor(source, filename), block_name), None
+    except ProcessingError as e:
+        return None, (e.code, e.message, e.details)
+    finally:
+        current_job_cancel.reset(cancel_token)
+        if cancel is not None:
+            cancel.close()
+
+
+def _wait_result(future: Future, cancel_flag: Optional[SharedMemory]) -> Any:
+    # Пока процесс пула конвертирует файл, отмена задачи переносится во флаг, который читает процесс
+    cancel = current_job_cancel.get()
+    if cancel is None or cancel_flag is None:
+        return future.result()
+    while True:
+        if cancel.is_set():
+            cancel_flag.buf[0] = 1
+        try:
+            return future.result(timeout=CANCEL_POLL_INTERVAL)
+        except FutureTimeoutError:
+            continue
+
+
+class FileProcessPool:
+    """
+    Пул процессов для конвертации файлов. Если процесс пула аварийно завершился (BrokenProcessPool), пул
+    пересоздается, а файл обрабатывается повторно один раз; повторное падение считается ошибкой этого файла.
+    """
+
+    def __init__(self, workers: int = FILE_PROCESS_WORKERS):
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # spawn: процессы не наследуют потоки и блокировки веб-сервера
+                self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                     mp_context=multiprocessing.get_context('spawn'))
+            return self._executor
+
+    def _reset(self, broken: ProcessPoolExecutor) -> None:
+        with self._lock:
+            if self._executor is broken:
+                self._executor = None
+        broken.shutdown(wait=False)
+
+    def process(self, extension: str, source: Source, filename: Optional[str] = None) -> Dict[str, Any]:
+        # Открытый файл не передается в процесс через pickle, поэтому передается его содержимое
+        if not isinstance(source, (str, bytes)):
+            source = read_source(source)
+        # Флаг отмены создается только для файлов задачи, у которых есть токен отмены
+        cancel_flag = SharedMemory(name=f"nmap_cancel_{uuid.uuid4().hex[:16]}", create=True, size=1) \
+            if current_job_cancel.get() is not None else None
+        try:
+            return self._process(extension, source, filename, cancel_flag)
+        finally:
+            if cancel_flag is not None:
+                cancel_flag.close()
+                cancel_flag.unlink()
+
+    def _process(self, extension: str, source: Source, filename: Optional[str],
+                 cancel_flag: Optional[SharedMemory]) -> Dict[str, Any]:
+        cancel_name = cancel_flag.name if cancel_flag is not None else None
+        for attempt in (1, 2):
+            executor = self._get_executor()
+            # Блок для координат называет основной процесс и освобождает его при любом исходе попытки
+            block_name = f"nmap_{uuid.uuid4().hex[:20]}"
+            try:
+                future = executor.submit(_process_in_worker, extension, source, filename, block_name, cancel_name)
+                packed, error = _wait_result(future, cancel_flag)
+                if error is not None:
+                    raise JobCancelledError() if error[0] == ERR_CANCELLED else ProcessingError(*error)
+                return unpack_result(packed)
+            except BrokenProcessPool:
+                self._reset(executor)
+                if attempt == 2:
+                    raise ProcessingError(ERR_LOGIC, "Процесс конвертации аварийно завершился")
+                logger.warning(f"Процесс конвертации аварийно завершился, повтор для {source_name(source, filename)}")
+            finally:
+                _release_shared_block(block_name)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown()
+
+
+_process_pool: Optional[FileProcessPool] = None
+_process_pool_lock = threading.Lock()
+
+
+def get_process_pool() -> FileProcessPool:
+    global _process_pool
+    if _process_pool is None:
+        with _process_pool_lock:
+            if _process_pool is None:
+                _process_pool = FileProcessPool()
+    return _process_pool
+
+
+def process_file(source: Source, filename: str) -> Dict[str, Any]:
+    """Конвертирует файл (путь, содержимое в памяти или открытый файл) конвертером, выбранным по расширению filename"""
+    extension = get_file_extension(filename)
+    if extension not in FILE_PROCESSORS:
+        raise ValueError(f"Неподдерживаемый тип файла: {extension}")
+
+    if FILE_PROCESS_WORKERS > 0:
+        return get_process_pool().process(extension, source, filename)
+    processor, _ = FILE_PROCESSORS[extension]
+    return processor(source, filename)
@@ -1,10 +1,9 @@
-import os
 import uuid
 import logging
 import geopandas as gpd
-from shapely.geometry import Polygon
-from typing import Dict, Any
-from .prcs_flow import ProcessingError, ERR_SHAPEFILE
+from shapely.geometry import Polygon, shape
+from typing import Dict, Any, Iterable, Mapping, Optional, Tuple
+from .prcs_flow import ProcessingError, ERR_SHAPEFILE, Source, check_cancelled, open_source, source_name
 
 
 logger = logging.getLogger(__name__)
@@ -14,9 +13,10 @@ logger = logging.getLogger(__name__)
 """
 
 
-def process_geojson(file_path: str) -> Dict[str, Any]:
+def process_geojson(source: Source, filename: Optional[str] = None) -> Dict[str, Any]:
+    # source — путь, bytes или двоичный файл; содержимое в памяти pyogrio читает через /vsimem/ без записи на диск
     try:
-        gdf = gpd.read_file(file_path, encoding='utf-8')
+        gdf = gpd.read_file(open_source(source), encoding='utf-8')
     except Exception as e:
         raise ProcessingError(ERR_SHAPEFILE, f"Ошибка чтения файла: {str(e)}")
 
@@ -27,12 +27,32 @@ def process_geojson(file_path: str) -> Dict[str, Any]:
     if gdf.crs is None:
         pass
 
+    return process_geojson_features(((row.geometry, row) for _, row in gdf.iterrows()), source_name(source, filename))
+
+
+def process_geojson_feature(feature: Mapping[str, Any], desc: str) -> Dict[str, Any]:
+    """
+    Один объект GeoJSON в виде словаря (модель НСПД после model_dump() или __geo_interface__). Геометрия строится
+    shapely прямо из словаря, без сериализации и чтения через GDAL.
+    """
+    geometry = feature.get('geometry')
+    if not geometry:
+        raise ProcessingError(ERR_SHAPEFILE, "У объекта нет геометрии")
+    try:
+        geom = shape(geometry)
+    except Exception as e:
+        raise ProcessingError(ERR_SHAPEFILE, f"Ошибка чтения геометрии: {str(e)}")
+    return process_geojson_features([(geom, feature.get('properties') or {})], desc)
+
+
+def process_geojson_features(features: Iterable[Tuple[Any, Mapping[str, Any]]], desc: str) -> Dict[str, Any]:
+    # features — пары (геометрия shapely, свойства объекта); у всех точек одно описание desc
     paths = {}
     points = {}
     metadata = []
 
-    for _, row in gdf.iterrows():
-        geom = row.geometry
+    for geom, properties in features:
+        check_cancelled()
         if geom is None or geom.is_empty:
             continue
 
@@ -63,11 +83,8 @@ def process_geojson(file_path: str) -> Dict[str, Any]:
             for line in geom.geoms:
                 current_feature_paths.append(list(line.coords))
 
-        # Генерируем описание объекта из названия файла
-        desc = os.path.basename(file_path)
-
-        category = row.get('category_t', '')
-        title = row.get('title', '')
+        category = properties.get('category_t', '')
+        title = properties.get('title', '')
         if category or title:
             display_text = f"{category} {title}".strip()
             if display_text and display_text not in metadata:
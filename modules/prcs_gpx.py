@@ -1,9 +1,8 @@
 import uuid
 import logging
-import os
 import xml.etree.ElementTree as ET
-from typing import Dict, Any
-from .prcs_flow import ProcessingError, ERR_SHAPEFILE
+from typing import Dict, Any, Optional
+from .prcs_flow import ProcessingError, ERR_SHAPEFILE, Source, check_cancelled, open_source, source_name
 
 
 logger = logging.getLogger(__name__)
@@ -13,9 +12,9 @@ logger = logging.getLogger(__name__)
 """
 
 
-def process_gpx(file_path: str) -> Dict[str, Any]:
+def process_gpx(source: Source, filename: Optional[str] = None) -> Dict[str, Any]:
     try:
-        tree = ET.parse(file_path)
+        tree = ET.parse(open_source(source))
         root = tree.getroot()
     except Exception as e:
         raise ProcessingError(ERR_SHAPEFILE, f"Ошибка чтения файла: {str(e)}")
@@ -28,11 +27,12 @@ def process_gpx(file_path: str) -> Dict[str, Any]:
         return elem.tag.split('}', 1)[-1] if '}' in elem.tag else elem.tag
 
     # Генерируем описание объекта из названия файла
-    desc = os.path.basename(file_path)
+    desc = source_name(source, filename)
 
     # Парсим tracks (trk)
     for trk in root.iter():
         if get_tag(trk) == 'trk':
+            check_cancelled()
             trk_name = None
             # Try to find name
             for child in trk:
@@ -70,6 +70,7 @@ def process_gpx(file_path: str) -> Dict[str, Any]:
     # Парсим waypoints (wpt)
     for wpt in root.iter():
         if get_tag(wpt) == 'wpt':
+            check_cancelled()
             try:
                 lat = float(wpt.attrib['lat'])
                 lon = float(wpt.attrib['lon'])
@@ -0,0 +1,126 @@
+"""
+Потоковое чтение index.json. Документ разбирается по мере поступления фрагментов из сети или с диска: каждая
+запись paths/points декодируется отдельно и сразу попадает в итоговый словарь, поэтому в памяти держится
+одна копия индекса и небольшой хвост еще не разобранного текста, а не все тело ответа плюс словарь.
+"""
+import codecs
+import json
+from json.decoder import WHITESPACE
+from typing import Any, Dict, Iterable, Iterator, List, Union
+
+
+_decoder = json.JSONDecoder()
+
+# Символы, которыми может продолжаться число: "0." или "1e" на границе фрагмента — начало более длинного числа
+_NUMBER_TAIL = frozenset("0123456789+-.eE")
+
+
+class _ChunkReader:
+    """Текст из потока байтовых фрагментов с курсором; прочитанная часть буфера отбрасывается при дочитывании"""
+
+    def __init__(self, chunks: Iterable[bytes]):
+        self._chunks: Iterator[bytes] = iter(chunks)
+        self._utf8 = codecs.getincrementaldecoder('utf-8')()
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def fill(self, min_size: int = 1) -> bool:
+        """Дочитывает не меньше min_size символов, False если поток закончился"""
+        pending = [self.buffer[self.pos:]]
+        added = 0
+        while added < min_size and not self.eof:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                self.eof = True
+                text = self._utf8.decode(b"", final=True)
+            else:
+                text = self._utf8.decode(chunk)
+            pending.append(text)
+            added += len(text)
+        self.buffer = "".join(pending)
+        self.pos = 0
+        return added > 0
+
+    def peek(self) -> str:
+        """Следующий значащий символ, пустая строка в конце потока"""
+        while True:
+            self.pos = WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill():
+                return ""
+
+    def expect(self, char: str) -> None:
+        if self.peek() != char:
+            raise ValueError(f"Expecting '{char}' at position {self.pos}")
+        self.pos += 1
+
+    def value(self) -> Any:
+        """
+        Декодирует одно JSON-значение. Если значение не поместилось в буфер, поток дочитывается с удвоением,
+        чтобы длинная запись не разбиралась заново на каждом фрагменте. Значение, которое упирается в конец
+        буфера, может продолжаться в следующем фрагменте, поэтому его тоже дочитываем. Число, за которым до конца
+        буфера идут только символы числа ("0." перед "1"), raw_decode принимает по первой части, поэтому такое
+        число тоже дочитывается.
+        """
+        self.peek()
+        while True:
+            try:
+                result, end = _decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if not self.fill(max(len(self.buffer) - self.pos, 1)):
+                    raise
+                continue
+            if not self.eof and (end == len(self.buffer) or (
+                    isinstance(result, (int, float)) and not isinstance(result, bool)
+                    and _NUMBER_TAIL.issuperset(self.buffer[end:]))):
+                self.fill()
+                continue
+            self.pos = end
+            return result
+
+    def key(self) -> str:
+        key = self.value()
+        if not isinstance(key, str):
+            raise ValueError(f"Expecting property name at position {self.pos}")
+        self.expect(":")
+        return key
+
+    def members(self) -> Iterator[str]:
+        """Перебирает ключи объекта; после каждого ключа курсор стоит на его значении"""
+        self.expect("{")
+        if self.peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            yield self.key()
+            separator = self.peek()
+            self.pos += 1
+            if separator == "}":
+                return
+            if separator != ",":
+                raise ValueError(f"Expecting ',' delimiter at position {self.pos - 1}")
+
+
+def _read_object(reader: _ChunkReader) -> Dict[str, Any]:
+    return {key: reader.value() for key in reader.members()}
+
+
+def decode_index_stream(chunks: Iterable[Union[bytes, bytearray]]) -> Union[Dict[str, Any], List[Any], Any]:
+    """
+    Разбирает JSON-документ из последовательности байтовых фрагментов UTF-8. Объект верхнего уровня
+    и вложенные в него объекты (paths, points) читаются по одной записи. Результат совпадает с json.loads
+    от всего тела; при некорректном JSON выбрасывается ValueError.
+    """
+    reader = _ChunkReader(chunks)
+    if reader.peek() != "{":
+        document = reader.value()
+    else:
+        document = {}
+        for key in reader.members():
+            document[key] = _read_object(reader) if reader.peek() == "{" else reader.value()
+
+    if reader.peek() != "":
+        raise ValueError(f"Extra data at position {reader.pos}")
+    return document
@@ -0,0 +1,305 @@
+"""
+Долговременная очередь задач в SQLite для JOB_QUEUE_BACKEND = "sqlite". Веб-приложение записывает в очередь
+вид задачи, аргументы (включая пути временных файлов) и состояние, а задачи разбирают отдельные процессы worker.py.
+Обработчик берет задачу в аренду на JOB_LEASE_TIMEOUT секунд и продлевает ее, пока задача выполняется. Если
+обработчик перезапустился или упал, аренда истекает и задача возвращается в очередь, пока не исчерпаны попытки.
+Завершенные задачи удаляются из очереди через JOB_TTL секунд, как из реестра задач в памяти.
+Временные файлы загрузки хранятся до завершения задачи, а отметка saved не дает повтору сохранить результаты дважды.
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from config import JOB_QUEUE_DB, JOB_QUEUE_SIZE, JOB_RETRY_AFTER, JOB_LEASE_TIMEOUT, JOB_MAX_ATTEMPTS, JOB_TTL, \
+    JOB_QUEUE_BACKEND, JOB_EVENT_BUS
+from .prcs_flow import JobQueueFullError
+from .prcs_event_log import get_event_log
+from .prcs_async_log import process_upload_async, process_nspd_async, process_nspd_border_async, make_log_entry
+
+logger = logging.getLogger(__name__)
+
+
+QUEUE_QUEUED = "queued"
+QUEUE_RUNNING = "running"
+QUEUE_DONE = "done"
+QUEUE_FAILED = "failed"
+QUEUE_CANCELLED = "cancelled"
+
+# Виды задач: в очереди хранится вид, обработчик выбирает по нему функцию задачи
+JOB_KIND_UPLOAD = "upload"
+JOB_TARGETS: Dict[str, Callable[..., None]] = {
+    JOB_KIND_UPLOAD: process_upload_async,
+    "nspd": process_nspd_async,
+    "nspd_border": process_nspd_border_async,
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    args TEXT NOT NULL,
+    state TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    lease_until REAL,
+    cancel_requested INTEGER NOT NULL DEFAULT 0,
+    saved INTEGER NOT NULL DEFAULT 0,
+    report TEXT,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_state_created ON jobs (state, created);
+"""
+
+# Поля задачи, которые не отдаются через API: аргументы содержат пути временных файлов на сервере
+_PRIVATE_FIELDS = ("args",)
+
+
+class SQLiteJobQueue:
+    """
+    Очередь задач в файле SQLite, общая для процессов одной машины. Каждая операция открывает свое соединение,
+    а изменения состояния выполняются в транзакции BEGIN IMMEDIATE, поэтому задачу получает ровно один обработчик.
+    """
+
+    def __init__(self, path: str = JOB_QUEUE_DB, queue_size: int = JOB_QUEUE_SIZE,
+                 retry_after: int = JOB_RETRY_AFTER, lease_timeout: float = JOB_LEASE_TIMEOUT,
+                 max_attempts: int = JOB_MAX_ATTEMPTS, ttl: float = JOB_TTL):
+        self.path = path
+        self.queue_size = queue_size
+        self.retry_after = retry_after
+        self.lease_timeout = lease_timeout
+        self.max_attempts = max_attempts
+        self.ttl = ttl
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        connection = self._connect()
+        try:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(_SCHEMA)
+            columns = {row["name"] for row in connection.execute("PRAGMA table_info(jobs)")}
+            if "saved" not in columns:
+                # Очередь, созданная до появления отметки сохранения
+                connection.execute("ALTER TABLE jobs ADD COLUMN saved INTEGER NOT NULL DEFAULT 0")
+        finally:
+            connection.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        connection.row_factory = sqlite3.Row
+        return connection
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        connection = self._connect()
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield connection
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            connection.execute("COMMIT")
+        finally:
+            connection.close()
+
+    def enqueue(self, job_id: str, kind: str, args: List[Any]) -> None:
+        """Ставит задачу в очередь; при заполненной очереди выбрасывает JobQueueFullError"""
+        with self._transaction() as connection:
+            self._purge(connection, time.time())
+            queued = connection.execute("SELECT COUNT(*) FROM jobs WHERE state = ?", (QUEUE_QUEUED,)).fetchone()[0]
+            if queued >= self.queue_size:
+                raise JobQueueFullError(self.retry_after)
+            connection.execute("INSERT INTO jobs (id, kind, args, state, created) VALUES (?, ?, ?, ?, ?)",
+                               (job_id, kind, json.dumps(args), QUEUE_QUEUED, time.time()))
+
+    def claim(self, worker_id: str) -> Optional[Dict[str, Any]]:
+        """Берет в аренду самую старую задачу из очереди; None, если очередь пуста"""
+        now = time.time()
+        with self._transaction() as connection:
+            failed = self._expire_leases(connection, now)
+            row = connection.execute("SELECT * FROM jobs WHERE state = ? ORDER BY created LIMIT 1",
+                                     (QUEUE_QUEUED,)).fetchone()
+            if row is not None:
+                connection.execute(
+                    "UPDATE jobs SET state = ?, worker = ?, attempts = attempts + 1, lease_until = ?, started = ? "
+                    "WHERE id = ?", (QUEUE_RUNNING, worker_id, now + self.lease_timeout, now, row["id"]))
+        for job_id, message in failed:
+            _close_job_log(job_id, "error", message)
+        if row is None:
+            return None
+        job = _row_to_dict(row)
+        job.update(state=QUEUE_RUNNING, worker=worker_id, attempts=row["attempts"] + 1, started=now)
+        return job
+
+    def heartbeat(self, job_id: str, worker_id: str) -> bool:
+        """Продлевает аренду задачи. Возвращает True, если для задачи запрошена отмена"""
+        with self._transaction() as connection:
+            connection.execute("UPDATE jobs SET lease_until = ? WHERE id = ? AND worker = ? AND state = ?",
+                               (time.time() + self.lease_timeout, job_id, worker_id, QUEUE_RUNNING))
+            row = connection.execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return bool(row and row["cancel_requested"])
+
+    def mark_saved(self, job_id: str) -> None:
+        """Отмечает, что результаты задачи сохранены; повтор задачи после сбоя обработчика их не сохраняет"""
+        with self._transaction() as connection:
+            connection.execute("UPDATE jobs SET saved = 1 WHERE id = ?", (job_id,))
+
+    def finish(self, job_id: str, report: Dict[str, Any]) -> None:
+        """
+        Записывает отчет выполненной задачи и удаляет ее временные файлы; состояние определяется ошибкой и отменой
+        в отчете
+        """
+        if report.get("cancelled"):
+            state = QUEUE_CANCELLED
+        elif report.get("error"):
+            state = QUEUE_FAILED
+        else:
+            state = QUEUE_DONE
+        with self._transaction() as connection:
+            connection.execute("UPDATE jobs SET state = ?, report = ?, lease_until = NULL, finished = ? WHERE id = ?",
+                               (state, json.dumps(report), time.time(), job_id))
+            row = connection.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is not None:
+            _remove_temp_files(row)
+
+    def cancel(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Задача из очереди отменяется сразу, для выполняющейся отмена передается обработчику при продлении аренды.
+        None для неизвестной задачи.
+        """
+        with self._transaction() as connection:
+            row = connection.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None
+            cancelled_queued = row["state"] == QUEUE_QUEUED
+            if cancelled_queued:
+                connection.execute("UPDATE jobs SET state = ?, cancel_requested = 1, finished = ? WHERE id = ?",
+                                   (QUEUE_CANCELLED, time.time(), job_id))
+                _remove_temp_files(row)
+            elif row["state"] == QUEUE_RUNNING:
+                connection.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ?", (job_id,))
+            row = connection.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if cancelled_queued:
+            # Задачу не запустит ни один обработчик, поэтому лог задачи завершается здесь
+            _close_job_log(job_id, "warning", "✗ Задача отменена до запуска")
+        return _row_to_dict(row)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        connection = self._connect()
+        try:
+            row = connection.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        finally:
+            connection.close()
+        return _row_to_dict(row) if row is not None else None
+
+    def list(self, offset: int = 0, limit: int = 50, state: Optional[str] = None) -> Tuple[int, List[Dict[str, Any]]]:
+        """Страница задач, начиная с новых, и общее число задач с учетом фильтра по состоянию"""
+        with self._transaction() as connection:
+            self._purge(connection, time.time())
+            condition, params = ("WHERE state = ?", (state,)) if state is not None else ("", ())
+            total = connection.execute(f"SELECT COUNT(*) FROM jobs {condition}", params).fetchone()[0]
+            rows = connection.execute(f"SELECT * FROM jobs {condition} ORDER BY created DESC LIMIT ? OFFSET ?",
+                                      (*params, limit, offset)).fetchall()
+        return total, [_row_to_dict(row) for row in rows]
+
+    def counts(self) -> Dict[str, int]:
+        connection = self._connect()
+        try:
+            rows = connection.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall()
+        finally:
+            connection.close()
+        counts = dict.fromkeys((QUEUE_QUEUED, QUEUE_RUNNING, QUEUE_DONE, QUEUE_FAILED, QUEUE_CANCELLED), 0)
+        counts.update({row[0]: row[1] for row in rows})
+        return counts
+
+    def _purge(self, connection: sqlite3.Connection, now: float) -> None:
+        # Завершенные задачи удаляются через ttl секунд после завершения; их временные файлы уже удалены
+        connection.execute("DELETE FROM jobs WHERE state IN (?, ?, ?) AND finished < ?",
+                           (QUEUE_DONE, QUEUE_FAILED, QUEUE_CANCELLED, now - self.ttl))
+
+    def _expire_leases(self, connection: sqlite3.Connection, now: float) -> List[Tuple[str, str]]:
+        # Задачи упавших обработчиков возвращаются в очередь; после max_attempts попыток задача считается ошибочной.
+        # Возвращает идентификаторы и текст ошибки задач, завершенных с ошибкой
+        failed = []
+        expired = connection.execute("SELECT * FROM jobs WHERE state = ? AND lease_until < ?",
+                                     (QUEUE_RUNNING, now)).fetchall()
+        for row in expired:
+            if row["attempts"] >= self.max_attempts:
+                logger.warning(f"Job {row['id']} failed after {row['attempts']} attempts")
+                report = {"error": f"Обработчик не завершил задачу за {row['attempts']} попыток"}
+                connection.execute("UPDATE jobs SET state = ?, report = ?, lease_until = NULL, finished = ? "
+                                   "WHERE id = ?", (QUEUE_FAILED, json.dumps(report), now, row["id"]))
+                _remove_temp_files(row)
+                failed.append((row["id"], f"✗ {report['error']}"))
+            else:
+                logger.warning(f"Job {row['id']} lease expired on worker {row['worker']}, requeued")
+                connection.execute("UPDATE jobs SET state = ?, worker = NULL, lease_until = NULL WHERE id = ?",
+                                   (QUEUE_QUEUED, row["id"]))
+        return failed
+
+
+def check_job_backends(queue_backend: str = JOB_QUEUE_BACKEND, event_bus: str = JOB_EVENT_BUS) -> None:
+    """
+    Проверка настроек при запуске: задачи очереди SQLite выполняет worker.py, поэтому их лог доступен
+    веб-приложению только через журнал SQLite
+    """
+    if queue_backend == 'sqlite' and event_bus != 'sqlite':
+        raise ValueError('JOB_QUEUE_BACKEND = "sqlite" требует JOB_EVENT_BUS = "sqlite": '
+                         'иначе SSE-клиенты не получат лог задач')
+
+
+def _close_job_log(job_id: str, level: str, message: str) -> None:
+    # Итоговая запись и завершение лога задачи, которую не завершил обработчик: SSE-клиенты получают событие end
+    if JOB_EVENT_BUS != 'sqlite':
+        return
+    log_queue = get_event_log().open(job_id)
+    log_queue.put(make_log_entry(level, message))
+    log_queue.put(None)
+
+
+def _row_to_dict(row: sqlite3.Row) -> Dict[str, Any]:
+    job = dict(row)
+    job["args"] = json.loads(job["args"])
+    job["report"] = json.loads(job["report"]) if job["report"] else None
+    job["cancel_requested"] = bool(job["cancel_requested"])
+    job["saved"] = bool(job["saved"])
+    return job
+
+
+def public_job(job: Dict[str, Any]) -> Dict[str, Any]:
+    """Задача из очереди для ответа API, без аргументов задачи"""
+    return {key: value for key, value in job.items() if key not in _PRIVATE_FIELDS}
+
+
+def _remove_temp_files(row: sqlite3.Row) -> None:
+    # Временные файлы загрузки — первый аргумент задачи upload: список пар (путь, имя файла)
+    if row["kind"] != JOB_KIND_UPLOAD:
+        return
+    for temp_path, _ in json.loads(row["args"])[0]:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+_job_queue: Optional[SQLiteJobQueue] = None
+_job_queue_lock = threading.Lock()
+
+
+def get_job_queue() -> SQLiteJobQueue:
+    global _job_queue
+    if _job_queue is None:
+        with _job_queue_lock:
+            if _job_queue is None:
+                _job_queue = SQLiteJobQueue()
+    return _job_queue
+
+
+def set_job_queue(job_queue: Optional[SQLiteJobQueue]) -> None:
+    global _job_queue
+    with _job_queue_lock:
+        _job_queue = job_queue
@@ -0,0 +1,419 @@
+"""
+Общий пул обработки асинхронных задач. Эндпоинты app.py ставят задачи в ограниченную очередь, которую разбирает
+фиксированное число рабочих потоков, поэтому всплеск загрузок не запускает одновременно сотни разборов
+geopandas. Когда очередь заполнена, submit выбрасывает JobQueueFullError, а эндпоинт отвечает 429.
+Реестр задач хранит состояние и лог каждой задачи и удаляет завершенные задачи по истечении JOB_TTL.
+"""
+import asyncio
+import logging
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timezone
+from itertools import islice
+from queue import Queue
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+from config import JOB_WORKERS, JOB_QUEUE_SIZE, JOB_RETRY_AFTER, JOB_TTL, JOB_REGISTRY_MAX_JOBS, \
+    JOB_REGISTRY_MAX_RECORDS, JOB_EVENT_BUFFER_SIZE, JOB_EVENT_BUS
+from .prcs_flow import JobQueueFullError, current_job_report, current_job_cancel, current_job_saved
+from .prcs_async_log import make_log_entry
+from .prcs_event_log import get_event_log
+
+logger = logging.getLogger(__name__)
+
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_CANCELLED = "cancelled"
+JOB_FINISHED_STATES = (JOB_DONE, JOB_CANCELLED)
+
+PendingJob = Tuple[Callable[..., None], Queue, Tuple[Any, ...], Optional[threading.Event]]
+
+
+class JobExecutor:
+
+    def __init__(self, workers: int = JOB_WORKERS, queue_size: int = JOB_QUEUE_SIZE,
+                 retry_after: int = JOB_RETRY_AFTER):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.retry_after = retry_after
+        self._condition = threading.Condition()
+        self._pending: Deque[PendingJob] = deque()
+        self._threads: List[threading.Thread] = []
+        self._active = 0
+        self._shutdown = False
+
+    def submit(self, target: Callable[..., None], log_queue: Queue, *args: Any,
+               cancel_event: Optional[threading.Event] = None) -> int:
+        """
+        Ставит задачу target(log_queue, *args) в очередь. Возвращает позицию в очереди ожидания, 0 если
+        задача начнет выполняться сразу. Позиция и ее изменения отправляются в лог задачи. По cancel_event
+        задачу можно снять с очереди через cancel_pending.
+        """
+        with self._condition:
+            if self._shutdown:
+                raise RuntimeError("Job executor is shut down")
+            if len(self._pending) >= self.queue_size:
+                raise JobQueueFullError(self.retry_after)
+
+            self._start_workers()
+            self._pending.append((target, log_queue, args, cancel_event))
+            position = max(0, len(self._pending) - (self.workers - self._active))
+            if position:
+                log_queue.put(_position_entry(position))
+            self._condition.notify()
+            return position
+
+    def cancel_pending(self, cancel_event: threading.Event) -> bool:
+        """
+        Снимает с очереди ожидания задачу с токеном cancel_event и сразу выполняет ее в вызывающем потоке:
+        отмененная задача только освобождает файлы и закрывает лог, поэтому не ждет свободного рабочего потока
+        и не занимает место в очереди. False, если задача уже выполняется или неизвестна.
+        """
+        with self._condition:
+            index = next((index for index, entry in enumerate(self._pending) if entry[3] is cancel_event), None)
+            if index is None:
+                return False
+            entry = self._pending[index]
+            del self._pending[index]
+            self._announce_positions(start=index)
+        self._run(entry)
+        return True
+
+    def queued(self) -> int:
+        with self._condition:
+            return len(self._pending)
+
+    def shutdown(self, wait: bool = True) -> None:
+        # Задачи, уже стоящие в очереди, выполняются до конца
+        with self._condition:
+            self._shutdown = True
+            self._condition.notify_all()
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+    def _start_workers(self) -> None:
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._work, name=f"job-worker-{len(self._threads)}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _announce_positions(self, start: int = 0) -> None:
+        # Задачи в очереди сдвигаются на одну позицию, когда рабочий поток забирает очередную задачу
+        # или задача перед ними отменена
+        idle = self.workers - self._active
+        for index, (_, log_queue, _, _) in enumerate(self._pending, start=1):
+            if index > max(idle, start):
+                log_queue.put(_position_entry(index - idle))
+
+    def _work(self) -> None:
+        while True:
+            with self._condition:
+                while not self._pending and not self._shutdown:
+                    self._condition.wait()
+                if not self._pending:
+                    return
+                entry = self._pending.popleft()
+                self._active += 1
+                self._announce_positions()
+
+            try:
+                self._run(entry)
+            finally:
+                with self._condition:
+                    self._active -= 1
+
+    @staticmethod
+    def _run(entry: PendingJob) -> None:
+        target, log_queue, args, _ = entry
+        try:
+            target(log_queue, *args)
+        except Exception:
+            logger.exception("Job failed")
+
+
+def _position_entry(position: int) -> dict:
+    return make_log_entry('info', f"Задача в очереди, позиция: {position}", queue_position=position)
+
+
+class EventBuffer:
+    """
+    Лог задачи: кольцевой буфер последних записей с последовательными номерами. Записи не забираются читателями,
+    поэтому любое число подписчиков получает весь лог, а переподключившийся клиент продолжает с номера
+    Last-Event-ID. Поддерживает put() очереди: None завершает лог.
+    """
+
+    def __init__(self, maxlen: int = JOB_EVENT_BUFFER_SIZE):
+        self._condition = threading.Condition()
+        self._events: Deque[Tuple[int, Dict[str, Any]]] = deque(maxlen=maxlen)
+        self._last_id = 0
+        self.closed = False
+        # Ожидающие SSE-корутины ASGI-режима: цикл событий и future, которую put() завершает из потока задачи
+        self._async_waiters: List[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+
+    def __len__(self) -> int:
+        with self._condition:
+            return len(self._events)
+
+    def put(self, entry: Optional[Dict[str, Any]]) -> None:
+        with self._condition:
+            if entry is None:
+                self.closed = True
+            else:
+                self._last_id += 1
+                self._events.append((self._last_id, entry))
+            self._condition.notify_all()
+            waiters, self._async_waiters = self._async_waiters, []
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(_wake, future)
+
+    def wait(self, after: int, timeout: Optional[float] = None) -> Tuple[List[Tuple[int, Dict[str, Any]]], bool]:
+        """
+        Записи с номерами больше after и признак завершения лога. Если новых записей нет, ждет их не дольше
+        timeout секунд. Записи, вытесненные из буфера, пропускаются.
+        """
+        with self._condition:
+            if self._last_id <= after and not self.closed:
+                self._condition.wait(timeout)
+            return self._events_after(after)
+
+    async def wait_async(self, after: int,
+                         timeout: Optional[float] = None) -> Tuple[List[Tuple[int, Dict[str, Any]]], bool]:
+        """То же, что wait(), но ожидание не занимает поток: корутина просыпается по put() из потока задачи"""
+        loop = asyncio.get_running_loop()
+        with self._condition:
+            if self._last_id > after or self.closed:
+                return self._events_after(after)
+            future = loop.create_future()
+            self._async_waiters.append((loop, future))
+
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with self._condition:
+                if (loop, future) in self._async_waiters:
+                    self._async_waiters.remove((loop, future))
+
+        with self._condition:
+            return self._events_after(after)
+
+    def _events_after(self, after: int) -> Tuple[List[Tuple[int, Dict[str, Any]]], bool]:
+        if not self._events or self._last_id <= after:
+            return [], self.closed
+        first_id = self._events[0][0]
+        return list(islice(self._events, max(0, after - first_id + 1), None)), self.closed
+
+
+def _wake(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+class Job:
+
+    def __init__(self, job_id: str):
+        self.id = job_id
+        self.state = JOB_QUEUED
+        # При JOB_EVENT_BUS = "sqlite" лог задачи доступен другим процессам веб-приложения
+        self.log_queue = get_event_log().open(job_id) if JOB_EVENT_BUS == 'sqlite' else EventBuffer()
+        self.created = time.time()
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        # Заполняется задачей через report_job/report_file
+        self.report: Dict[str, Any] = {"files": [], "processed": 0, "skipped": 0, "error": None, "cancelled": False,
+                                       "saved": False}
+        # Проверяется задачей через check_cancelled/is_cancelled
+        self.cancel_event = threading.Event()
+        # Вызывается после сохранения результатов; обработчик очереди SQLite записывает отметку в очередь
+        self.on_saved: Optional[Callable[[], None]] = None
+
+    def to_dict(self, include_files: bool = True) -> Dict[str, Any]:
+        """Состояние задачи для GET /jobs: время в ISO 8601 (UTC), длительности в секундах"""
+        data = {
+            "id": self.id,
+            "state": self.state,
+            "created": _iso_time(self.created),
+            "started": _iso_time(self.started),
+            "finished": _iso_time(self.finished),
+            "queue_wait": _elapsed(self.created, self.started),
+            "duration": _elapsed(self.started, self.finished),
+            "processed": self.report["processed"],
+            "skipped": self.report["skipped"],
+            "error": self.report["error"],
+            "cancelled": self.report["cancelled"],
+        }
+        if include_files:
+            # Файлы конвертируются параллельно, поэтому отчет упорядочивается по порядку загрузки
+            data["files"] = sorted(list(self.report["files"]), key=lambda outcome: outcome["index"])
+        return data
+
+
+def _iso_time(timestamp: Optional[float]) -> Optional[str]:
+    if timestamp is None:
+        return None
+    return datetime.fromtimestamp(timestamp, timezone.utc).isoformat()
+
+
+def _elapsed(start: Optional[float], end: Optional[float]) -> Optional[float]:
+    if start is None or end is None:
+        return None
+    return round(end - start, 3)
+
+
+class JobRegistry:
+    """
+    Потокобезопасный реестр задач. Завершенные задачи удаляются через ttl секунд после завершения, а при
+    превышении max_jobs задач или max_records записей лога в памяти — раньше срока, начиная с самых старых.
+    Очистка выполняется при создании задач и запросе статистики, без отдельного потока.
+    """
+
+    def __init__(self, ttl: float = JOB_TTL, max_jobs: int = JOB_REGISTRY_MAX_JOBS,
+                 max_records: int = JOB_REGISTRY_MAX_RECORDS):
+        self.ttl = ttl
+        self.max_jobs = max_jobs
+        self.max_records = max_records
+        self._lock = threading.Lock()
+        self._jobs: Dict[str, Job] = {}
+        self.evicted = 0
+
+    def create(self, job_id: Optional[str] = None) -> Job:
+        # job_id передает обработчик очереди SQLite, чтобы задача сохранила идентификатор из очереди
+        job = Job(job_id or str(uuid.uuid4()))
+        with self._lock:
+            self._evict(incoming=1)
+            self._jobs[job.id] = job
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def remove(self, job_id: str) -> None:
+        with self._lock:
+            self._jobs.pop(job_id, None)
+
+    def run(self, job_id: str, target: Callable[..., None], log_queue: EventBuffer, *args: Any) -> None:
+        # Обертка для JobExecutor: отмечает начало и завершение задачи
+        job = self._set_state(job_id, JOB_RUNNING)
+        report_token = current_job_report.set(job.report if job is not None else None)
+        cancel_token = current_job_cancel.set(job.cancel_event if job is not None else None)
+        saved_token = current_job_saved.set(job.on_saved if job is not None else None)
+        try:
+            target(log_queue, *args)
+        finally:
+            current_job_saved.reset(saved_token)
+            current_job_cancel.reset(cancel_token)
+            current_job_report.reset(report_token)
+            cancelled = job is not None and job.cancel_event.is_set()
+            self._set_state(job_id, JOB_CANCELLED if cancelled else JOB_DONE)
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        """
+        Устанавливает токен отмены задачи. Задача в очереди завершится сразу после запуска, выполняющаяся —
+        на ближайшей проверке между объектами или файлами, без сохранения результатов. None для неизвестной задачи.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None and job.state not in JOB_FINISHED_STATES:
+                job.cancel_event.set()
+                job.report["cancelled"] = True
+            return job
+
+    def list(self, offset: int = 0, limit: int = 50, state: Optional[str] = None) -> Tuple[int, List[Job]]:
+        """Страница задач, начиная с новых, и общее число задач с учетом фильтра по состоянию"""
+        with self._lock:
+            self._evict()
+            jobs = [job for job in self._jobs.values() if state is None or job.state == state]
+        jobs.sort(key=lambda job: job.created, reverse=True)
+        return len(jobs), jobs[offset:offset + limit]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            self._evict()
+            counts = {JOB_QUEUED: 0, JOB_RUNNING: 0, JOB_DONE: 0, JOB_CANCELLED: 0}
+            for job in self._jobs.values():
+                counts[job.state] += 1
+            return {
+                "jobs": len(self._jobs),
+                **counts,
+                "buffered_records": self._buffered_records(),
+                "evicted": self.evicted,
+            }
+
+    def _set_state(self, job_id: str, state: str) -> Optional[Job]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            job.state = state
+            if state == JOB_RUNNING:
+                job.started = time.time()
+            elif state in JOB_FINISHED_STATES:
+                job.finished = time.time()
+            return job
+
+    def _buffered_records(self) -> int:
+        return sum(len(job.log_queue) for job in self._jobs.values())
+
+    def _evict(self, incoming: int = 0) -> None:
+        now = time.time()
+        finished = sorted((job for job in self._jobs.values() if job.state in JOB_FINISHED_STATES),
+                          key=lambda job: job.finished)
+
+        for job in finished:
+            if now - job.finished >= self.ttl:
+                self._drop(job)
+
+        records = self._buffered_records()
+        for job in finished:
+            if len(self._jobs) + incoming <= self.max_jobs and records <= self.max_records:
+                return
+            if job.id in self._jobs:
+                records -= len(job.log_queue)
+                self._drop(job)
+
+    def _drop(self, job: Job) -> None:
+        del self._jobs[job.id]
+        self.evicted += 1
+
+
+_executor: Optional[JobExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_job_executor() -> JobExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = JobExecutor()
+    return _executor
+
+
+def set_job_executor(executor: Optional[JobExecutor]) -> None:
+    global _executor
+    with _executor_lock:
+        _executor = executor
+
+
+_registry: Optional[JobRegistry] = None
+
+
+def get_job_registry() -> JobRegistry:
+    global _registry
+    if _registry is None:
+        with _executor_lock:
+            if _registry is None:
+                _registry = JobRegistry()
+    return _registry
+
+
+def set_job_registry(registry: Optional[JobRegistry]) -> None:
+    global _registry
+    with _executor_lock:
+        _registry = registry
@@ -1,10 +1,9 @@
 import uuid
 import logging
-import os
 import zipfile
 import xml.etree.ElementTree as ET
-from typing import Dict, Any, List
-from .prcs_flow import ProcessingError, ERR_SHAPEFILE
+from typing import Dict, Any, List, Optional
+from .prcs_flow import ProcessingError, ERR_SHAPEFILE, Source, check_cancelled, open_source, source_name
 
 
 logger = logging.getLogger(__name__)
@@ -14,10 +13,11 @@ logger = logging.getLogger(__name__)
 """
 
 
-def process_kml(file_path: str) -> Dict[str, Any]:
+def process_kml(source: Source, filename: Optional[str] = None) -> Dict[str, Any]:
     try:
-        if zipfile.is_zipfile(file_path):
-            with zipfile.ZipFile(file_path, 'r') as z:
+        readable = open_source(source)
+        if zipfile.is_zipfile(readable):
+            with zipfile.ZipFile(readable, 'r') as z:
                 kml_files = [f for f in z.namelist() if f.lower().endswith('.kml')]
                 if not kml_files:
                     raise ProcessingError(ERR_SHAPEFILE, "В KMZ-архиве отсутствует KML-файл")
@@ -25,7 +25,8 @@ def process_kml(file_path: str) -> Dict[str, Any]:
                 with z.open(kml_files[0]) as f:
                     tree = ET.parse(f)
         else:
-            tree = ET.parse(file_path)
+            # is_zipfile сдвигает позицию в открытом файле
+            tree = ET.parse(open_source(readable))
 
         root = tree.getroot()
     except Exception as e:
@@ -39,7 +40,7 @@ def process_kml(file_path: str) -> Dict[str, Any]:
         return elem.tag.split('}', 1)[-1] if '}' in elem.tag else elem.tag
 
     # Генерируем описание объекта из названия файла
-    desc = os.path.basename(file_path)
+    desc = source_name(source, filename)
 
     def parse_coordinates(coords_text: str) -> List[List[float]]:
         coords = []
@@ -56,6 +57,7 @@ def process_kml(file_path: str) -> Dict[str, Any]:
 
     for placemark in root.iter():
         if get_tag(placemark) == 'Placemark':
+            check_cancelled()
             name = None
             for child in placemark:
                 if get_tag(child) == 'name':
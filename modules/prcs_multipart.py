@@ -0,0 +1,163 @@
+"""
+Потоковый прием файлов /upload-async. Тело multipart разбирается по мере поступления, и каждый полностью принятый
+файл сразу передается задаче через UploadFeed, поэтому первые файлы конвертируются, пока следующие еще загружаются.
+"""
+import logging
+import os
+import threading
+from io import BytesIO
+from typing import BinaryIO, Callable, Iterable, List, Optional, Tuple, Union
+from werkzeug.sansio.multipart import MultipartDecoder, File, Data, Epilogue, NEED_DATA
+from config import UPLOAD_MEMORY_LIMIT
+from .prcs_flow import ProcessingError, ERR_NETWORK, Source
+
+logger = logging.getLogger(__name__)
+
+
+MULTIPART_CHUNK_SIZE = 64 * 1024
+
+
+class UploadFeed:
+    """
+    Список файлов задачи, который пополняется, пока запрос еще принимается. Задача забирает файлы по номеру
+    через wait(); close() отмечает, что новых файлов не будет. После discard() поступающие файлы сразу удаляются.
+    abort() отмечает, что тело запроса принято не полностью: задача не сохраняет результаты такой загрузки.
+    При keep_files=True временные файлы не удаляются задачей: ими владеет вызывающий (очередь SQLite).
+    """
+
+    def __init__(self, keep_files: bool = False):
+        self._condition = threading.Condition()
+        self._items: List[Tuple[Source, str]] = []
+        self.closed = False
+        self.discarded = False
+        self.aborted = False
+        self.keep_files = keep_files
+
+    @classmethod
+    def of(cls, files: Iterable[Tuple[Source, str]], keep_files: bool = False) -> 'UploadFeed':
+        """Завершенный feed из файлов, принятых целиком до запуска задачи"""
+        feed = cls(keep_files=keep_files)
+        for source, filename in files:
+            feed.add(source, filename)
+        feed.close()
+        return feed
+
+    def __len__(self) -> int:
+        with self._condition:
+            return len(self._items)
+
+    def add(self, source: Source, filename: str) -> None:
+        with self._condition:
+            if not self.discarded:
+                self._items.append((source, filename))
+                self._condition.notify_all()
+                return
+        self.remove(source)
+
+    def remove(self, source: Source) -> None:
+        """Удаляет временный файл, который задаче больше не нужен"""
+        if not self.keep_files:
+            _remove(source)
+
+    def close(self) -> None:
+        with self._condition:
+            self.closed = True
+            self._condition.notify_all()
+
+    def abort(self) -> None:
+        with self._condition:
+            self.aborted = True
+            self.discarded = True
+            self.closed = True
+            self._condition.notify_all()
+
+    def discard(self) -> None:
+        # Задача отменена или хранилище недоступно: файлы, которые еще поступят, не нужны
+        with self._condition:
+            self.discarded = True
+
+    def wait(self, start: int, timeout: Optional[float] = None) -> Tuple[List[Tuple[Source, str]], bool]:
+        """Файлы с номерами от start и признак завершения приема; ждет новых файлов не дольше timeout секунд"""
+        with self._condition:
+            if len(self._items) <= start and not self.closed:
+                self._condition.wait(timeout)
+            return self._items[start:], self.closed
+
+
+class _PartWriter:
+    # Файл до UPLOAD_MEMORY_LIMIT собирается в памяти, больший переносится во временный файл
+    def __init__(self, temp_path: str):
+        self.temp_path = temp_path
+        self.size = 0
+        self._target: Union[BytesIO, BinaryIO] = BytesIO()
+
+    def write(self, data: bytes) -> None:
+        self.size += len(data)
+        if isinstance(self._target, BytesIO) and self.size > UPLOAD_MEMORY_LIMIT:
+            buffered = self._target.getvalue()
+            self._target = open(self.temp_path, 'wb')
+            self._target.write(buffered)
+        self._target.write(data)
+
+    def finish(self) -> Source:
+        if isinstance(self._target, BytesIO):
+            return self._target.getvalue()
+        self._target.close()
+        return self.temp_path
+
+    def abort(self) -> None:
+        if not isinstance(self._target, BytesIO):
+            self._target.close()
+            _remove(self.temp_path)
+
+
+def read_multipart_uploads(stream: BinaryIO, boundary: bytes, feed: UploadFeed, job_id: str,
+                           accept: Callable[[str], Optional[str]]) -> int:
+    """
+    Разбирает тело multipart из stream и передает в feed файлы поля files. accept возвращает безопасное имя
+    файла или None, если файл не поддерживается. Возвращает число переданных файлов. Если тело оборвано или
+    повреждено, выбрасывает ProcessingError; файлы, уже переданные в feed, остаются в нем.
+    """
+    decoder = MultipartDecoder(boundary)
+    writer: Optional[_PartWriter] = None
+    filename: Optional[str] = None
+    accepted = 0
+
+    try:
+        received_all = False
+        while True:
+            event = decoder.next_event()
+            if event is NEED_DATA:
+                if received_all:
+                    # Тело закончилось до завершающей границы
+                    raise ProcessingError(ERR_NETWORK, "Тело запроса оборвано")
+                chunk = stream.read(MULTIPART_CHUNK_SIZE)
+                received_all = not chunk
+                decoder.receive_data(chunk or None)
+                continue
+            if isinstance(event, Epilogue):
+                break
+            if isinstance(event, File):
+                filename = accept(event.filename) if event.name == 'files' and event.filename else None
+                writer = _PartWriter(os.path.join("/tmp", f"{job_id}_{accepted}_{filename}")) if filename else None
+            elif isinstance(event, Data) and writer is not None:
+                writer.write(event.data)
+                if not event.more_data:
+                    feed.add(writer.finish(), filename)
+                    accepted += 1
+                    writer = None
+    except ValueError:
+        # MultipartDecoder не может разобрать оборванное или поврежденное тело
+        if writer is not None:
+            writer.abort()
+        raise ProcessingError(ERR_NETWORK, "Тело запроса оборвано или повреждено")
+    except Exception:
+        if writer is not None:
+            writer.abort()
+        raise
+    return accepted
+
+
+def _remove(source: Source) -> None:
+    if isinstance(source, str) and os.path.exists(source):
+        os.remove(source)
@@ -0,0 +1,125 @@
+"""
+Кэш результатов НСПД в SQLite. Сконвертированная геометрия хранится по слою и реестровому номеру NSPD_CACHE_TTL
+секунд; при переполнении удаляются записи, которые дольше всех не запрашивались. Файл общий для процессов
+веб-приложения и worker.py.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Dict, Optional
+from config import NSPD_CACHE_DB, NSPD_CACHE_TTL, NSPD_CACHE_MAX_ENTRIES
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS nspd_cache (
+    layer TEXT NOT NULL,
+    registry_number TEXT NOT NULL,
+    result TEXT NOT NULL,
+    created REAL NOT NULL,
+    accessed REAL NOT NULL,
+    PRIMARY KEY (layer, registry_number)
+);
+CREATE INDEX IF NOT EXISTS nspd_cache_accessed ON nspd_cache (accessed);
+"""
+
+
+class SQLiteNspdCache:
+    """
+    Кэш с ограничением по времени жизни (ttl) и числу записей (max_entries). Соединения открываются по одному на
+    поток, как в SQLiteEventLog.
+    """
+
+    def __init__(self, path: str = NSPD_CACHE_DB, ttl: float = NSPD_CACHE_TTL,
+                 max_entries: int = NSPD_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        connection = self._connection()
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.executescript(_SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            self._local.connection = connection
+        return connection
+
+    def get(self, layer: str, registry_number: str) -> Optional[Dict[str, Any]]:
+        """Результат конвертации или None, если записи нет или она устарела"""
+        connection = self._connection()
+        now = time.time()
+        row = connection.execute("SELECT result, created FROM nspd_cache WHERE layer = ? AND registry_number = ?",
+                                 (layer, registry_number)).fetchone()
+        if row is None:
+            return None
+        if row[1] < now - self.ttl:
+            connection.execute("DELETE FROM nspd_cache WHERE layer = ? AND registry_number = ?",
+                               (layer, registry_number))
+            return None
+        try:
+            result = _with_new_ids(json.loads(row[0]))
+        except (ValueError, TypeError, AttributeError):
+            # Поврежденная или несовместимая запись удаляется и считается промахом
+            connection.execute("DELETE FROM nspd_cache WHERE layer = ? AND registry_number = ?",
+                               (layer, registry_number))
+            return None
+        connection.execute("UPDATE nspd_cache SET accessed = ? WHERE layer = ? AND registry_number = ?",
+                           (now, layer, registry_number))
+        return result
+
+    def put(self, layer: str, registry_number: str, result: Dict[str, Any]) -> None:
+        connection = self._connection()
+        now = time.time()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.execute("INSERT OR REPLACE INTO nspd_cache (layer, registry_number, result, created, accessed) "
+                               "VALUES (?, ?, ?, ?, ?)",
+                               (layer, registry_number, json.dumps(result, ensure_ascii=False), now, now))
+            connection.execute("DELETE FROM nspd_cache WHERE created < ?", (now - self.ttl,))
+            # Сверх max_entries остаются только последние запрошенные записи
+            connection.execute("DELETE FROM nspd_cache WHERE rowid IN "
+                               "(SELECT rowid FROM nspd_cache ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                               (self.max_entries,))
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+
+    def __len__(self) -> int:
+        return self._connection().execute("SELECT COUNT(*) FROM nspd_cache").fetchone()[0]
+
+
+def _with_new_ids(result: Dict[str, Any]) -> Dict[str, Any]:
+    # Каждая загрузка получает свои идентификаторы, как при запросе к НСПД: иначе повторная загрузка того же номера
+    # перезаписала бы объекты в index.json вместо добавления. Контур и его точка сохраняют общий идентификатор
+    new_ids = {key: str(uuid.uuid4()) for key in list(result.get('paths', {})) + list(result.get('points', {}))}
+    result['paths'] = {new_ids[key]: value for key, value in result.get('paths', {}).items()}
+    result['points'] = {new_ids[key]: value for key, value in result.get('points', {}).items()}
+    return result
+
+
+_nspd_cache: Optional[SQLiteNspdCache] = None
+_nspd_cache_lock = threading.Lock()
+
+
+def get_nspd_cache() -> SQLiteNspdCache:
+    global _nspd_cache
+    if _nspd_cache is None:
+        with _nspd_cache_lock:
+            if _nspd_cache is None:
+                _nspd_cache = SQLiteNspdCache()
+    return _nspd_cache
+
+
+def set_nspd_cache(nspd_cache: Optional[SQLiteNspdCache]) -> None:
+    global _nspd_cache
+    with _nspd_cache_lock:
+        _nspd_cache = nspd_cache
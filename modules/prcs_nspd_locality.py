@@ -1,20 +1,20 @@
-import os
-import json
-import uuid
 import logging
 from typing import Dict, Any
 from pynspd import Nspd
 from pynspd.schemas import Layer36281Feature
-from .prcs_geojson import process_geojson
+from .prcs_geojson import process_geojson_feature
 from .prcs_flow import ProcessingError
 
 logger = logging.getLogger(__name__)
 
+# Слой НСПД «Населённые пункты (полигоны)», ключ кэша запросов
+NSPD_LAYER = "36281"
+
 
 def process_nspd_locality(registry_number: str) -> Dict[str, Any]:
     """
-    Получаем данные из НСПД по реестровому номеру, сохраняет во временный GeoJSON
-    и обрабатывает его с помощью process_geojson.
+    Получаем данные из НСПД по реестровому номеру, преобразует
+    геометрию объекта с помощью process_geojson_feature.
     """
     try:
         logger.info(f"Поиск объекта в НСПД по реестровому номеру: {registry_number}")
@@ -36,36 +36,14 @@ def process_nspd_locality(registry_number: str) -> Dict[str, Any]:
                 feature_dict = target_feature.__geo_interface__
             else:
                 feature_dict = target_feature
-        # Оборачиваем в FeatureCollection для корректного чтения geopandas
-        geojson_data = {
-            "type": "FeatureCollection",
-            "features": [feature_dict]
-        }
-        # Сохраняем во временный файл
-        temp_filename = f"nspd_{registry_number}_{uuid.uuid4()}.geojson"
-        temp_path = os.path.join("/tmp", temp_filename)
-
-        with open(temp_path, 'w', encoding='utf-8') as f:
-            json.dump(geojson_data, f, ensure_ascii=False, default=str)
-
-        logger.info(f"Данные сохранены во временный файл: {temp_path}")
-
-        # Обрабатываем как обычный GeoJSON
-        try:
-            result = process_geojson(temp_path)
-            # Обновляем описание, чтобы было понятно, что это из НСПД
-            for point in result.get('points', {}).values():
-                point['desc'] = f"НСПД: {registry_number}"
-
-            # Также обновляем метаданные если нужно
-            if 'metadata' in result:
-                result['metadata'] = [f"НСПД: {registry_number}"] + result['metadata']
-
-            return result
-        finally:
-            # Удаляем временный файл
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
+        # Геометрия конвертируется прямо из словаря объекта; описание точек указывает на источник
+        result = process_geojson_feature(feature_dict, f"НСПД: {registry_number}")
+
+        # Также обновляем метаданные если нужно
+        if 'metadata' in result:
+            result['metadata'] = [f"НСПД: {registry_number}"] + result['metadata']
+
+        return result
 
     except Exception as e:
         logger.error(f"Ошибка при обработке данных НСПД: {e}")
@@ -1,10 +1,9 @@
-import os
 import uuid
 import logging
 import geopandas as gpd
 from shapely.geometry import Polygon
-from typing import Dict, Any
-from .prcs_flow import ProcessingError, ERR_SHAPEFILE
+from typing import Dict, Any, Optional
+from .prcs_flow import ProcessingError, ERR_SHAPEFILE, Source, check_cancelled, open_source, source_name
 
 
 logger = logging.getLogger(__name__)
@@ -14,9 +13,10 @@ logger = logging.getLogger(__name__)
 """
 
 
-def process_zip(zip_path: str) -> Dict[str, Any]:
+def process_zip(source: Source, filename: Optional[str] = None) -> Dict[str, Any]:
+    # Архив по пути читается через zip://, архив в памяти pyogrio распознает сам и читает через /vsizip//vsimem/
     try:
-        gdf = gpd.read_file(f"zip://{zip_path}", encoding='utf-8')
+        gdf = gpd.read_file(f"zip://{source}" if isinstance(source, str) else open_source(source), encoding='utf-8')
     except Exception as e:
         raise ProcessingError(ERR_SHAPEFILE, f"Ошибка чтения ZIP-файла: {str(e)}")
 
@@ -32,6 +32,7 @@ def process_zip(zip_path: str) -> Dict[str, Any]:
     metadata = []
 
     for _, row in gdf.iterrows():
+        check_cancelled()
         geom = row.geometry
         if geom is None or geom.is_empty:
             continue
@@ -105,7 +106,7 @@ def process_zip(zip_path: str) -> Dict[str, Any]:
             desc = ""
 
         if not desc:
-            desc = os.path.basename(zip_path)
+            desc = source_name(source, filename)
         category = row.get('category_t', '')
         title = row.get('title', '')
         if category or title:
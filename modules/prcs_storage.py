@@ -0,0 +1,262 @@
+"""
+Хранилище index.json. Конвейер в prcs_async_log и app.py работает через функции модуля ensure_folder,
+download_index_json_with_revision и update_index_json, а реализация выбирается параметром STORAGE_BACKEND.
+"""
+import copy
+import json
+import logging
+import os
+import random
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Dict, Any, Iterator, Optional, Tuple
+from config import STORAGE_BACKEND, STORAGE_LOCAL_ROOT
+from .prcs_flow import ProcessingError, IndexConflictError, ERR_LOGIC, REVISION_ABSENT, \
+    create_nmap_output_template, merge_nmap_output_template
+from . import prcs_upload
+from .prcs_index_stream import decode_index_stream
+from .prcs_upload import get_current_day_folder_path, get_index_path, DOWNLOAD_CHUNK_SIZE
+
+logger = logging.getLogger(__name__)
+
+
+# Ограничения повторов при конфликте параллельных обновлений index.json
+INDEX_UPDATE_MAX_ATTEMPTS = 5
+INDEX_UPDATE_BACKOFF_BASE = 0.2
+INDEX_UPDATE_BACKOFF_MAX = 3.0
+
+Snapshot = Tuple[Optional[Dict[str, Any]], int]
+
+
+class StorageBackend(ABC):
+
+    @abstractmethod
+    def ensure_folder(self, path: str) -> None:
+        ...
+
+    @abstractmethod
+    def revision(self) -> Optional[int]:
+        """Текущая ревизия index.json, None если файла нет"""
+
+    @abstractmethod
+    def get_index(self) -> Snapshot:
+        """index.json и ревизия, которую видели до чтения; (None, REVISION_ABSENT) если файла нет"""
+
+    @abstractmethod
+    def put_index(self, data: Dict[str, Any], if_revision: Optional[int] = None) -> None:
+        """Записывает index.json; при if_revision, не совпавшей с текущей ревизией, выбрасывает IndexConflictError"""
+
+    def update_index(self, new_data: Dict[str, Any], snapshot: Optional[Snapshot] = None) -> int:
+        """
+        Объединяем new_data с index.json с оптимистичной проверкой ревизии: snapshot — результат get_index(),
+        полученный ранее. Насколько проверка атомарна, зависит от хранилища: у Яндекс Диска остается окно между
+        проверкой ревизии и загрузкой (см. prcs_upload.upload_index_json). При конфликте index.json читается
+        заново, данные объединяются повторно, а попытка повторяется с ограниченной экспоненциальной задержкой
+        со случайным разбросом, чтобы конкурирующие задачи не повторяли друг друга синхронно. Возвращает число
+        попыток.
+        """
+        for attempt in range(1, INDEX_UPDATE_MAX_ATTEMPTS + 1):
+            if snapshot is None:
+                snapshot = self.get_index()
+            current_index, revision = snapshot
+            if current_index is None:
+                current_index = create_nmap_output_template()
+
+            try:
+                self.put_index(merge_nmap_output_template(current_index, new_data), if_revision=revision)
+                return attempt
+            except IndexConflictError as e:
+                if attempt == INDEX_UPDATE_MAX_ATTEMPTS:
+                    raise
+                delay = min(INDEX_UPDATE_BACKOFF_MAX, INDEX_UPDATE_BACKOFF_BASE * 2 ** (attempt - 1))
+                logger.info(f"{e.message}, retrying (attempt {attempt + 1})")
+                time.sleep(random.uniform(0, delay))
+                snapshot = None
+
+        return INDEX_UPDATE_MAX_ATTEMPTS
+
+
+class YandexDiskStorage(StorageBackend):
+
+    def ensure_folder(self, path: str) -> None:
+        prcs_upload.ensure_folder(path)
+
+    def revision(self) -> Optional[int]:
+        return prcs_upload.get_index_revision()
+
+    def get_index(self) -> Snapshot:
+        return prcs_upload.download_index_json_with_revision()
+
+    def put_index(self, data: Dict[str, Any], if_revision: Optional[int] = None) -> None:
+        prcs_upload.upload_index_json(data, if_revision=if_revision)
+
+
+class LocalStorage(StorageBackend):
+    """
+    index.json в папке на локальном диске. Запись атомарная (временный файл + os.replace) и выполняется
+    под файловой блокировкой, поэтому сравнение ревизий корректно и между процессами. Ревизия — mtime файла
+    в наносекундах, при записи она всегда увеличивается.
+    """
+
+    def __init__(self, root: str = STORAGE_LOCAL_ROOT):
+        self.root = root
+        os.makedirs(self.root, exist_ok=True)
+        self._lock_path = os.path.join(self.root, ".index.lock")
+
+    def _local_path(self, path: str) -> str:
+        return os.path.join(self.root, path)
+
+    @contextmanager
+    def _locked(self, exclusive: bool) -> Iterator[None]:
+        with open(self._lock_path, 'a+b') as lock_file:
+            _lock_file(lock_file, exclusive)
+            try:
+                yield
+            finally:
+                _unlock_file(lock_file)
+
+    def _revision(self, index_path: str) -> Optional[int]:
+        try:
+            return os.stat(index_path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def ensure_folder(self, path: str) -> None:
+        os.makedirs(self._local_path(path), exist_ok=True)
+
+    def revision(self) -> Optional[int]:
+        return self._revision(self._local_path(get_index_path()))
+
+    def get_index(self) -> Snapshot:
+        index_path = self._local_path(get_index_path())
+        with self._locked(exclusive=False):
+            revision = self._revision(index_path)
+            if revision is None:
+                return None, REVISION_ABSENT
+            try:
+                with open(index_path, 'rb') as f:
+                    return decode_index_stream(iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b"")), revision
+            except ValueError:
+                raise ProcessingError(ERR_LOGIC, "Failed to parse existing index.json")
+
+    def put_index(self, data: Dict[str, Any], if_revision: Optional[int] = None) -> None:
+        self.ensure_folder(get_current_day_folder_path())
+        index_path = self._local_path(get_index_path())
+
+        with self._locked(exclusive=True):
+            current_revision = self._revision(index_path)
+            if if_revision is not None and (current_revision or REVISION_ABSENT) != if_revision:
+                raise IndexConflictError(
+                    f"index.json was modified concurrently (expected revision {if_revision}, got {current_revision})")
+
+            temp_path = f"{index_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+            new_revision = max(time.time_ns(), (current_revision or 0) + 1)
+            os.utime(temp_path, ns=(new_revision, new_revision))
+            os.replace(temp_path, index_path)
+
+
+def _lock_file(lock_file, exclusive: bool) -> None:
+    # fcntl есть только в Unix, msvcrt — только в Windows, поэтому модуль импортируется при блокировке
+    if os.name == 'nt':
+        import msvcrt
+        # В msvcrt нет разделяемой блокировки: чтение тоже блокирует файл монопольно.
+        # LK_LOCK ждет около 10 секунд и выбрасывает OSError, поэтому ожидание повторяется
+        lock_file.seek(0)
+        while True:
+            try:
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+                return
+            except OSError:
+                continue
+    import fcntl
+    fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+
+
+def _unlock_file(lock_file) -> None:
+    if os.name == 'nt':
+        import msvcrt
+        lock_file.seek(0)
+        msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+        return
+    import fcntl
+    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class MemoryStorage(StorageBackend):
+    """index.json в памяти процесса с целочисленной ревизией"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.folders = set()
+        self._index: Optional[Dict[str, Any]] = None
+        self._revision = REVISION_ABSENT
+
+    def ensure_folder(self, path: str) -> None:
+        with self._lock:
+            self.folders.add(path)
+
+    def revision(self) -> Optional[int]:
+        with self._lock:
+            return self._revision if self._index is not None else None
+
+    def get_index(self) -> Snapshot:
+        with self._lock:
+            if self._index is None:
+                return None, REVISION_ABSENT
+            return copy.deepcopy(self._index), self._revision
+
+    def put_index(self, data: Dict[str, Any], if_revision: Optional[int] = None) -> None:
+        self.ensure_folder(get_current_day_folder_path())
+        with self._lock:
+            if if_revision is not None and self._revision != if_revision:
+                raise IndexConflictError(
+                    f"index.json was modified concurrently (expected revision {if_revision}, got {self._revision})")
+            self._index = copy.deepcopy(data)
+            self._revision += 1
+
+
+STORAGE_BACKENDS = {
+    'yandex': YandexDiskStorage,
+    'local': LocalStorage,
+    'memory': MemoryStorage,
+}
+
+_storage: Optional[StorageBackend] = None
+_storage_lock = threading.Lock()
+
+
+def create_storage(name: str) -> StorageBackend:
+    if name not in STORAGE_BACKENDS:
+        raise ProcessingError(ERR_LOGIC, f"Unknown storage backend: {name}")
+    return STORAGE_BACKENDS[name]()
+
+
+def get_storage() -> StorageBackend:
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                _storage = create_storage(STORAGE_BACKEND)
+    return _storage
+
+
+def set_storage(storage: Optional[StorageBackend]) -> None:
+    global _storage
+    with _storage_lock:
+        _storage = storage
+
+
+def ensure_folder(path: str) -> None:
+    get_storage().ensure_folder(path)
+
+
+def download_index_json_with_revision() -> Snapshot:
+    return get_storage().get_index()
+
+
+def update_index_json(new_data: Dict[str, Any], snapshot: Optional[Snapshot] = None) -> int:
+    return get_storage().update_index(new_data, snapshot)
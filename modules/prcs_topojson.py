@@ -1,10 +1,9 @@
-import os
 import uuid
 import logging
 import geopandas as gpd
 from shapely.geometry import Polygon
-from typing import Dict, Any
-from .prcs_flow import ProcessingError, ERR_SHAPEFILE
+from typing import Dict, Any, Optional
+from .prcs_flow import ProcessingError, ERR_SHAPEFILE, Source, check_cancelled, open_source, source_name
 
 
 logger = logging.getLogger(__name__)
@@ -14,9 +13,10 @@ logger = logging.getLogger(__name__)
 """
 
 
-def process_topojson(file_path: str) -> Dict[str, Any]:
+def process_topojson(source: Source, filename: Optional[str] = None) -> Dict[str, Any]:
+    # source — путь, bytes или двоичный файл; содержимое в памяти pyogrio читает через /vsimem/ без записи на диск
     try:
-        gdf = gpd.read_file(file_path, encoding='utf-8')
+        gdf = gpd.read_file(open_source(source), encoding='utf-8')
     except Exception as e:
         raise ProcessingError(ERR_SHAPEFILE, f"Ошибка чтения файла: {str(e)}")
 
@@ -32,6 +32,7 @@ def process_topojson(file_path: str) -> Dict[str, Any]:
     metadata = []
 
     for _, row in gdf.iterrows():
+        check_cancelled()
         geom = row.geometry
         if geom is None or geom.is_empty:
             continue
@@ -64,7 +65,7 @@ def process_topojson(file_path: str) -> Dict[str, Any]:
                 current_feature_paths.append(list(line.coords))
 
         # Генерируем описание объекта из названия файла
-        desc = os.path.basename(file_path)
+        desc = source_name(source, filename)
 
         category = row.get('category_t', '')
         title = row.get('title', '')
@@ -1,18 +1,134 @@
 import requests
+import gzip
 import json
 import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextvars import copy_context
 from datetime import datetime
-from typing import Dict, Any, Optional
-from config import YANDEX_DISK_API_KEY
-from .prcs_flow import ProcessingError, ERR_NETWORK
+from typing import Dict, Any, Optional, Tuple
+from urllib.parse import urlsplit
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from config import YANDEX_DISK_API_KEY, YANDEX_DISK_API_URL, YANDEX_DISK_POOL_SIZE, YANDEX_DISK_TIMEOUT, \
+    YANDEX_DISK_RETRIES, YANDEX_DISK_BACKOFF, YANDEX_DISK_FOLDER_CACHE_TTL, YANDEX_DISK_GZIP_UPLOAD
+from .prcs_flow import ProcessingError, IndexConflictError, ERR_NETWORK, REVISION_ABSENT
+from .prcs_index_stream import decode_index_stream
 
 BASE_FOLDER_PATH = "Приложения/Блокнот картографа Народной карты"
-API_BASE_URL = "https://cloud-api.yandex.net/v1/disk/resources"
+API_BASE_URL = YANDEX_DISK_API_URL
+INDEX_FILE_NAME = "index.json"
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
 
 # Configure logging
 
 logger = logging.getLogger(__name__)
 
+# Сводка по объему переданных данных попадает в лог задачи
+TRANSFER_LOGGER_NAME = f"{__name__}.transfer"
+transfer_logger = logging.getLogger(TRANSFER_LOGGER_NAME)
+
+# Независимые запросы одной операции с Диском выполняются параллельно; задачи этого пула не ставят в него новые
+_request_executor = ThreadPoolExecutor(max_workers=YANDEX_DISK_POOL_SIZE, thread_name_prefix='disk-request')
+
+
+class YandexDiskClient:
+    """
+    Долгоживущий HTTP-клиент Яндекс Диска: одна requests.Session с пулом keep-alive соединений, поэтому запросы
+    задачи не открывают каждый раз новое TCP+TLS соединение. Сетевые ошибки и ответы 429/5xx повторяются
+    с экспоненциальной задержкой, время каждого запроса пишется в лог.
+    """
+
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+    def __init__(self, pool_size: int = YANDEX_DISK_POOL_SIZE, timeout=YANDEX_DISK_TIMEOUT,
+                 retries: int = YANDEX_DISK_RETRIES, backoff: float = YANDEX_DISK_BACKOFF):
+        self.timeout = timeout
+        self.session = requests.Session()
+
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff,
+            status_forcelist=self.RETRY_STATUSES,
+            allowed_methods=frozenset({"GET", "PUT"}),
+            respect_retry_after_header=True,
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        kwargs.setdefault("timeout", self.timeout)
+        started = time.perf_counter()
+        try:
+            response = self.session.request(method, url, **kwargs)
+        except requests.RequestException as e:
+            raise ProcessingError(ERR_NETWORK, f"{method} request to {urlsplit(url).netloc} failed: {e}")
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        logger.info(f"{method} {urlsplit(url).path} -> {response.status_code} in {elapsed_ms:.0f} ms")
+        return response
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def put(self, url: str, **kwargs) -> requests.Response:
+        return self.request("PUT", url, **kwargs)
+
+    def close(self) -> None:
+        self.session.close()
+
+
+class FolderCache:
+    """
+    Потокобезопасный кэш папок, существование которых уже подтверждено. Запись устаревает через ttl секунд
+    или при смене дня, а любой 404 от Диска сбрасывает кэш целиком, так что удаленная папка будет создана снова.
+    """
+
+    def __init__(self, ttl: float = YANDEX_DISK_FOLDER_CACHE_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Tuple[float, str]] = {}
+
+    def contains(self, path: str) -> bool:
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is None:
+                return False
+            checked_at, day = entry
+            if time.monotonic() - checked_at > self.ttl or day != datetime.now().strftime("%Y-%m-%d"):
+                del self._entries[path]
+                return False
+            return True
+
+    def add(self, path: str) -> None:
+        with self._lock:
+            self._entries[path] = (time.monotonic(), datetime.now().strftime("%Y-%m-%d"))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+_folder_cache = FolderCache()
+_client: Optional[YandexDiskClient] = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> YandexDiskClient:
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = YandexDiskClient()
+    return _client
+
+
+def clear_folder_cache() -> None:
+    _folder_cache.clear()
+
 
 def get_headers() -> Dict[str, str]:
     return {
@@ -27,19 +143,41 @@ def get_current_day_folder_path() -> str:
     return f"{BASE_FOLDER_PATH}/{today_str}"
 
 
+def get_index_path() -> str:
+    return f"{get_current_day_folder_path()}/{INDEX_FILE_NAME}"
+
+
+def _format_size(size: int) -> str:
+    if size >= 1024 * 1024:
+        return f"{size / (1024 * 1024):.1f} МБ"
+    return f"{size / 1024:.1f} КБ"
+
+
+def _log_transfer(action: str, raw_size: int, wire_size: int, elapsed: float) -> None:
+    message = f"index.json {action}: {_format_size(wire_size)} по сети за {elapsed:.2f} с"
+    if 0 < wire_size < raw_size:
+        # Оценка: без сжатия передача заняла бы время, пропорциональное несжатому объему
+        saved = elapsed * (raw_size - wire_size) / wire_size
+        message += f", gzip {_format_size(raw_size)} → {_format_size(wire_size)}, сэкономлено ≈{saved:.2f} с"
+    transfer_logger.info(message)
+
+
 def ensure_folder(path: str) -> None:
+    if _folder_cache.contains(path):
+        return
+
     headers = get_headers()
 
     # Проверяем есть ли папка
     check_url = f"{API_BASE_URL}?path={path}"
-    response = requests.get(check_url, headers=headers)
+    response = get_client().get(check_url, headers=headers)
 
     if response.status_code == 200:
         logger.info(f"Folder {path} already exists.")
-        return
     elif response.status_code == 404:
+        _folder_cache.clear()
         create_url = f"{API_BASE_URL}?path={path}"
-        create_response = requests.put(create_url, headers=headers)
+        create_response = get_client().put(create_url, headers=headers)
 
         if create_response.status_code == 201:
             logger.info(f"Folder {path} created.")
@@ -50,32 +188,75 @@ def ensure_folder(path: str) -> None:
     else:
         raise ProcessingError(ERR_NETWORK, f"Failed to check folder {path}: {response.text}")
 
+    _folder_cache.add(path)
+
+
+def submit_request(fn, *args, **kwargs) -> Future:
+    # Контекст задачи передается в поток пула, чтобы логи запроса попадали в лог задачи
+    return _request_executor.submit(copy_context().run, fn, *args, **kwargs)
+
+
+# Получаем текущую ревизию index.json, None если файла нет
+def get_index_revision() -> Optional[int]:
+    file_path = get_index_path()
+    headers = get_headers()
+
+    meta_url = f"{API_BASE_URL}?path={file_path}&fields=revision"
+    response = get_client().get(meta_url, headers=headers)
+
+    if response.status_code == 200:
+        revision = response.json().get("revision")
+        if revision is None:
+            raise ProcessingError(ERR_NETWORK, "Failed to get revision of index.json")
+        return revision
+    elif response.status_code == 404:
+        # Индекса дня еще нет — это не говорит об отсутствии папки, кэш папок не сбрасывается
+        return None
+    else:
+        raise ProcessingError(ERR_NETWORK, f"Failed to check index.json revision: {response.text}")
+
 
 # Скачиваем index.json если он есть в базовой папке диска
 def download_index_json() -> Optional[Dict[str, Any]]:
-    folder_path = get_current_day_folder_path()
-    file_path = f"{folder_path}/index.json"
+    file_path = get_index_path()
     headers = get_headers()
 
     # Получаем ссылку для скачивания
     download_url_req = f"{API_BASE_URL}/download?path={file_path}"
-    response = requests.get(download_url_req, headers=headers)
+    response = get_client().get(download_url_req, headers=headers)
 
     if response.status_code == 200:
         href = response.json().get("href")
         if not href:
             raise ProcessingError(ERR_NETWORK, "Failed to get download link for index.json")
 
-        # Скачиваем файл
-        file_response = requests.get(href)
-        if file_response.status_code == 200:
-            try:
-                return file_response.json()
-            except json.JSONDecodeError:
-                raise ProcessingError(ERR_NETWORK, "Failed to parse existing index.json")
-        else:
+        # Скачиваем файл. requests сам запрашивает gzip (Accept-Encoding: gzip, deflate) и распаковывает ответ
+        # по мере чтения; лог сравнивает объем по сети с распакованным
+        started = time.perf_counter()
+        file_response = get_client().get(href, stream=True)
+        if file_response.status_code != 200:
+            file_response.close()
             raise ProcessingError(ERR_NETWORK, f"Failed to download index.json content: {file_response.status_code}")
 
+        # Тело разбирается по мере чтения, без промежуточной копии всего ответа в памяти
+        received = 0
+
+        def counted_chunks():
+            nonlocal received
+            for chunk in file_response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                received += len(chunk)
+                yield chunk
+
+        try:
+            data = decode_index_stream(counted_chunks())
+        except ValueError:
+            raise ProcessingError(ERR_NETWORK, "Failed to parse existing index.json")
+        finally:
+            file_response.close()
+
+        _log_transfer("скачан", received, file_response.raw.tell(), time.perf_counter() - started)
+        return data
+
     elif response.status_code == 404:
         logger.info("index.json not found, starting fresh.")
         return None
@@ -83,31 +264,87 @@ def download_index_json() -> Optional[Dict[str, Any]]:
         raise ProcessingError(ERR_NETWORK, f"Failed to check index.json: {response.text}")
 
 
+def download_index_json_with_revision() -> Tuple[Optional[Dict[str, Any]], int]:
+    """
+    Скачиваем index.json вместе с ревизией, которую видели до скачивания. Если файл изменится между
+    запросами, ревизия окажется устаревшей и загрузка завершится конфликтом, а не потерей данных.
+    """
+    revision = get_index_revision()
+    if revision is None:
+        return None, REVISION_ABSENT
+
+    data = download_index_json()
+    if data is None:
+        return None, REVISION_ABSENT
+    return data, revision
+
+
+# Диск отвечает 409 и на уже существующий файл, и на отсутствующую родительскую папку
+def _is_missing_path_error(response: requests.Response) -> bool:
+    try:
+        return response.json().get("error") == "DiskPathDoesntExistsError"
+    except ValueError:
+        return False
+
+
 # Загружаем index.json в базовую папку диска
-def upload_index_json(data: Dict[str, Any]) -> None:
+def upload_index_json(data: Dict[str, Any], if_revision: Optional[int] = None) -> None:
+    """
+    if_revision=None перезаписывает файл без проверок. Иначе загрузка выполняется только если ревизия
+    index.json на диске совпадает с if_revision (REVISION_ABSENT — файла еще нет), в противном случае
+    выбрасывается IndexConflictError.
+
+    Для нового файла проверку выполняет сам Диск (overwrite=false). Для существующего файла API не поддерживает
+    условную загрузку, поэтому ревизия сверяется отдельным запросом непосредственно перед PUT: это оптимистичная
+    проверка, а не атомарная замена. Запись, выполненная другим процессом между проверкой и PUT, будет
+    перезаписана; окно сведено к одному запросу ревизии перед загрузкой уже подготовленного тела.
+    """
     folder_path = get_current_day_folder_path()
     ensure_folder(folder_path)
 
-    file_path = f"{folder_path}/index.json"
+    file_path = get_index_path()
     headers = get_headers()
 
-    # Получаем ссылку для загрузки
-    upload_url_req = f"{API_BASE_URL}/upload?path={file_path}&overwrite=true"
-    response = requests.get(upload_url_req, headers=headers)
+    # Для отсутствующего файла конфликт проверяет сам Диск: overwrite=false вернет 409, если файл уже создан
+    overwrite = "false" if if_revision == REVISION_ABSENT else "true"
+
+    # Ссылка для загрузки запрашивается в фоне, пока тело сериализуется и сверяется ревизия
+    upload_url_req = f"{API_BASE_URL}/upload?path={file_path}&overwrite={overwrite}"
+    link_future = submit_request(get_client().get, upload_url_req, headers=headers)
+
+    json_data = json.dumps(data, ensure_ascii=False, indent=2).encode('utf-8')
+    body, upload_headers = json_data, {}
+    if YANDEX_DISK_GZIP_UPLOAD:
+        body = gzip.compress(json_data, compresslevel=5)
+        upload_headers["Content-Encoding"] = "gzip"
+
+    # Ревизия проверяется вместе с запросом ссылки непосредственно перед PUT, чтобы окно гонки было минимальным
+    check_revision = if_revision is not None and if_revision != REVISION_ABSENT
+    current_revision = get_index_revision() if check_revision else None
+    response = link_future.result()
 
     if response.status_code == 200:
         href = response.json().get("href")
         if not href:
             raise ProcessingError(ERR_NETWORK, "Failed to get upload link for index.json")
 
-        # Загружаем и конвертируем файл
-        json_data = json.dumps(data, ensure_ascii=False, indent=2)
+        if check_revision and current_revision != if_revision:
+            raise IndexConflictError(
+                f"index.json was modified concurrently (expected revision {if_revision}, got {current_revision})")
 
-        upload_response = requests.put(href, data=json_data.encode('utf-8'))
+        started = time.perf_counter()
+        upload_response = get_client().put(href, data=body, headers=upload_headers)
+        _log_transfer("загружен", len(json_data), len(body), time.perf_counter() - started)
 
         if upload_response.status_code in [201, 202, 200]:
             logger.info("index.json uploaded successfully.")
         else:
             raise ProcessingError(ERR_NETWORK, f"Failed to upload index.json content: {upload_response.status_code}")
+    elif response.status_code == 409 and _is_missing_path_error(response):
+        _folder_cache.clear()
+        raise ProcessingError(ERR_NETWORK, f"Failed to get upload link, folder is missing: {response.text}")
+    elif response.status_code == 409 and if_revision == REVISION_ABSENT:
+        raise IndexConflictError("index.json was created concurrently")
     else:
         raise ProcessingError(ERR_NETWORK, f"Failed to get upload link: {response.text}")
+
@@ -1,10 +1,10 @@
-import os
+import io
 import uuid
 import logging
 from shapely import wkt
 from shapely.geometry import Polygon
-from typing import Dict, Any
-from .prcs_flow import ProcessingError, ERR_SHAPEFILE
+from typing import Dict, Any, Optional
+from .prcs_flow import ProcessingError, ERR_SHAPEFILE, Source, check_cancelled, read_source, source_name
 
 
 logger = logging.getLogger(__name__)
@@ -14,10 +14,10 @@ logger = logging.getLogger(__name__)
 """
 
 
-def process_wkt(file_path: str) -> Dict[str, Any]:
+def process_wkt(source: Source, filename: Optional[str] = None) -> Dict[str, Any]:
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            lines = f.readlines()
+        # Строки разбиваются как при чтении файла в текстовом режиме: только по \n, \r\n и \r
+        lines = io.TextIOWrapper(io.BytesIO(read_source(source)), encoding='utf-8').readlines()
     except Exception as e:
         raise ProcessingError(ERR_SHAPEFILE, f"Ошибка чтения файла: {str(e)}")
 
@@ -29,9 +29,10 @@ def process_wkt(file_path: str) -> Dict[str, Any]:
     metadata = []
 
     # Генерируем описание объекта из названия файла
-    desc = os.path.basename(file_path)
+    desc = source_name(source, filename)
 
     for line_num, line in enumerate(lines, 1):
+        check_cancelled()
         line = line.strip()
 
         # Пропускаем если решетка
@@ -5,6 +5,12 @@ import json
 from io import BytesIO
 from unittest.mock import patch, MagicMock, Mock
 from app import app, allowed_file
+from werkzeug.datastructures import Headers
+from werkzeug.sansio.multipart import MultipartEncoder, Preamble, File, Data
+from modules.prcs_jobs import JobRegistry
+from modules.prcs_storage import MemoryStorage, set_storage
+from modules.prcs_event_log import SQLiteEventLog, set_event_log
+from modules.prcs_job_queue import SQLiteJobQueue
 
 
 class TestApp(unittest.TestCase):
@@ -13,6 +19,10 @@ class TestApp(unittest.TestCase):
         self.app = app
         self.app.config['TESTING'] = True
         self.client = self.app.test_client()
+        # Задачи не запускаются в фоне и не обращаются к сети после завершения теста
+        patcher = patch('app.get_job_executor')
+        self.mock_get_executor = patcher.start()
+        self.addCleanup(patcher.stop)
 
     def test_allowed_file_valid_extensions(self):
         # Проверка допустимых расширений файлов
@@ -54,13 +64,13 @@ class TestApp(unittest.TestCase):
         self.assertIn(b'<!DOCTYPE html>', response.data)
 
     @patch('app.ensure_folder')
-    @patch('app.download_index_json')
-    @patch('app.upload_index_json')
+    @patch('app.download_index_json_with_revision')
+    @patch('app.update_index_json')
     @patch('app.process_gpx')
     def test_index_post_with_gpx_file(self, mock_process_gpx, mock_upload, mock_download, mock_ensure):
         # Проверка POST-запроса с файлом GPX
         mock_ensure.return_value = None
-        mock_download.return_value = {"paths": {}, "points": {}}
+        mock_download.return_value = ({"paths": {}, "points": {}}, 1)
         mock_upload.return_value = None
         mock_process_gpx.return_value = {
             "paths": {"uuid1": [[37.6173, 55.7558]]},
@@ -98,7 +108,7 @@ class TestApp(unittest.TestCase):
         self.assertIn(b'Yandex.Disk Error', response.data)
 
     @patch('app.ensure_folder')
-    @patch('app.download_index_json')
+    @patch('app.download_index_json_with_revision')
     def test_index_post_download_error(self, mock_download, mock_ensure):
         # Проверка POST-запроса с ошибкой загрузки index.json
         from modules.prcs_flow import ProcessingError, ERR_NETWORK
@@ -114,14 +124,14 @@ class TestApp(unittest.TestCase):
         self.assertIn(b'Failed to retrieve index.json', response.data)
 
     @patch('app.ensure_folder')
-    @patch('app.download_index_json')
-    @patch('app.upload_index_json')
+    @patch('app.download_index_json_with_revision')
+    @patch('app.update_index_json')
     @patch('app.process_gpx')
     def test_index_post_processing_error(self, mock_process_gpx, mock_upload, mock_download, mock_ensure):
         # Проверка POST-запроса с ошибкой обработки файла
         from modules.prcs_flow import ProcessingError, ERR_SHAPEFILE
         mock_ensure.return_value = None
-        mock_download.return_value = {"paths": {}, "points": {}}
+        mock_download.return_value = ({"paths": {}, "points": {}}, 1)
         mock_process_gpx.side_effect = ProcessingError(ERR_SHAPEFILE, "Invalid file")
 
         data = {
@@ -144,14 +154,14 @@ class TestApp(unittest.TestCase):
         self.assertIn(b'Invalid file type', response.data)
 
     @patch('app.ensure_folder')
-    @patch('app.download_index_json')
-    @patch('app.upload_index_json')
+    @patch('app.download_index_json_with_revision')
+    @patch('app.update_index_json')
     @patch('app.process_geojson')
     @patch('app.process_gpx')
     def test_index_post_multiple_files(self, mock_gpx, mock_geojson, mock_upload, mock_download, mock_ensure):
         # Проверка POST-запроса с несколькими файлами
         mock_ensure.return_value = None
-        mock_download.return_value = {"paths": {}, "points": {}}
+        mock_download.return_value = ({"paths": {}, "points": {}}, 1)
         mock_upload.return_value = None
 
         mock_gpx.return_value = {
@@ -184,6 +194,38 @@ class TestApp(unittest.TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.content_type, 'text/event-stream; charset=utf-8')
 
+    def test_stream_logs_replay(self):
+        # Проверка повторной отправки лога нескольким подписчикам и продолжения с Last-Event-ID
+        registry = JobRegistry()
+        job = registry.create()
+        for message in ("a", "b", "c"):
+            job.log_queue.put({"level": "info", "message": message})
+        job.log_queue.put(None)
+
+        with patch('app.get_job_registry', return_value=registry):
+            first = self.client.get(f'/stream-logs/{job.id}').get_data(as_text=True)
+            second = self.client.get(f'/stream-logs/{job.id}').get_data(as_text=True)
+            resumed = self.client.get(f'/stream-logs/{job.id}', headers={'Last-Event-ID': '2'}).get_data(as_text=True)
+
+        self.assertEqual(first, second)
+        self.assertIn('id: 1\ndata: {"level": "info", "message": "a"}', first)
+        self.assertTrue(first.endswith("event: end\ndata: {}\n\n"))
+        self.assertNotIn('"a"', resumed)
+        self.assertIn('id: 3\ndata: {"level": "info", "message": "c"}', resumed)
+
+    @patch('modules.prcs_async_log.SSE_HEARTBEAT_INTERVAL', 0.01)
+    def test_stream_logs_heartbeat(self):
+        # Проверка heartbeat в простаивающем соединении
+        registry = JobRegistry()
+        job = registry.create()
+        with patch('app.get_job_registry', return_value=registry):
+            response = self.client.get(f'/stream-logs/{job.id}')
+            chunks = response.response
+            self.assertEqual(next(chunks), b": heartbeat\n\n")
+            job.log_queue.put({"level": "info", "message": "a"})
+            self.assertTrue(next(chunks).startswith(b"id: 1\n"))
+            response.close()
+
     @patch('app.allowed_file')
     def test_upload_async_endpoint(self, mock_allowed):
         # Проверка async upload endpoint
@@ -226,15 +268,217 @@ class TestApp(unittest.TestCase):
         response_data = json.loads(response.data)
         self.assertIn('session_id', response_data)
 
+    @patch('app.allowed_file')
+    @patch('app.get_job_executor')
+    def test_upload_async_queue_full(self, mock_get_executor, mock_allowed):
+        # Проверка ответа 429, когда очередь задач заполнена
+        from modules.prcs_flow import JobQueueFullError
+        mock_allowed.return_value = True
+        mock_get_executor.return_value.submit.side_effect = JobQueueFullError(15)
+
+        data = {
+            'files': (BytesIO(b'test'), 'test.gpx')
+        }
+
+        registry = JobRegistry()
+        # Файл больше предела памяти сохраняется во временный файл, который удаляется при отказе
+        with patch('app.get_job_registry', return_value=registry), patch('app.UPLOAD_MEMORY_LIMIT', 2), \
+                patch('app.UPLOAD_STREAMING', False):
+            response = self.client.post('/upload-async', data=data, content_type='multipart/form-data')
+        self.assertEqual(registry.stats()['jobs'], 0)
+
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.headers['Retry-After'], '15')
+        self.assertIn('error', json.loads(response.data))
+        saved_path = mock_get_executor.return_value.submit.call_args[0][3][0][0]
+        self.assertIsInstance(saved_path, str)
+        self.assertFalse(os.path.exists(saved_path))
+
+    @patch('app.allowed_file')
+    def test_upload_async_keeps_small_files_in_memory(self, mock_allowed):
+        # Файл не больше UPLOAD_MEMORY_LIMIT передается задаче содержимым, без временного файла
+        mock_allowed.return_value = True
+        data = {'files': [(BytesIO(b'small'), 'small.gpx'), (BytesIO(b'large file'), 'large.gpx')]}
+
+        with patch('app.UPLOAD_MEMORY_LIMIT', 5), patch('app.UPLOAD_STREAMING', False):
+            response = self.client.post('/upload-async', data=data, content_type='multipart/form-data')
+
+        self.assertEqual(response.status_code, 200)
+        temp_files = self.mock_get_executor.return_value.submit.call_args[0][3]
+        self.assertEqual(temp_files[0], (b'small', 'small.gpx'))
+        large_path, _ = temp_files[1]
+        self.assertTrue(os.path.exists(large_path))
+        os.remove(large_path)
+
+    def test_upload_async_streaming(self):
+        # Задача ставится до чтения тела, файлы передаются ей через UploadFeed по мере приема
+        data = {'files': [(BytesIO(b'track'), 'a.gpx'), (BytesIO(b'x'), 'b.exe'), (BytesIO(b'wkt'), 'c.wkt')]}
+
+        response = self.client.post('/upload-async', data=data, content_type='multipart/form-data')
+
+        self.assertEqual(response.status_code, 200)
+        feed = self.mock_get_executor.return_value.submit.call_args[0][3]
+        self.assertEqual(feed.wait(0), ([(b'track', 'a.gpx'), (b'wkt', 'c.wkt')], True))
+
+    def test_upload_async_truncated_body_not_saved(self):
+        # Оборванное тело запроса: задача отменяется, уже принятые файлы не сохраняются в index.json
+        registry = JobRegistry()
+        storage = MemoryStorage()
+        set_storage(storage)
+        self.addCleanup(set_storage, None)
+        encoder = MultipartEncoder(b'bound')
+        body = b''.join([encoder.send_event(Preamble(data=b'')),
+                         encoder.send_event(File(name='files', filename='a.gpx', headers=Headers())),
+                         encoder.send_event(Data(data=b'track', more_data=False)),
+                         encoder.send_event(File(name='files', filename='b.gpx', headers=Headers())),
+                         encoder.send_event(Data(data=b'partial', more_data=True))])
+        result = {"paths": {"a": [[0, 0]]}, "points": {}, "metadata": []}
+
+        with patch('app.get_job_registry', return_value=registry), \
+                patch.dict('modules.prcs_async_log.FILE_PROCESSORS', {'.gpx': (lambda *args: result, 'GPX')}):
+            response = self.client.post('/upload-async', data=body,
+                                        content_type='multipart/form-data; boundary=bound')
+            run, log_queue, job_id, feed = self.mock_get_executor.return_value.submit.call_args[0]
+            run(log_queue, job_id, feed)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(feed.aborted)
+        job = registry.get(job_id).to_dict()
+        self.assertEqual((job['state'], job['error']), ('cancelled', "Прием файлов прерван, результаты не сохраняются"))
+        self.assertIsNone(storage.get_index()[0])
+
+    def test_jobs_stats(self):
+        # Проверка счетчиков задач для мониторинга
+        registry = JobRegistry()
+        registry.create()
+        with patch('app.get_job_registry', return_value=registry), patch('app.get_job_executor') as mock_executor:
+            mock_executor.return_value.queued.return_value = 0
+            response = self.client.get('/stats/jobs')
+
+        self.assertEqual(response.status_code, 200)
+        stats = json.loads(response.data)
+        self.assertEqual(stats['jobs'], 1)
+        self.assertEqual(stats['queued'], 1)
+        self.assertEqual(stats['executor_queued'], 0)
+
+    def test_job_status(self):
+        # Состояние задачи по идентификатору, 404 для неизвестной задачи
+        registry = JobRegistry()
+        job = registry.create()
+        with patch('app.get_job_registry', return_value=registry):
+            response = self.client.get(f'/jobs/{job.id}')
+            missing = self.client.get('/jobs/unknown')
+
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertEqual((data['id'], data['state'], data['files']), (job.id, 'queued', []))
+        self.assertEqual(missing.status_code, 404)
+
+    def test_cancel_job(self):
+        # DELETE /jobs/<id> отменяет задачу; 409 для завершенной, 404 для неизвестной
+        registry = JobRegistry()
+        job = registry.create()
+        finished = registry.create()
+        registry.run(finished.id, lambda log_queue: None, finished.log_queue)
+        with patch('app.get_job_registry', return_value=registry):
+            response = self.client.delete(f'/jobs/{job.id}')
+            conflict = self.client.delete(f'/jobs/{finished.id}')
+            missing = self.client.delete('/jobs/unknown')
+
+        self.assertEqual(response.status_code, 202)
+        self.assertTrue(json.loads(response.data)['cancelled'])
+        self.assertTrue(job.cancel_event.is_set())
+        self.mock_get_executor.return_value.cancel_pending.assert_called_once_with(job.cancel_event)
+        self.assertEqual(conflict.status_code, 409)
+        self.assertEqual(missing.status_code, 404)
+
+    @patch('app.get_job_queue')
+    def test_upload_nspd_async_sqlite_queue(self, mock_get_queue):
+        # В режиме sqlite задача записывается в очередь обработчиков, а не в пул потоков
+        with patch('app.JOB_QUEUE_BACKEND', 'sqlite'):
+            response = self.client.post('/upload-nspd-async', data={'registry_number': '123'})
+
+        self.assertEqual(response.status_code, 200)
+        session_id = json.loads(response.data)['session_id']
+        mock_get_queue.return_value.enqueue.assert_called_once_with(session_id, 'nspd', ['123'])
+        self.mock_get_executor.return_value.submit.assert_not_called()
+
+    def test_cancel_queued_sqlite_job_ends_stream(self):
+        # Задача, отмененная в очереди SQLite, завершает SSE-поток, а не шлет heartbeat бесконечно
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        event_log = SQLiteEventLog(os.path.join(directory.name, 'events.sqlite3'))
+        job_queue = SQLiteJobQueue(os.path.join(directory.name, 'jobs.sqlite3'))
+        set_event_log(event_log)
+        self.addCleanup(set_event_log, None)
+        with patch('app.JOB_QUEUE_BACKEND', 'sqlite'), patch('app.JOB_EVENT_BUS', 'sqlite'), \
+                patch('modules.prcs_jobs.JOB_EVENT_BUS', 'sqlite'), \
+                patch('modules.prcs_job_queue.JOB_EVENT_BUS', 'sqlite'), \
+                patch('app.get_job_queue', return_value=job_queue):
+            session_id = json.loads(self.client.post('/upload-nspd-async', data={'registry_number': '1'}).data)[
+                'session_id']
+            response = self.client.delete(f'/jobs/{session_id}')
+            stream = self.client.get(f'/stream-logs/{session_id}').get_data(as_text=True)
+
+        self.assertEqual(response.status_code, 202)
+        self.assertIn(json.dumps("✗ Задача отменена до запуска"), stream)
+        self.assertTrue(stream.endswith("event: end\ndata: {}\n\n"))
+
+    @patch('app.get_job_queue')
+    def test_jobs_list_sqlite_queue(self, mock_get_queue):
+        # В режиме sqlite список задач строится по очереди, без аргументов задач
+        mock_get_queue.return_value.list.return_value = (1, [{"id": "a", "state": "running", "args": [["/tmp/x"]]}])
+        with patch('app.JOB_QUEUE_BACKEND', 'sqlite'):
+            response = self.client.get('/jobs?state=running')
+
+        mock_get_queue.return_value.list.assert_called_once_with(0, 50, 'running')
+        self.assertEqual(json.loads(response.data)['jobs'], [{"id": "a", "state": "running"}])
+
+    @patch('app.get_job_queue')
+    def test_job_status_sqlite_hides_args(self, mock_get_queue):
+        # Аргументы задачи из очереди содержат пути временных файлов и не отдаются через API
+        mock_get_queue.return_value.get.return_value = {"id": "a", "state": "queued",
+                                                        "args": [[["/tmp/upload", "track.gpx"]]]}
+        with patch('app.JOB_QUEUE_BACKEND', 'sqlite'):
+            response = self.client.get('/jobs/a')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data), {"id": "a", "state": "queued"})
+
+    def test_jobs_list(self):
+        # Пагинация списка задач с ограничением limit
+        registry = JobRegistry()
+        for _ in range(3):
+            registry.create()
+        with patch('app.get_job_registry', return_value=registry):
+            response = self.client.get('/jobs?offset=1&limit=1000&state=queued')
+
+        data = json.loads(response.data)
+        self.assertEqual((data['total'], data['offset'], data['limit']), (3, 1, 200))
+        self.assertEqual(len(data['jobs']), 2)
+        self.assertNotIn('files', data['jobs'][0])
+
+    @patch('app.get_job_executor')
+    def test_upload_nspd_async_submits_job(self, mock_get_executor):
+        # Проверка постановки задачи НСПД в общий пул
+        from app import process_nspd_async
+        response = self.client.post('/upload-nspd-async', data={'registry_number': '23:01-4.9'})
+
+        self.assertEqual(response.status_code, 200)
+        session_id = json.loads(response.data)['session_id']
+        mock_get_executor.return_value.submit.assert_called_once()
+        self.assertEqual(mock_get_executor.return_value.submit.call_args[0][0].args, (session_id, process_nspd_async))
+        self.assertEqual(mock_get_executor.return_value.submit.call_args[0][2:], (session_id, '23:01-4.9'))
+
     @patch('app.ensure_folder')
-    @patch('app.download_index_json')
-    @patch('app.upload_index_json')
+    @patch('app.download_index_json_with_revision')
+    @patch('app.update_index_json')
     @patch('app.process_gpx')
     def test_index_post_upload_error(self, mock_process_gpx, mock_upload, mock_download, mock_ensure):
         # Проверка POST-запроса с ошибкой загрузки index.json
         from modules.prcs_flow import ProcessingError, ERR_NETWORK
         mock_ensure.return_value = None
-        mock_download.return_value = {"paths": {}, "points": {}}
+        mock_download.return_value = ({"paths": {}, "points": {}}, 1)
         mock_process_gpx.return_value = {
             "paths": {"uuid1": [[37.6173, 55.7558]]},
             "points": {"uuid1": {"coords": [37.6173, 55.7558], "desc": "Test"}},
@@ -251,13 +495,13 @@ class TestApp(unittest.TestCase):
         self.assertIn(b'Failed to save results to Yandex.Disk', response.data)
 
     @patch('app.ensure_folder')
-    @patch('app.download_index_json')
-    @patch('app.upload_index_json')
+    @patch('app.download_index_json_with_revision')
+    @patch('app.update_index_json')
     @patch('app.process_gpx')
     def test_index_post_creates_new_index_if_none(self, mock_process_gpx, mock_upload, mock_download, mock_ensure):
         # Проверка POST-запроса с созданием нового index.json
         mock_ensure.return_value = None
-        mock_download.return_value = None
+        mock_download.return_value = (None, 0)
         mock_upload.return_value = None
         mock_process_gpx.return_value = {
             "paths": {"uuid1": [[37.6173, 55.7558]]},
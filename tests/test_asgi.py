@@ -0,0 +1,164 @@
+import unittest
+import asyncio
+import json
+import threading
+from unittest.mock import patch
+from asgi import app, WsgiBridge
+from modules.prcs_jobs import JobRegistry
+
+
+class ASGIClient:
+    """Запрос к ASGI-приложению без сервера: тело собирается до завершения ответа или отключения клиента"""
+
+    def __init__(self, disconnect_after=None):
+        self.messages = []
+        self.disconnect_after = disconnect_after
+
+    async def request(self, path, query_string=b'', headers=()):
+        scope = {'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+                 'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': query_string,
+                 'root_path': '', 'headers': list(headers), 'server': ('testserver', 80),
+                 'client': ('127.0.0.1', 1234)}
+        disconnect = asyncio.Event()
+        request_sent = False
+
+        async def receive():
+            nonlocal request_sent
+            if not request_sent:
+                request_sent = True
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+            if self.disconnect_after is None:
+                await asyncio.Event().wait()
+            await disconnect.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            self.messages.append(message)
+            body = b''.join(m.get('body', b'') for m in self.messages)
+            if self.disconnect_after is not None and self.disconnect_after in body:
+                disconnect.set()
+
+        await asyncio.wait_for(app(scope, receive, send), timeout=5)
+        return self.messages[0]['status'], b''.join(m.get('body', b'') for m in self.messages[1:])
+
+
+class TestASGI(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = JobRegistry()
+        patcher = patch('asgi.get_sse_jobs', return_value=self.registry)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_stream_replays_after_last_event_id(self):
+        # Записи после Last-Event-ID и событие end для завершенного лога
+        job = self.registry.create()
+        for message in ("a", "b"):
+            job.log_queue.put({"message": message})
+        job.log_queue.put(None)
+
+        status, body = asyncio.run(ASGIClient().request(f'/stream-logs/{job.id}',
+                                                        headers=[(b'last-event-id', b'1')]))
+        self.assertEqual(status, 200)
+        self.assertEqual(body, b'id: 2\ndata: {"message": "b"}\n\nevent: end\ndata: {}\n\n')
+
+    def test_stream_waits_for_job_thread(self):
+        # Корутина просыпается по записи из потока задачи
+        job = self.registry.create()
+
+        async def scenario():
+            loop = asyncio.get_running_loop()
+            loop.call_later(0.05, lambda: loop.run_in_executor(None, job.log_queue.put, {"message": "a"}))
+            loop.call_later(0.1, lambda: loop.run_in_executor(None, job.log_queue.put, None))
+            return await ASGIClient().request(f'/stream-logs/{job.id}', query_string=b'last_event_id=0')
+
+        _, body = asyncio.run(scenario())
+        self.assertEqual(body, b'id: 1\ndata: {"message": "a"}\n\nevent: end\ndata: {}\n\n')
+
+    def test_disconnect_stops_stream(self):
+        # Отключение клиента завершает поток без ожидания heartbeat
+        job = self.registry.create()
+        job.log_queue.put({"message": "a"})
+
+        _, body = asyncio.run(ASGIClient(disconnect_after=b'"a"').request(f'/stream-logs/{job.id}'))
+        self.assertEqual(body, b'id: 1\ndata: {"message": "a"}\n\n')
+        self.assertEqual(job.log_queue._async_waiters, [])
+
+    def test_other_routes_go_to_flask(self):
+        with patch('app.get_job_registry', return_value=self.registry), patch('app.get_job_executor') as executor:
+            executor.return_value.queued.return_value = 0
+            status, body = asyncio.run(ASGIClient().request('/stats/jobs'))
+
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(body)['jobs'], 0)
+
+
+class TestWsgiBridge(unittest.TestCase):
+
+    def setUp(self):
+        self.bridge = WsgiBridge(self.wsgi_app, threads=4)
+        self.addCleanup(self.bridge.shutdown)
+        self.handler = None
+
+    def wsgi_app(self, environ, start_response):
+        start_response('200 OK', [('Content-Type', 'text/plain')])
+        return [self.handler(environ)]
+
+    def request(self, chunks, path='/'):
+        # Части тела отдаются по одной; None в списке — ожидание, пока приложение прочитает предыдущие
+        scope = {'type': 'http', 'method': 'POST', 'path': path, 'query_string': b'', 'headers': [],
+                 'server': ('testserver', 80)}
+        messages = []
+        pending = list(chunks)
+
+        async def receive():
+            while pending and pending[0] is None:
+                pending.pop(0)
+                await asyncio.get_running_loop().run_in_executor(None, self.first_read.wait, 5)
+            body = pending.pop(0) if pending else b''
+            return {'type': 'http.request', 'body': body, 'more_body': bool(pending)}
+
+        async def send(message):
+            messages.append(message)
+
+        async def run():
+            await asyncio.wait_for(self.bridge(scope, receive, send), timeout=5)
+        return run, messages
+
+    def test_body_read_incrementally(self):
+        # Flask получает первую часть тела до того, как клиент отправил следующую
+        self.first_read = threading.Event()
+
+        def handler(environ):
+            first = environ['wsgi.input'].read(3)
+            self.first_read.set()
+            return first + b'|' + environ['wsgi.input'].read()
+
+        self.handler = handler
+        run, messages = self.request([b'abc', None, b'def'])
+        asyncio.run(run())
+        self.assertEqual(messages[0]['status'], 200)
+        self.assertEqual(b''.join(m.get('body', b'') for m in messages[1:]), b'abc|def')
+
+    def test_requests_run_in_parallel(self):
+        # Запросы не выполняются в одном общем потоке: оба обработчика одновременно ждут друг друга
+        barrier = threading.Barrier(2, timeout=5)
+
+        def handler(environ):
+            barrier.wait()
+            return threading.current_thread().name.encode()
+
+        self.handler = handler
+        first, first_messages = self.request([b''])
+        second, second_messages = self.request([b''])
+
+        async def both():
+            await asyncio.gather(first(), second())
+
+        asyncio.run(both())
+        names = {b''.join(m.get('body', b'') for m in messages[1:]) for messages in (first_messages, second_messages)}
+        self.assertEqual(len(names), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -17,9 +17,8 @@ from modules.prcs_flow import ProcessingError
 class TestNspdBorder(unittest.TestCase):
 
     @patch('modules.prcs_nspd_border.Nspd')
-    @patch('modules.prcs_nspd_border.process_geojson')
     @patch('modules.prcs_nspd_border.Layer36278Feature')
-    def test_process_nspd_border_success(self, mock_layer_cls, mock_process_geojson, mock_nspd_cls):
+    def test_process_nspd_border_success(self, mock_layer_cls, mock_nspd_cls):
         # Создание клиента и поиск результатов
         mock_nspd_instance = MagicMock()
         mock_nspd_cls.return_value = mock_nspd_instance
@@ -36,24 +35,17 @@ class TestNspdBorder(unittest.TestCase):
         }
         mock_nspd_instance.search_in_layer.return_value = [mock_feature]
 
-        # Парсинг GeoJSON
-        mock_process_geojson.return_value = {
-            "paths": {"path1": {"coords": [[37.6173, 55.7558], [37.6200, 55.7600]]}},
-            "points": {"uuid1": {"coords": [37.6173, 55.7558], "desc": "Old Desc"}},
-            "metadata": []
-        }
-
         registry_number = "23:01-6.1"
         result = process_nspd_border(registry_number)
 
         # Проверка, что поиск НСПД был вызван
         mock_nspd_instance.search_in_layer.assert_called_with(registry_number, mock_layer_cls)
 
-        # Проверка, что process_geojson был вызван
-        self.assertTrue(mock_process_geojson.called)
-
         # Проверка результатов парсинга — описание должно содержать "МО НСПД:"
-        self.assertEqual(result['points']['uuid1']['desc'], f"МО НСПД: {registry_number}")
+        (path,) = result['paths'].values()
+        self.assertEqual(path[0], (37.6173, 55.7558))
+        (point,) = result['points'].values()
+        self.assertEqual(point['desc'], f"МО НСПД: {registry_number}")
         self.assertIn(f"МО НСПД: {registry_number}", result['metadata'])
 
     @patch('modules.prcs_nspd_border.Nspd')
@@ -68,9 +60,8 @@ class TestNspdBorder(unittest.TestCase):
         self.assertIn("не найдено", str(cm.exception))
 
     @patch('modules.prcs_nspd_border.Nspd')
-    @patch('modules.prcs_nspd_border.process_geojson')
     @patch('modules.prcs_nspd_border.Layer36278Feature')
-    def test_process_nspd_border_with_dict_method(self, mock_layer_cls, mock_process_geojson, mock_nspd_cls):
+    def test_process_nspd_border_with_dict_method(self, mock_layer_cls, mock_nspd_cls):
         """Тест для объекта с методом dict() вместо model_dump()"""
         mock_nspd_instance = MagicMock()
         mock_nspd_cls.return_value = mock_nspd_instance
@@ -81,7 +72,7 @@ class TestNspdBorder(unittest.TestCase):
             "type": "Feature",
             "geometry": {
                 "type": "Polygon",
-                "coordinates": [[[37.0, 55.0], [37.1, 55.1], [37.0, 55.0]]]
+                "coordinates": [[[37.0, 55.0], [37.1, 55.1], [37.1, 55.0], [37.0, 55.0]]]
             },
             "properties": {"name": "Test Border"}
         })
@@ -89,23 +80,16 @@ class TestNspdBorder(unittest.TestCase):
         del mock_feature.model_dump
         mock_nspd_instance.search_in_layer.return_value = [mock_feature]
 
-        mock_process_geojson.return_value = {
-            "paths": {},
-            "points": {"uuid1": {"coords": [37.0, 55.0], "desc": "Old"}},
-            "metadata": []
-        }
-
         registry_number = "77:00-1.1"
         result = process_nspd_border(registry_number)
 
         # Проверка, что dict был вызван
         mock_feature.dict.assert_called_once()
-        self.assertEqual(result['points']['uuid1']['desc'], f"МО НСПД: {registry_number}")
+        self.assertEqual([point['desc'] for point in result['points'].values()], [f"МО НСПД: {registry_number}"])
 
     @patch('modules.prcs_nspd_border.Nspd')
-    @patch('modules.prcs_nspd_border.process_geojson')
     @patch('modules.prcs_nspd_border.Layer36278Feature')
-    def test_process_nspd_border_multiple_points(self, mock_layer_cls, mock_process_geojson, mock_nspd_cls):
+    def test_process_nspd_border_multiple_points(self, mock_layer_cls, mock_nspd_cls):
         """Тест обработки нескольких точек в результате"""
         mock_nspd_instance = MagicMock()
         mock_nspd_cls.return_value = mock_nspd_instance
@@ -113,32 +97,27 @@ class TestNspdBorder(unittest.TestCase):
         mock_feature = MagicMock()
         mock_feature.model_dump.return_value = {
             "type": "Feature",
-            "geometry": {"type": "Polygon", "coordinates": [[]]},
-            "properties": {}
+            "geometry": {"type": "MultiPolygon", "coordinates": [
+                [[[37.0, 55.0], [37.1, 55.0], [37.1, 55.1], [37.0, 55.0]]],
+                [[[38.0, 55.0], [38.1, 55.0], [38.1, 55.1], [38.0, 55.0]]],
+                [[[39.0, 55.0], [39.1, 55.0], [39.1, 55.1], [39.0, 55.0]]]
+            ]},
+            "properties": {"category_t": "Муниципальный округ", "title": "Тестовый"}
         }
         mock_nspd_instance.search_in_layer.return_value = [mock_feature]
 
-        # Несколько точек в результате
-        mock_process_geojson.return_value = {
-            "paths": {},
-            "points": {
-                "uuid1": {"coords": [37.0, 55.0], "desc": "Point 1"},
-                "uuid2": {"coords": [37.1, 55.1], "desc": "Point 2"},
-                "uuid3": {"coords": [37.2, 55.2], "desc": "Point 3"}
-            },
-            "metadata": ["existing_meta"]
-        }
-
         registry_number = "23:02-5.5"
         result = process_nspd_border(registry_number)
 
+        # Каждый полигон дает свою точку в центроиде
+        self.assertEqual(len(result['points']), 3)
         # Все точки должны получить обновлённое описание
         for point in result['points'].values():
             self.assertEqual(point['desc'], f"МО НСПД: {registry_number}")
 
         # Метаданные должны содержать новую запись в начале
         self.assertEqual(result['metadata'][0], f"МО НСПД: {registry_number}")
-        self.assertIn("existing_meta", result['metadata'])
+        self.assertEqual(result['metadata'][1:], ["Муниципальный округ Тестовый"])
 
 
 if __name__ == '__main__':
@@ -17,9 +17,8 @@ from modules.prcs_flow import ProcessingError
 class TestNspdLocality(unittest.TestCase):
 
     @patch('modules.prcs_nspd_locality.Nspd')
-    @patch('modules.prcs_nspd_locality.process_geojson')
     @patch('modules.prcs_nspd_locality.Layer36281Feature')
-    def test_process_nspd_locality_success(self, mock_layer_cls, mock_process_geojson, mock_nspd_cls):
+    def test_process_nspd_locality_success(self, mock_layer_cls, mock_nspd_cls):
         # Создание клиента и поиск результатов
         mock_nspd_instance = MagicMock()
         mock_nspd_cls.return_value = mock_nspd_instance
@@ -36,24 +35,15 @@ class TestNspdLocality(unittest.TestCase):
         }
         mock_nspd_instance.search_in_layer.return_value = [mock_feature]
 
-        # Парсинг GeoJSON
-        mock_process_geojson.return_value = {
-            "paths": {},
-            "points": {"uuid1": {"coords": [37.6173, 55.7558], "desc": "Old Desc"}},
-            "metadata": []
-        }
-
         registry_number = "77:01:0002009:2525"
         result = process_nspd_locality(registry_number)
 
         # Проверка, что поиск НСПД был вызван
         mock_nspd_instance.search_in_layer.assert_called_with(registry_number, mock_layer_cls)
 
-        # Проверка, что process_geojson был вызван
-        self.assertTrue(mock_process_geojson.called)
-
         # Проверка результатов парсинга
-        self.assertEqual(result['points']['uuid1']['desc'], f"НСПД: {registry_number}")
+        (point,) = result['points'].values()
+        self.assertEqual(point, {"coords": [37.6173, 55.7558], "desc": f"НСПД: {registry_number}"})
         self.assertIn(f"НСПД: {registry_number}", result['metadata'])
 
     @patch('modules.prcs_nspd_locality.Nspd')
@@ -0,0 +1,358 @@
+import unittest
+import logging
+import os
+import tempfile
+import threading
+from queue import Queue
+from unittest.mock import patch
+from modules.prcs_async_log import process_upload_async, process_nspd_async, process_nspd_border_async
+from modules.prcs_storage import MemoryStorage, set_storage
+from modules.prcs_flow import ProcessingError, ERR_NETWORK
+from modules.prcs_jobs import JobRegistry
+from modules.prcs_multipart import UploadFeed
+from modules.prcs_upload import BASE_FOLDER_PATH
+from modules.prcs_nspd_cache import SQLiteNspdCache, set_nspd_cache
+
+
+def drain(log_queue):
+    # Собираем сообщения лога задачи до завершающего None
+    messages = []
+    while True:
+        entry = log_queue.get(timeout=5)
+        if entry is None:
+            return messages
+        messages.append(entry['message'])
+
+
+class TestProcessUploadAsync(unittest.TestCase):
+
+    def setUp(self):
+        self.storage = MemoryStorage()
+        set_storage(self.storage)
+        job_logger = logging.getLogger('modules.prcs_async_log')
+        self.addCleanup(job_logger.setLevel, job_logger.level)
+        job_logger.setLevel(logging.INFO)
+
+    def tearDown(self):
+        set_storage(None)
+
+    def make_temp_file(self, suffix='.gpx'):
+        fd, path = tempfile.mkstemp(suffix=suffix)
+        os.close(fd)
+        return path
+
+    def gpx_result(self, key):
+        return {"paths": {key: [[0, 0]]}, "points": {key: {"coords": [0, 0], "desc": key}}, "metadata": []}
+
+    def test_process_upload_merges_into_storage(self):
+        # Файлы конвертируются и объединяются с index.json в хранилище
+        temp_path = self.make_temp_file()
+        log_queue = Queue()
+        with patch.dict('modules.prcs_async_log.FILE_PROCESSORS',
+                        {'.gpx': (lambda path, filename: self.gpx_result("a"), 'GPX')}):
+            process_upload_async(log_queue, "session", [(temp_path, "track.gpx")])
+
+        messages = drain(log_queue)
+        self.assertIn("Завершено: 1 успешно, 0 пропущено", messages)
+        self.assertEqual(set(self.storage.get_index()[0]["paths"]), {"a"})
+        self.assertFalse(os.path.exists(temp_path))
+
+    def test_process_upload_from_memory(self):
+        # Содержимое файла в памяти передается конвертеру вместе с именем файла
+        sources = []
+
+        def parse(source, filename):
+            sources.append((source, filename))
+            return self.gpx_result("a")
+
+        log_queue = Queue()
+        with patch.dict('modules.prcs_async_log.FILE_PROCESSORS', {'.gpx': (parse, 'GPX')}):
+            process_upload_async(log_queue, "session", [(b"<gpx/>", "track.gpx")])
+
+        self.assertIn("Завершено: 1 успешно, 0 пропущено", drain(log_queue))
+        self.assertEqual(sources, [(b"<gpx/>", "track.gpx")])
+
+    def test_files_converted_while_uploading(self):
+        # Первый файл конвертируется до того, как прием запроса завершен
+        feed = UploadFeed()
+        first_parsed = threading.Event()
+
+        def parse(source, filename):
+            if filename == "a.gpx":
+                first_parsed.set()
+            return self.gpx_result(filename)
+
+        def upload():
+            feed.add(b"<gpx/>", "a.gpx")
+            first_parsed.wait(5)
+            feed.add(b"<gpx/>", "b.gpx")
+            feed.close()
+
+        log_queue = Queue()
+        uploader = threading.Thread(target=upload)
+        uploader.start()
+        with patch.dict('modules.prcs_async_log.FILE_PROCESSORS', {'.gpx': (parse, 'GPX')}):
+            process_upload_async(log_queue, "session", feed)
+        uploader.join()
+
+        self.assertTrue(first_parsed.is_set())
+        self.assertIn("Завершено: 2 успешно, 0 пропущено", drain(log_queue))
+        self.assertEqual(set(self.storage.get_index()[0]["paths"]), {"a.gpx", "b.gpx"})
+
+    def test_index_download_overlaps_parsing(self):
+        # Скачивание index.json идет параллельно с парсингом файла
+        parsing_started = threading.Event()
+        original_get_index = self.storage.get_index
+
+        def slow_get_index():
+            self.assertTrue(parsing_started.wait(timeout=5))
+            return original_get_index()
+
+        def parse(path, filename):
+            parsing_started.set()
+            return self.gpx_result("a")
+
+        temp_path = self.make_temp_file()
+        log_queue = Queue()
+        with patch.object(self.storage, 'get_index', side_effect=slow_get_index), \
+                patch.dict('modules.prcs_async_log.FILE_PROCESSORS', {'.gpx': (parse, 'GPX')}):
+            process_upload_async(log_queue, "session", [(temp_path, "track.gpx")])
+
+        self.assertIn("Завершено: 1 успешно, 0 пропущено", drain(log_queue))
+
+    def test_cancel_skips_save_and_removes_temp_files(self):
+        # Отмененная задача удаляет временные файлы, не дожидаясь конвертации, и не сохраняет результаты
+        registry = JobRegistry()
+        job = registry.create()
+        parsing_started = threading.Event()
+        release = threading.Event()
+
+        def parse(path, filename):
+            parsing_started.set()
+            self.assertTrue(release.wait(timeout=5))
+            return self.gpx_result("a")
+
+        temp_files = [(self.make_temp_file(), f"track{n}.gpx") for n in range(2)]
+        with patch('modules.prcs_async_log.SESSION_FILE_CONCURRENCY', 1), \
+                patch('modules.prcs_async_log.CANCEL_POLL_INTERVAL', 0.01), \
+                patch.dict('modules.prcs_async_log.FILE_PROCESSORS', {'.gpx': (parse, 'GPX')}):
+            thread = threading.Thread(target=registry.run,
+                                      args=(job.id, process_upload_async, job.log_queue, job.id, temp_files))
+            thread.start()
+            self.assertTrue(parsing_started.wait(timeout=5))
+            registry.cancel(job.id)
+            for _ in range(500):
+                if not os.path.exists(temp_files[1][0]):
+                    break
+                threading.Event().wait(0.01)
+            self.assertFalse(os.path.exists(temp_files[1][0]))
+            release.set()
+            thread.join(timeout=5)
+
+        messages = [entry['message'] for _, entry in job.log_queue.wait(0)[0]]
+        self.assertIn("✗ Задача отменена, результаты не сохраняются", messages)
+        self.assertIsNone(self.storage.get_index()[0])
+        self.assertTrue(job.to_dict()["cancelled"])
+
+    def test_saved_results_not_saved_again(self):
+        # Повтор задачи из очереди SQLite: файлы остаются вызывающему, сохраненные результаты не дублируются
+        temp_path = self.make_temp_file()
+        self.addCleanup(os.remove, temp_path)
+        registry = JobRegistry()
+        saved = []
+        with patch.dict('modules.prcs_async_log.FILE_PROCESSORS',
+                        {'.gpx': (lambda path, filename: self.gpx_result("a"), 'GPX')}):
+            first = registry.create()
+            first.on_saved = lambda: saved.append(first.id)
+            registry.run(first.id, process_upload_async, first.log_queue, first.id,
+                         UploadFeed.of([(temp_path, "track.gpx")], keep_files=True))
+            self.assertEqual((saved, first.report["saved"]), ([first.id], True))
+            revision = self.storage.get_index()[1]
+
+            retry = registry.create()
+            retry.report["saved"] = True
+            registry.run(retry.id, process_upload_async, retry.log_queue, retry.id,
+                         UploadFeed.of([(temp_path, "track.gpx")], keep_files=True))
+
+        messages = [entry['message'] for _, entry in retry.log_queue.wait(0)[0]]
+        self.assertIn("✓ Результаты уже сохранены предыдущей попыткой", messages)
+        self.assertEqual(self.storage.get_index()[1], revision)
+        self.assertTrue(os.path.exists(temp_path))
+
+    def test_files_processed_concurrently(self):
+        # Файлы одной загрузки конвертируются одновременно
+        barrier = threading.Barrier(2, timeout=5)
+
+        def parse(path, filename):
+            barrier.wait()
+            return self.gpx_result(os.path.basename(path))
+
+        temp_paths = [self.make_temp_file(), self.make_temp_file()]
+        log_queue = Queue()
+        with patch.dict('modules.prcs_async_log.FILE_PROCESSORS', {'.gpx': (parse, 'GPX')}):
+            process_upload_async(log_queue, "session", [(path, f"track{n}.gpx") for n, path in enumerate(temp_paths)])
+
+        messages = drain(log_queue)
+        self.assertIn("Завершено: 2 успешно, 0 пропущено", messages)
+        self.assertIn("track1.gpx: парсинг и конвертация GPX", messages)
+        self.assertEqual(len(self.storage.get_index()[0]["paths"]), 2)
+
+    def test_merge_follows_upload_order(self):
+        # Результаты объединяются в порядке загрузки, даже если первый файл конвертируется дольше
+        second_done = threading.Event()
+
+        def parse(path, filename):
+            if path == temp_paths[0]:
+                self.assertTrue(second_done.wait(timeout=5))
+                return {"paths": {"a": [[1, 1]]}, "points": {}, "metadata": []}
+            second_done.set()
+            return {"paths": {"a": [[2, 2]]}, "points": {}, "metadata": []}
+
+        temp_paths = [self.make_temp_file(), self.make_temp_file()]
+        log_queue = Queue()
+        with patch.dict('modules.prcs_async_log.FILE_PROCESSORS', {'.gpx': (parse, 'GPX')}):
+            process_upload_async(log_queue, "session", [(path, "track.gpx") for path in temp_paths])
+
+        drain(log_queue)
+        self.assertEqual(self.storage.get_index()[0]["paths"], {"a": [[2, 2]]})
+
+    @patch('modules.prcs_async_log.SESSION_FILE_CONCURRENCY', 2)
+    def test_session_concurrency_limit(self):
+        # Одна задача занимает не больше SESSION_FILE_CONCURRENCY потоков конвертации
+        lock = threading.Lock()
+        counters = {"running": 0, "peak": 0}
+
+        def parse(path, filename):
+            with lock:
+                counters["running"] += 1
+                counters["peak"] = max(counters["peak"], counters["running"])
+            threading.Event().wait(0.02)
+            with lock:
+                counters["running"] -= 1
+            return self.gpx_result(os.path.basename(path))
+
+        temp_paths = [self.make_temp_file() for _ in range(6)]
+        log_queue = Queue()
+        with patch.dict('modules.prcs_async_log.FILE_PROCESSORS', {'.gpx': (parse, 'GPX')}):
+            process_upload_async(log_queue, "session", [(path, "track.gpx") for path in temp_paths])
+
+        self.assertIn("Завершено: 6 успешно, 0 пропущено", drain(log_queue))
+        self.assertEqual(counters["peak"], 2)
+
+    def test_concurrent_jobs_do_not_share_logs(self):
+        # Записи параллельных задач, в том числе из потоков конвертации, попадают только в лог своей задачи
+        barrier = threading.Barrier(2, timeout=5)
+
+        def parse(path, filename):
+            barrier.wait()
+            return self.gpx_result(os.path.basename(path))
+
+        queues = {"first": Queue(), "second": Queue()}
+        with patch.dict('modules.prcs_async_log.FILE_PROCESSORS', {'.gpx': (parse, 'GPX')}):
+            threads = [threading.Thread(target=process_upload_async,
+                                        args=(log_queue, name, [(self.make_temp_file(), f"{name}.gpx")]))
+                       for name, log_queue in queues.items()]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        for name, log_queue in queues.items():
+            other = "second" if name == "first" else "first"
+            messages = drain(log_queue)
+            self.assertIn(f"✓ {name}.gpx сконвертирован в index.json", messages)
+            self.assertIn("Загрузка текущего файла index.json", messages)
+            self.assertFalse(any(other in message for message in messages))
+
+    def test_storage_failure_stops_job(self):
+        # Ошибка хранилища прерывает задачу, временные файлы удаляются
+        temp_paths = [self.make_temp_file(), self.make_temp_file()]
+        log_queue = Queue()
+        with patch.object(self.storage, 'ensure_folder', side_effect=ProcessingError(ERR_NETWORK, "401")), \
+                patch('modules.prcs_async_log._storage_failed', return_value=True):
+            process_upload_async(log_queue, "session", [(path, "track.gpx") for path in temp_paths])
+
+        messages = drain(log_queue)
+        self.assertIn("Добавьте свой OAuth-токен Яндекс.Диска в config.py", messages)
+        self.assertFalse(any(message.startswith("Завершено") for message in messages))
+        for path in temp_paths:
+            self.assertFalse(os.path.exists(path))
+
+    def test_index_downloaded_while_folders_checked(self):
+        # index.json скачивается одновременно с проверкой папок, а не после нее
+        barrier = threading.Barrier(2, timeout=5)
+        ensure_folder, get_index = self.storage.ensure_folder, self.storage.get_index
+        downloads = []
+
+        def checked(path):
+            if path == BASE_FOLDER_PATH:
+                barrier.wait()
+            ensure_folder(path)
+
+        def downloaded():
+            # Снимок для объединения при сохранении уже не ждет проверку папок
+            if not downloads:
+                downloads.append(True)
+                barrier.wait()
+            return get_index()
+
+        temp_path = self.make_temp_file()
+        log_queue = Queue()
+        with patch.object(self.storage, 'ensure_folder', side_effect=checked), \
+                patch.object(self.storage, 'get_index', side_effect=downloaded), \
+                patch.dict('modules.prcs_async_log.FILE_PROCESSORS',
+                           {'.gpx': (lambda path, filename: self.gpx_result("a"), 'GPX')}):
+            process_upload_async(log_queue, "session", [(temp_path, "track.gpx")])
+
+        self.assertIn("Завершено: 1 успешно, 0 пропущено", drain(log_queue))
+        self.assertEqual(set(self.storage.get_index()[0]["paths"]), {"a"})
+
+    def test_no_files(self):
+        log_queue = Queue()
+        process_upload_async(log_queue, "session", [])
+        self.assertEqual(drain(log_queue), ["Не выбраны файлы для загрузки"])
+
+
+class TestProcessNspdAsync(unittest.TestCase):
+
+    def setUp(self):
+        self.storage = MemoryStorage()
+        set_storage(self.storage)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        set_nspd_cache(SQLiteNspdCache(os.path.join(directory.name, 'nspd.sqlite3')))
+        self.addCleanup(set_nspd_cache, None)
+        job_logger = logging.getLogger('modules.prcs_async_log')
+        self.addCleanup(job_logger.setLevel, job_logger.level)
+        job_logger.setLevel(logging.INFO)
+
+    def tearDown(self):
+        set_storage(None)
+
+    @patch('modules.prcs_async_log.process_nspd_locality')
+    def test_process_nspd(self, mock_locality):
+        # Данные НСПД объединяются с index.json
+        mock_locality.return_value = {"paths": {"a": [[0, 0]]}, "points": {}, "metadata": []}
+        log_queue = Queue()
+        process_nspd_async(log_queue, "session", "23:01-4.9")
+
+        self.assertIn("✓ Загружен", drain(log_queue))
+        self.assertEqual(set(self.storage.get_index()[0]["paths"]), {"a"})
+
+    @patch('modules.prcs_async_log.process_nspd_border')
+    def test_repeated_lookup_served_from_cache(self, mock_border):
+        # Повторный запрос того же номера не обращается к НСПД, попадание в кэш видно в логе задачи
+        mock_border.return_value = {"paths": {"a": [[0, 0]]}, "points": {"a": {"coords": [0, 0], "desc": "МО"}},
+                                    "metadata": []}
+        first_log, second_log = Queue(), Queue()
+        process_nspd_border_async(first_log, "session", "23:01-6.1")
+        process_nspd_border_async(second_log, "session", "23:01-6.1")
+
+        mock_border.assert_called_once_with("23:01-6.1")
+        self.assertIn("Кэш НСПД: 23:01-6.1 не найден, запрос к НСПД", drain(first_log))
+        self.assertIn("Кэш НСПД: 23:01-6.1 найден, запрос к НСПД не нужен", drain(second_log))
+        self.assertEqual(len(self.storage.get_index()[0]["paths"]), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
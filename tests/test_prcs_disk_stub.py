@@ -0,0 +1,148 @@
+import unittest
+import time
+import requests
+from unittest.mock import patch
+from modules import prcs_upload
+from modules.prcs_disk_stub import DiskStubServer, HREF_TTL
+from modules.prcs_upload import (
+    YandexDiskClient,
+    clear_folder_cache,
+    ensure_folder,
+    download_index_json_with_revision,
+    upload_index_json,
+    get_current_day_folder_path,
+    BASE_FOLDER_PATH
+)
+from modules.prcs_storage import YandexDiskStorage
+from modules.prcs_flow import IndexConflictError, REVISION_ABSENT
+
+
+class DiskStubTestCase(unittest.TestCase):
+    # Клиент prcs_upload направляется на локальную заглушку вместо API Диска
+
+    stub_kwargs = {}
+
+    def setUp(self):
+        clear_folder_cache()
+        self.stub = DiskStubServer(**self.stub_kwargs).start()
+        self.client = YandexDiskClient(retries=3, backoff=0)
+        patchers = [
+            patch('modules.prcs_upload.API_BASE_URL', self.stub.api_base_url),
+            patch('modules.prcs_upload._client', self.client),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.client.close()
+        self.stub.stop()
+        clear_folder_cache()
+
+
+class TestDiskStub(DiskStubTestCase):
+
+    def test_folders_and_index_roundtrip(self):
+        # Полный цикл задачи: папки, новый index.json, повторное скачивание
+        ensure_folder(BASE_FOLDER_PATH)
+        ensure_folder(get_current_day_folder_path())
+        self.assertEqual(download_index_json_with_revision(), (None, REVISION_ABSENT))
+
+        data = {"paths": {"id1": [[37.6, 55.7]]}, "points": {"id1": {"coords": [37.6, 55.7], "desc": "Тест"}}}
+        upload_index_json(data, if_revision=REVISION_ABSENT)
+
+        index, revision = download_index_json_with_revision()
+        self.assertEqual(index, data)
+        self.assertGreater(revision, REVISION_ABSENT)
+
+    def test_hrefs_not_kept(self):
+        # Ссылка удаляется после использования, неиспользованная — по истечении HREF_TTL
+        ensure_folder(BASE_FOLDER_PATH)
+        ensure_folder(get_current_day_folder_path())
+        upload_index_json({"paths": {}, "points": {}}, if_revision=REVISION_ABSENT)
+        download_index_json_with_revision()
+        self.assertEqual(self.stub.state.hrefs, {})
+
+        self.stub.state.issue_href("GET", "unused")
+        with patch('modules.prcs_disk_stub.time.monotonic', return_value=time.monotonic() + HREF_TTL + 1):
+            self.stub.state.issue_href("GET", "fresh")
+        self.assertEqual([path for _, path, _ in self.stub.state.hrefs.values()], ["fresh"])
+
+    def test_missing_parent_folder(self):
+        # Создание папки без родителя отклоняется как на настоящем Диске
+        response = requests.put(f"{self.stub.api_base_url}?path=missing/child")
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()["error"], "DiskPathDoesntExistsError")
+
+    def test_compare_and_swap(self):
+        # Конфликтующие загрузки index.json отклоняются, update_index объединяет данные
+        ensure_folder(BASE_FOLDER_PATH)
+        storage = YandexDiskStorage()
+        storage.update_index({"paths": {"a": [[0, 0]]}, "points": {}})
+        stale_snapshot = storage.get_index()
+        storage.update_index({"paths": {"b": [[1, 1]]}, "points": {}})
+
+        with self.assertRaises(IndexConflictError):
+            upload_index_json({"paths": {}, "points": {}}, if_revision=stale_snapshot[1])
+
+        with patch('modules.prcs_storage.time.sleep'):
+            storage.update_index({"paths": {"c": [[2, 2]]}, "points": {}}, stale_snapshot)
+        self.assertEqual(set(storage.get_index()[0]["paths"]), {"a", "b", "c"})
+
+    @patch('modules.prcs_upload.YANDEX_DISK_GZIP_UPLOAD', True)
+    def test_gzip_transfer(self):
+        # index.json передается сжатым в обе стороны, на стороне заглушки хранится распакованным
+        ensure_folder(BASE_FOLDER_PATH)
+        data = {"paths": {f"id{n}": [[37.6, 55.7]] * 10 for n in range(200)}, "points": {}}
+        upload_index_json(data, if_revision=REVISION_ABSENT)
+        uploaded = self.stub.state.bytes_in
+        stored = next(iter(self.stub.state.files.values()))[0]
+
+        self.assertLess(uploaded * 5, len(stored))
+        self.assertEqual(download_index_json_with_revision()[0], data)
+        self.assertEqual(self.stub.state.statuses[200], 4)
+
+    def test_request_accounting(self):
+        # Заглушка считает запросы, статусы и объем переданных данных
+        ensure_folder(BASE_FOLDER_PATH)
+        stats = requests.get(self.stub.api_base_url.replace("/v1/disk/resources", "/_stats")).json()
+
+        self.assertEqual(stats["requests"], {"GET resource": 1, "PUT resource": 1})
+        self.assertEqual(stats["statuses"], {"404": 1, "201": 1})
+        self.assertGreater(stats["bytes_out"], 0)
+
+
+class TestDiskStubFaults(DiskStubTestCase):
+
+    stub_kwargs = {"faults": {503: 0.5}}
+
+    def test_injected_faults_are_retried(self):
+        # Клиент переживает внедренные ответы 503 благодаря повторам
+        with patch.object(self.client.session.get_adapter("http://"), "max_retries",
+                          self.client.session.get_adapter("http://").max_retries.new(total=30)):
+            for _ in range(5):
+                clear_folder_cache()
+                ensure_folder(BASE_FOLDER_PATH)
+
+        self.assertGreater(sum(self.stub.state.faults.values()), 0)
+        self.assertIn(BASE_FOLDER_PATH, self.stub.state.folders)
+
+
+class TestDiskStubLatency(DiskStubTestCase):
+
+    stub_kwargs = {"latency": 0.05, "bandwidth": 100_000}
+
+    def test_latency_and_bandwidth(self):
+        # Задержка добавляется к каждому ответу, тело ограничивается пропускной способностью
+        ensure_folder(BASE_FOLDER_PATH)
+        data = {"paths": {"a": [[0.123456789, 0.123456789]] * 1000}, "points": {}}
+
+        started = time.perf_counter()
+        upload_index_json(data, if_revision=REVISION_ABSENT)
+        elapsed = time.perf_counter() - started
+
+        self.assertGreaterEqual(elapsed, 0.1 + self.stub.state.bytes_in / 100_000)
+
+
+if __name__ == '__main__':
+    unittest.main()
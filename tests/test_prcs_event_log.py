@@ -0,0 +1,112 @@
+import unittest
+import asyncio
+import os
+import tempfile
+import threading
+from unittest.mock import patch
+from modules.prcs_async_log import create_sse_stream
+from modules.prcs_event_log import SQLiteEventLog, set_event_log
+from modules.prcs_jobs import JobRegistry
+
+
+class TestSQLiteEventLog(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'events.sqlite3')
+        self.event_log = SQLiteEventLog(self.path, poll_interval=0.01, ttl=60)
+
+    def test_shared_between_instances(self):
+        # Лог, записанный одним процессом, читает другой: экземпляры работают только через файл
+        writer = self.event_log.open("job")
+        reader = SQLiteEventLog(self.path, poll_interval=0.01).get("job").log_queue
+
+        writer.put({"message": "a"})
+        writer.put({"message": "b"})
+        self.assertEqual(reader.wait(0, timeout=1), ([(1, {"message": "a"}), (2, {"message": "b"})], False))
+        self.assertEqual(reader.wait(1, timeout=1), ([(2, {"message": "b"})], False))
+
+        writer.put(None)
+        self.assertEqual(reader.wait(2, timeout=1), ([], True))
+        self.assertTrue(reader.closed)
+
+    def test_wait_timeout_and_wakeup(self):
+        events = self.event_log.open("job")
+        self.assertEqual(events.wait(0, timeout=0.05), ([], False))
+
+        timer = threading.Timer(0.05, events.put, args=({"message": "a"},))
+        timer.start()
+        self.assertEqual(events.wait(0, timeout=5), ([(1, {"message": "a"})], False))
+        timer.join()
+
+    def test_wait_async(self):
+        # Асинхронное ожидание для ASGI-режима опрашивает журнал без блокировки цикла событий
+        events = self.event_log.open("job")
+
+        async def scenario():
+            loop = asyncio.get_running_loop()
+            loop.call_later(0.05, lambda: loop.run_in_executor(None, events.put, {"message": "a"}))
+            return await events.wait_async(0, timeout=5), await events.wait_async(1, timeout=0.05)
+
+        self.assertEqual(asyncio.run(scenario()), (([(1, {"message": "a"})], False), ([], False)))
+
+    def test_idle_async_streams_share_one_poll(self):
+        # Простаивающие SSE-корутины не читают журнал каждая: один запрос за период опроса на все потоки
+        streams = [self.event_log.open(f"job{n}") for n in range(20)]
+
+        async def scenario():
+            return await asyncio.gather(*(events.wait_async(0, timeout=0.2) for events in streams))
+
+        with patch.object(self.event_log, 'read', wraps=self.event_log.read) as read, \
+                patch.object(self.event_log, 'heads', wraps=self.event_log.heads) as heads:
+            results = asyncio.run(scenario())
+
+        self.assertEqual(results, [([], False)] * 20)
+        self.assertEqual(read.call_count, 20)
+        self.assertLess(heads.call_count, 40)
+        self.assertEqual(len(heads.call_args[0][0]), 20)
+
+    def test_unknown_job(self):
+        self.assertIsNone(self.event_log.get("unknown"))
+
+    def test_concurrent_writers(self):
+        # Параллельные записи одной задачи получают разные последовательные номера
+        events = self.event_log.open("job")
+        threads = [threading.Thread(target=lambda n=n: [events.put({"n": n}) for _ in range(20)]) for n in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        records, _ = events.wait(0, timeout=1)
+        self.assertEqual([event_id for event_id, _ in records], list(range(1, 81)))
+
+    def test_purge(self):
+        # Лог удаляется через ttl после завершения задачи, незавершенный лог остается
+        finished = self.event_log.open("finished")
+        finished.put({"message": "a"})
+        finished.put(None)
+        self.event_log.open("running")
+
+        with patch('modules.prcs_event_log.time.time', return_value=10 ** 10):
+            self.assertEqual(self.event_log.purge(), 1)
+        self.assertIsNone(self.event_log.get("finished"))
+        self.assertIsNotNone(self.event_log.get("running"))
+
+    def test_sse_from_other_process(self):
+        # SSE-поток строится по журналу, даже если задача создана в другом процессе
+        set_event_log(self.event_log)
+        self.addCleanup(set_event_log, None)
+        with patch('modules.prcs_jobs.JOB_EVENT_BUS', 'sqlite'):
+            job = JobRegistry().create()
+        job.log_queue.put({"message": "a"})
+        job.log_queue.put(None)
+
+        response = create_sse_stream(job.id, SQLiteEventLog(self.path), last_event_id=0)
+        body = "".join(response.response)
+        self.assertEqual(body, 'id: 1\ndata: {"message": "a"}\n\nevent: end\ndata: {}\n\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
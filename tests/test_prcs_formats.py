@@ -0,0 +1,179 @@
+import unittest
+import tempfile
+import os
+import threading
+import pickle
+from multiprocessing.shared_memory import SharedMemory
+from concurrent.futures.process import BrokenProcessPool
+from unittest.mock import patch, MagicMock
+from modules.prcs_formats import FileProcessPool, pack_result, unpack_result, process_file, get_file_extension
+from modules.prcs_flow import ProcessingError, JobCancelledError, current_job_cancel
+
+GPX_CONTENT = '''<?xml version="1.0" encoding="UTF-8"?>
+<gpx version="1.1" creator="test">
+    <trk>
+        <name>Test Track</name>
+        <trkseg>
+            <trkpt lat="55.7558" lon="37.6173"></trkpt>
+            <trkpt lat="55.7559" lon="37.6174"></trkpt>
+        </trkseg>
+    </trk>
+</gpx>'''
+
+
+class TestPackResult(unittest.TestCase):
+
+    def test_roundtrip(self):
+        # Координаты линий передаются через разделяемую память и восстанавливаются в исходном порядке
+        result = {
+            "paths": {"a": [[37.6, 55.7], [37.7, 55.8]], "b": [(1.0, 2.0, 3.0)], "c": [], "d": [[1.0, 2.0], [3.0]]},
+            "points": {"a": {"coords": [37.6, 55.7], "desc": "Тест"}},
+            "metadata": ["Тест"]
+        }
+        packed = pack_result(result)
+
+        self.assertEqual(packed["paths"], {"c": [], "d": [[1.0, 2.0], [3.0]]})
+        self.assertLess(len(pickle.dumps(packed)), 2000)
+        unpacked = unpack_result(packed)
+        self.assertEqual(unpacked, {
+            **result, "paths": {"a": [[37.6, 55.7], [37.7, 55.8]], "b": [[1.0, 2.0, 3.0]], "c": [],
+                                "d": [[1.0, 2.0], [3.0]]}
+        })
+        self.assertEqual(list(unpacked["paths"]), ["a", "b", "c", "d"])
+
+        # Блок освобождается после чтения
+        with self.assertRaises(FileNotFoundError):
+            SharedMemory(name=packed["shared_paths"][0])
+
+    def test_large_result_not_pickled(self):
+        # Через pickle проходят только ключи и смещения, а не координаты
+        result = {"paths": {f"id{n}": [[float(n), 55.7]] * 1000 for n in range(100)}, "points": {}, "metadata": []}
+        packed = pack_result(result)
+
+        self.assertLess(len(pickle.dumps(packed)), 10000)
+        self.assertEqual(unpack_result(packed), result)
+
+    def test_failed_pack_releases_block(self):
+        # Ошибка записи в блок не оставляет его в /dev/shm
+        with patch('modules.prcs_formats.np.concatenate', side_effect=MemoryError):
+            with self.assertRaises(MemoryError):
+                pack_result({"paths": {"a": [[1.0, 2.0]]}}, block_name="nmap_test_failed_pack")
+
+        with self.assertRaises(FileNotFoundError):
+            SharedMemory(name="nmap_test_failed_pack")
+
+    def test_no_paths(self):
+        packed = pack_result({"paths": {}, "points": {}, "metadata": []})
+        self.assertIsNone(packed["shared_paths"])
+        self.assertEqual(unpack_result(packed), {"paths": {}, "points": {}, "metadata": []})
+
+
+class TestProcessFile(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.gpx')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(GPX_CONTENT)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_get_file_extension(self):
+        self.assertEqual(get_file_extension("track.GPX"), ".gpx")
+        self.assertEqual(get_file_extension("track"), "")
+
+    def test_unsupported_extension(self):
+        with self.assertRaises(ValueError):
+            process_file(self.path, "track.txt")
+
+    def test_process_in_thread(self):
+        result = process_file(self.path, "track.gpx")
+        self.assertIn("Test Track", result["metadata"])
+
+    def test_process_pool(self):
+        # Конвертация в отдельном процессе дает тот же результат, ошибки конвертера передаются как ProcessingError
+        pool = FileProcessPool(workers=1)
+        self.addCleanup(pool.shutdown)
+
+        with patch('modules.prcs_formats.FILE_PROCESS_WORKERS', 1), \
+                patch('modules.prcs_formats.get_process_pool', return_value=pool):
+            result = process_file(self.path, "track.gpx")
+            with open(self.path, 'w') as f:
+                f.write("not xml")
+            with self.assertRaises(ProcessingError):
+                process_file(self.path, "track.gpx")
+
+        self.assertEqual(list(result["paths"].values()), [[[37.6173, 55.7558], [37.6174, 55.7559]]])
+        self.assertIn("Test Track", result["metadata"])
+
+    def test_process_pool_cancelled(self):
+        # Отмена задачи доходит до процесса пула: конвертер в нем прерывается на check_cancelled
+        pool = FileProcessPool(workers=1)
+        self.addCleanup(pool.shutdown)
+        cancel = threading.Event()
+        cancel.set()
+        token = current_job_cancel.set(cancel)
+        self.addCleanup(current_job_cancel.reset, token)
+
+        with patch('modules.prcs_formats.FILE_PROCESS_WORKERS', 1), \
+                patch('modules.prcs_formats.get_process_pool', return_value=pool), \
+                patch('modules.prcs_formats.SharedMemory', wraps=SharedMemory) as shared_memory:
+            with self.assertRaises(JobCancelledError):
+                process_file(self.path, "track.gpx")
+
+        # Флаг отмены удаляется после обработки файла
+        cancel_name = shared_memory.call_args_list[0][1]["name"]
+        with self.assertRaises(FileNotFoundError):
+            SharedMemory(name=cancel_name)
+
+    def test_broken_pool_is_retried_once(self):
+        # После аварийного завершения процесса пул пересоздается, файл обрабатывается повторно один раз
+        broken = MagicMock()
+        broken.submit.return_value.result.side_effect = BrokenProcessPool()
+        healthy = MagicMock()
+        healthy.submit.return_value.result.return_value = (pack_result({"paths": {"a": [[1.0, 2.0]]}}), None)
+
+        pool = FileProcessPool(workers=1)
+        with patch('modules.prcs_formats.ProcessPoolExecutor', side_effect=[broken, healthy]):
+            with self.assertLogs('modules.prcs_formats', level='WARNING'):
+                self.assertEqual(pool.process(".gpx", self.path), {"paths": {"a": [[1.0, 2.0]]}})
+        broken.shutdown.assert_called_once_with(wait=False)
+
+        with patch('modules.prcs_formats.ProcessPoolExecutor', side_effect=[broken, broken]):
+            pool = FileProcessPool(workers=1)
+            with self.assertRaises(ProcessingError):
+                pool.process(".gpx", self.path)
+
+    def test_block_released_when_result_is_lost(self):
+        # Блок, созданный процессом пула, освобождается и при падении пула, и при ошибке разбора результата
+        names = []
+
+        def packed_then(outcome):
+            def submit(fn, extension, source, filename, block_name, cancel_name):
+                names.append(block_name)
+                future = MagicMock()
+                future.result.side_effect = [outcome((pack_result({"paths": {"a": [[1.0, 2.0]]}}, block_name), None))]
+                return future
+            return submit
+
+        def broken(_):
+            raise BrokenProcessPool()
+
+        first, second = MagicMock(), MagicMock()
+        first.submit.side_effect = packed_then(broken)
+        second.submit.side_effect = packed_then(lambda value: value)
+        pool = FileProcessPool(workers=1)
+        with patch('modules.prcs_formats.ProcessPoolExecutor', side_effect=[first, second]), \
+                patch('modules.prcs_formats.unpack_result', side_effect=RuntimeError):
+            with self.assertLogs('modules.prcs_formats', level='WARNING'):
+                with self.assertRaises(RuntimeError):
+                    pool.process(".gpx", self.path)
+
+        self.assertEqual(len(names), 2)
+        for name in names:
+            with self.assertRaises(FileNotFoundError):
+                SharedMemory(name=name)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,9 +2,10 @@ import unittest
 import tempfile
 import os
 import json
+import io
 from shapely.geometry import Point, LineString, Polygon, MultiPoint, MultiPolygon, MultiLineString
 import geopandas as gpd
-from modules.prcs_geojson import process_geojson
+from modules.prcs_geojson import process_geojson, process_geojson_feature
 from modules.prcs_flow import ProcessingError
 
 
@@ -228,6 +229,36 @@ class TestPrcsGeojson(unittest.TestCase):
         finally:
             os.remove(geojson_path)
 
+    def test_process_geojson_from_memory(self):
+        # GeoJSON в памяти читается через /vsimem/ без временного файла
+        content = json.dumps({"type": "FeatureCollection", "features": [
+            {"type": "Feature", "properties": {"title": "T"},
+             "geometry": {"type": "Point", "coordinates": [37.6173, 55.7558]}}]}).encode('utf-8')
+
+        for source in (content, io.BytesIO(content)):
+            result = process_geojson(source, 'upload.geojson')
+            self.assertEqual(list(result['paths'].values()), [[[37.6173, 55.7558]]])
+            self.assertEqual(list(result['points'].values())[0]['desc'], 'upload.geojson')
+
+    def test_process_geojson_feature_matches_file(self):
+        # Объект из словаря дает те же контуры и подписи, что и чтение GeoJSON через GDAL
+        feature = {"type": "Feature", "properties": {"category_t": "Cat", "title": "Title"},
+                   "geometry": Polygon([(0, 0), (4, 0), (4, 4), (0, 4), (0, 0)],
+                                       [[(1, 1), (2, 1), (2, 2), (1, 1)]]).__geo_interface__}
+        content = json.dumps({"type": "FeatureCollection", "features": [feature]}).encode('utf-8')
+
+        expected = process_geojson(content, 'feature')
+        result = process_geojson_feature(feature, 'feature')
+
+        self.assertEqual([list(map(list, path)) for path in result['paths'].values()],
+                         [list(map(list, path)) for path in expected['paths'].values()])
+        self.assertEqual(list(result['points'].values()), list(expected['points'].values()))
+        self.assertEqual(result['metadata'], ['Cat Title'])
+
+    def test_process_geojson_feature_without_geometry(self):
+        with self.assertRaises(ProcessingError):
+            process_geojson_feature({"type": "Feature", "properties": {}, "geometry": None}, 'feature')
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,6 +1,7 @@
 import unittest
 import tempfile
 import os
+import io
 from modules.prcs_gpx import process_gpx
 from modules.prcs_flow import ProcessingError
 
@@ -257,6 +258,16 @@ class TestPrcsGpx(unittest.TestCase):
         finally:
             os.remove(gpx_file)
 
+    def test_process_gpx_from_memory(self):
+        # Содержимое в памяти и открытый файл обрабатываются без временного файла, описание — из filename
+        content = b'''<?xml version="1.0" encoding="UTF-8"?>
+<gpx version="1.1" creator="test"><wpt lat="55.7558" lon="37.6173"></wpt></gpx>'''
+
+        for source in (content, io.BytesIO(content)):
+            result = process_gpx(source, 'upload.gpx')
+            point = list(result['points'].values())[0]
+            self.assertEqual(point, {"coords": [37.6173, 55.7558], "desc": "upload.gpx"})
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,55 @@
+import unittest
+import json
+from modules.prcs_index_stream import decode_index_stream
+
+
+def split(raw, size):
+    return [raw[i:i + size] for i in range(0, len(raw), size)]
+
+
+class TestDecodeIndexStream(unittest.TestCase):
+
+    def setUp(self):
+        self.index = {
+            "paths": {f"id{n}": [[37.123456 + n, 55.654321], [-0.5, 1e-7]] for n in range(50)},
+            "points": {
+                "id1": {"coords": [37.6, 55.7], "desc": "Тест \"кавычки\" и ✓"},
+                "id2": {"coords": [0, 0], "desc": ""}
+            }
+        }
+
+    def test_matches_json_loads(self):
+        # Результат не зависит от того, как тело разбито на фрагменты
+        for indent in (None, 2):
+            raw = json.dumps(self.index, ensure_ascii=False, indent=indent).encode('utf-8')
+            for size in (1, 3, 17, 1024, len(raw)):
+                self.assertEqual(decode_index_stream(split(raw, size)), self.index)
+
+    def test_number_split_between_chunks(self):
+        # Число на границе фрагментов не обрезается
+        self.assertEqual(decode_index_stream([b'{"paths": {"a": [12', b'345]}, "n": 6', b'7}']),
+                         {"paths": {"a": [12345]}, "n": 67})
+
+    def test_numbers_split_at_every_offset(self):
+        # Граница фрагментов после ".", "e" или знака экспоненты не обрезает число
+        raw = b'{"paths": {"a": [0.1, -12.5e-3, 1E+10, 7, -0.0]}, "n": 3.25e2, "m": [1e5]}'
+        for first in range(1, len(raw)):
+            for second in range(first + 1, len(raw)):
+                chunks = [raw[:first], raw[first:second], raw[second:]]
+                self.assertEqual(decode_index_stream(chunks), json.loads(raw), chunks)
+        for raw in (b'0.1', b'-2e-5', b'42'):
+            for offset in range(1, len(raw)):
+                self.assertEqual(decode_index_stream([raw[:offset], raw[offset:]]), json.loads(raw))
+
+    def test_other_documents(self):
+        for raw in (b'{}', b' {"paths": {}, "points": {}} \n', b'[1, 2]', b'"text"', b'{"a": null}'):
+            self.assertEqual(decode_index_stream(split(raw, 2)), json.loads(raw))
+
+    def test_invalid_json(self):
+        for raw in (b'', b'{', b'{"a" 1}', b'{"a": 1,}', b'{"a": {"b": 1}', b'{"a": 1} x', b'{1: 2}', b'\xff'):
+            with self.assertRaises(ValueError):
+                decode_index_stream(split(raw, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
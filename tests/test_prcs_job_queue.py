@@ -0,0 +1,199 @@
+import unittest
+import os
+import sqlite3
+import tempfile
+from unittest.mock import patch
+from modules.prcs_job_queue import SQLiteJobQueue, check_job_backends, QUEUE_QUEUED, QUEUE_RUNNING, QUEUE_DONE, \
+    QUEUE_FAILED, QUEUE_CANCELLED
+from modules.prcs_flow import JobQueueFullError, report_job, results_saved
+from modules.prcs_event_log import SQLiteEventLog, set_event_log
+from worker import run_job
+
+
+class TestSQLiteJobQueue(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.now = 1000.0
+        patcher = patch('modules.prcs_job_queue.time.time', side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.queue = SQLiteJobQueue(os.path.join(self.directory, 'jobs.sqlite3'), queue_size=2,
+                                    lease_timeout=60, max_attempts=2, ttl=3600)
+
+    def use_event_log(self):
+        event_log = SQLiteEventLog(os.path.join(self.directory, 'events.sqlite3'))
+        set_event_log(event_log)
+        self.addCleanup(set_event_log, None)
+        patcher = patch('modules.prcs_job_queue.JOB_EVENT_BUS', 'sqlite')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return event_log
+
+    def make_temp_file(self):
+        fd, path = tempfile.mkstemp(dir=self.directory)
+        os.close(fd)
+        return path
+
+    def test_claim_order_and_finish(self):
+        # Задачи выдаются по порядку постановки и только одному обработчику
+        self.queue.enqueue("a", "nspd", ["1"])
+        self.now += 1
+        self.queue.enqueue("b", "nspd", ["2"])
+
+        first = self.queue.claim("w1")
+        second = self.queue.claim("w2")
+        self.assertEqual((first["id"], first["args"], first["attempts"]), ("a", ["1"], 1))
+        self.assertEqual(second["id"], "b")
+        self.assertIsNone(self.queue.claim("w3"))
+
+        self.queue.finish("a", {"processed": 1, "error": None})
+        self.queue.finish("b", {"error": "ошибка"})
+        self.assertEqual(self.queue.get("a")["state"], QUEUE_DONE)
+        self.assertEqual(self.queue.get("b")["report"], {"error": "ошибка"})
+        self.assertEqual(self.queue.counts()[QUEUE_FAILED], 1)
+
+    def test_list_and_ttl(self):
+        # Страница задач начиная с новых; завершенные задачи удаляются через ttl секунд
+        self.queue.enqueue("a", "nspd", ["1"])
+        self.now += 1
+        self.queue.enqueue("b", "nspd", ["2"])
+        total, jobs = self.queue.list(offset=0, limit=1)
+        self.assertEqual((total, [job["id"] for job in jobs]), (2, ["b"]))
+
+        self.queue.claim("w1")
+        self.queue.finish("a", {"error": None})
+        self.assertEqual(self.queue.list(state=QUEUE_DONE)[0], 1)
+        self.now += 3601
+        total, jobs = self.queue.list()
+        self.assertEqual((total, [job["id"] for job in jobs]), (1, ["b"]))
+
+    def test_backends_check(self):
+        # Лог задач обработчиков доступен веб-приложению только через журнал SQLite
+        with self.assertRaises(ValueError):
+            check_job_backends('sqlite', 'memory')
+        check_job_backends('sqlite', 'sqlite')
+        check_job_backends('memory', 'memory')
+
+    def test_queue_full(self):
+        self.queue.enqueue("a", "nspd", ["1"])
+        self.queue.enqueue("b", "nspd", ["2"])
+        with self.assertRaises(JobQueueFullError):
+            self.queue.enqueue("c", "nspd", ["3"])
+
+    def test_survives_restart(self):
+        # Очередь в файле доступна новому экземпляру, например после перезапуска
+        self.queue.enqueue("a", "nspd", ["1"])
+        restarted = SQLiteJobQueue(self.queue.path)
+        self.assertEqual(restarted.claim("w1")["id"], "a")
+
+    def test_expired_lease(self):
+        # Задача упавшего обработчика возвращается в очередь, после max_attempts попыток — ошибка
+        temp_path = self.make_temp_file()
+        self.queue.enqueue("a", "upload", [[[temp_path, "track.gpx"]]])
+        self.queue.claim("w1")
+
+        self.now += 30
+        self.assertFalse(self.queue.heartbeat("a", "w1"))
+        self.now += 59
+        self.assertIsNone(self.queue.claim("w2"))
+
+        self.now += 2
+        retried = self.queue.claim("w2")
+        self.assertEqual((retried["id"], retried["attempts"]), ("a", 2))
+        self.assertTrue(os.path.exists(temp_path))
+
+        self.now += 61
+        self.assertIsNone(self.queue.claim("w3"))
+        self.assertEqual(self.queue.get("a")["state"], QUEUE_FAILED)
+        self.assertFalse(os.path.exists(temp_path))
+
+    def test_cancel(self):
+        # Задача в очереди отменяется сразу, выполняющаяся получает отмену при продлении аренды
+        temp_path = self.make_temp_file()
+        self.queue.enqueue("a", "upload", [[[temp_path, "track.gpx"]]])
+        self.assertEqual(self.queue.cancel("a")["state"], QUEUE_CANCELLED)
+        self.assertFalse(os.path.exists(temp_path))
+
+        self.queue.enqueue("b", "nspd", ["1"])
+        self.queue.claim("w1")
+        self.assertEqual(self.queue.cancel("b")["state"], QUEUE_RUNNING)
+        self.assertTrue(self.queue.heartbeat("b", "w1"))
+        self.assertIsNone(self.queue.cancel("unknown"))
+        self.assertEqual(self.queue.counts()[QUEUE_QUEUED], 0)
+
+    def test_job_log_closed_without_worker(self):
+        # Лог задачи, отмененной в очереди или не завершенной обработчиками, завершается итоговой записью
+        event_log = self.use_event_log()
+        self.queue.enqueue("a", "nspd", ["1"])
+        event_log.open("a")
+        self.queue.cancel("a")
+        events, closed = event_log.read("a", 0)
+        self.assertTrue(closed)
+        self.assertEqual(events[-1][1]["message"], "✗ Задача отменена до запуска")
+
+        self.queue.enqueue("b", "nspd", ["2"])
+        event_log.open("b")
+        for _ in range(2):
+            self.queue.claim("w1")
+            self.assertFalse(event_log.read("b", 0)[1])
+            self.now += 61
+        self.assertIsNone(self.queue.claim("w2"))
+        events, closed = event_log.read("b", 0)
+        self.assertTrue(closed)
+        self.assertEqual(events[-1][1]["message"], "✗ Обработчик не завершил задачу за 2 попыток")
+
+    def test_worker_runs_job(self):
+        # Обработчик выполняет задачу по виду и записывает ее отчет в очередь
+        calls = []
+
+        def target(log_queue, job_id, registry_number):
+            calls.append((job_id, registry_number))
+            log_queue.put({"level": "info", "message": "готово"})
+            report_job(processed=1)
+
+        self.queue.enqueue("a", "nspd", ["1"])
+        with patch.dict('worker.JOB_TARGETS', {"nspd": target}):
+            run_job(self.queue, self.queue.claim("w1"), "w1")
+
+        job = self.queue.get("a")
+        self.assertEqual(calls, [("a", "1")])
+        self.assertEqual((job["state"], job["report"]["processed"]), (QUEUE_DONE, 1))
+
+    def test_worker_retry_keeps_files_until_finish(self):
+        # Повтор после сбоя получает временные файлы и отметку сохранения; файлы удаляются при завершении задачи
+        calls = []
+
+        def target(log_queue, job_id, feed):
+            calls.append((feed.keep_files, [path for path, _ in feed.wait(0, timeout=0)[0]], results_saved()))
+
+        temp_path = self.make_temp_file()
+        self.queue.enqueue("a", "upload", [[[temp_path, "track.gpx"]]])
+        self.queue.claim("w1")
+        self.queue.mark_saved("a")
+        self.now += 61
+        with patch.dict('worker.JOB_TARGETS', {"upload": target}):
+            run_job(self.queue, self.queue.claim("w2"), "w2")
+
+        self.assertEqual(calls, [(True, [temp_path], True)])
+        self.assertEqual(self.queue.get("a")["state"], QUEUE_DONE)
+        self.assertFalse(os.path.exists(temp_path))
+
+    def test_adds_saved_column(self):
+        # Очередь, созданная до появления отметки сохранения, получает столбец saved
+        path = os.path.join(self.directory, 'old.sqlite3')
+        connection = sqlite3.connect(path)
+        connection.execute("CREATE TABLE jobs (id TEXT PRIMARY KEY, kind TEXT NOT NULL, args TEXT NOT NULL, "
+                           "state TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, worker TEXT, lease_until REAL, "
+                           "cancel_requested INTEGER NOT NULL DEFAULT 0, report TEXT, created REAL NOT NULL, "
+                           "started REAL, finished REAL)")
+        connection.execute("INSERT INTO jobs (id, kind, args, state, created) VALUES ('a', 'nspd', '[]', 'queued', 1)")
+        connection.commit()
+        connection.close()
+        self.assertFalse(SQLiteJobQueue(path).get("a")["saved"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,280 @@
+import unittest
+import threading
+from queue import Queue
+from unittest.mock import patch
+from modules.prcs_jobs import JobExecutor, JobRegistry, EventBuffer, JOB_QUEUED, JOB_RUNNING, JOB_DONE, \
+    JOB_CANCELLED
+from modules.prcs_flow import JobQueueFullError, JobCancelledError, report_job, report_file, check_cancelled
+
+
+class TestJobExecutor(unittest.TestCase):
+
+    def setUp(self):
+        self.release = threading.Event()
+        self.executor = JobExecutor(workers=2, queue_size=2, retry_after=7)
+
+    def tearDown(self):
+        self.release.set()
+        self.executor.shutdown()
+
+    def blocking_job(self, log_queue, name, started=None):
+        if started is not None:
+            started.set()
+        self.assertTrue(self.release.wait(timeout=5))
+        log_queue.put(name)
+        log_queue.put(None)
+
+    def start_blocking(self, count):
+        queues = []
+        for n in range(count):
+            started = threading.Event()
+            log_queue = Queue()
+            self.assertEqual(self.executor.submit(self.blocking_job, log_queue, f"job{n}", started), 0)
+            self.assertTrue(started.wait(timeout=5))
+            queues.append(log_queue)
+        return queues
+
+    def test_runs_jobs(self):
+        # Задача выполняется в рабочем потоке и получает свою очередь лога
+        log_queue = Queue()
+        self.release.set()
+        self.executor.submit(self.blocking_job, log_queue, "job")
+        self.assertEqual(log_queue.get(timeout=5), "job")
+
+    def test_worker_limit_and_positions(self):
+        # Сверх числа рабочих потоков задачи ждут в очереди и видят свою позицию
+        self.start_blocking(2)
+        waiting = [Queue(), Queue()]
+        positions = [self.executor.submit(self.blocking_job, log_queue, f"wait{n}")
+                     for n, log_queue in enumerate(waiting)]
+
+        self.assertEqual(positions, [1, 2])
+        self.assertEqual(self.executor.queued(), 2)
+        self.assertEqual(waiting[1].get(timeout=5)['queue_position'], 2)
+
+        self.release.set()
+        # Когда первая задача из очереди начинает выполняться, вторая сдвигается на первую позицию
+        self.assertEqual(waiting[1].get(timeout=5)['queue_position'], 1)
+        self.assertEqual(waiting[1].get(timeout=5), "wait1")
+
+    def test_queue_full(self):
+        # Заполненная очередь отклоняет задачу с рекомендуемым временем повтора
+        self.start_blocking(2)
+        self.executor.submit(self.blocking_job, Queue(), "wait0")
+        self.executor.submit(self.blocking_job, Queue(), "wait1")
+
+        with self.assertRaises(JobQueueFullError) as context:
+            self.executor.submit(self.blocking_job, Queue(), "rejected")
+        self.assertEqual(context.exception.retry_after, 7)
+
+    def test_cancel_pending(self):
+        # Отмененная задача снимается с очереди и выполняется сразу, не дожидаясь рабочего потока
+        self.start_blocking(2)
+        waiting = [Queue(), Queue()]
+        cancel_event = threading.Event()
+        cancelled_run = []
+        self.executor.submit(lambda log_queue: cancelled_run.append(threading.current_thread()), waiting[0],
+                             cancel_event=cancel_event)
+        self.executor.submit(self.blocking_job, waiting[1], "wait1")
+        self.assertEqual(waiting[1].get(timeout=5)['queue_position'], 2)
+
+        cancel_event.set()
+        self.assertTrue(self.executor.cancel_pending(cancel_event))
+        self.assertEqual(cancelled_run, [threading.current_thread()])
+        self.assertEqual(self.executor.queued(), 1)
+        self.assertEqual(waiting[1].get(timeout=5)['queue_position'], 1)
+        self.assertFalse(self.executor.cancel_pending(cancel_event))
+
+    def test_failed_job_keeps_worker(self):
+        # Исключение в задаче не останавливает рабочий поток
+        def failing_job(log_queue):
+            raise RuntimeError("boom")
+
+        log_queue = Queue()
+        self.release.set()
+        executor = JobExecutor(workers=1, queue_size=2)
+        self.addCleanup(executor.shutdown)
+        with self.assertLogs('modules.prcs_jobs', level='ERROR'):
+            executor.submit(failing_job, Queue())
+            executor.submit(self.blocking_job, log_queue, "after")
+            entry = log_queue.get(timeout=5)
+            while isinstance(entry, dict):
+                entry = log_queue.get(timeout=5)
+            self.assertEqual(entry, "after")
+
+
+class TestEventBuffer(unittest.TestCase):
+
+    def test_replay_after_id(self):
+        # Записи не забираются читателем: каждый получает их с нужного номера
+        events = EventBuffer()
+        for n in range(3):
+            events.put({"message": str(n)})
+
+        self.assertEqual(events.wait(0, timeout=0), ([(1, {"message": "0"}), (2, {"message": "1"}),
+                                                      (3, {"message": "2"})], False))
+        self.assertEqual(events.wait(2, timeout=0), ([(3, {"message": "2"})], False))
+        self.assertEqual(events.wait(3, timeout=0), ([], False))
+
+    def test_ring_overflow(self):
+        # Старые записи вытесняются, номера продолжают расти
+        events = EventBuffer(maxlen=2)
+        for n in range(5):
+            events.put({"message": str(n)})
+        events.put(None)
+
+        self.assertEqual(len(events), 2)
+        self.assertEqual(events.wait(0), ([(4, {"message": "3"}), (5, {"message": "4"})], True))
+
+    def test_wait_wakes_subscribers(self):
+        # Все ожидающие подписчики просыпаются при новой записи
+        events = EventBuffer()
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(events.wait(0, timeout=5))) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        events.put({"message": "a"})
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, [([(1, {"message": "a"})], False)] * 2)
+
+
+class TestJobRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 1000.0
+        patcher = patch('modules.prcs_jobs.time.time', side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def run_job(self, registry, records=0):
+        job = registry.create()
+
+        def target(log_queue):
+            self.assertEqual(registry.get(job.id).state, JOB_RUNNING)
+            for n in range(records):
+                log_queue.put({"message": str(n)})
+
+        registry.run(job.id, target, job.log_queue)
+        return job
+
+    def test_job_lifecycle(self):
+        # Задача проходит состояния queued, running, done с отметками времени
+        registry = JobRegistry()
+        job = registry.create()
+        self.assertEqual(job.state, JOB_QUEUED)
+
+        self.now = 1005.0
+        registry.run(job.id, lambda log_queue: None, job.log_queue)
+
+        self.assertEqual(job.state, JOB_DONE)
+        self.assertEqual((job.created, job.started, job.finished), (1000.0, 1005.0, 1005.0))
+
+    def test_ttl_eviction(self):
+        # Завершенная задача удаляется после ttl, выполняющаяся остается
+        registry = JobRegistry(ttl=60)
+        finished = self.run_job(registry)
+        running = registry.create()
+
+        self.now += 59
+        self.assertEqual(registry.stats()["jobs"], 2)
+        self.now += 1
+        stats = registry.stats()
+
+        self.assertIsNone(registry.get(finished.id))
+        self.assertIs(registry.get(running.id), running)
+        self.assertEqual((stats["jobs"], stats["queued"], stats["evicted"]), (1, 1, 1))
+
+    def test_max_jobs(self):
+        # При превышении числа задач раньше срока удаляются самые старые завершенные
+        registry = JobRegistry(max_jobs=3)
+        jobs = []
+        for _ in range(3):
+            jobs.append(self.run_job(registry))
+            self.now += 1
+        registry.create()
+
+        self.assertIsNone(registry.get(jobs[0].id))
+        self.assertIsNotNone(registry.get(jobs[1].id))
+        self.assertEqual(registry.stats()["jobs"], 3)
+
+    def test_max_records(self):
+        # Непрочитанные записи лога учитываются в пределе памяти
+        registry = JobRegistry(max_records=10)
+        old = self.run_job(registry, records=8)
+        self.now += 1
+        recent = self.run_job(registry, records=5)
+        registry.create()
+
+        self.assertIsNone(registry.get(old.id))
+        self.assertIsNotNone(registry.get(recent.id))
+        self.assertEqual(registry.stats()["buffered_records"], 5)
+
+    def test_job_report(self):
+        # Задача заполняет отчет через report_job/report_file, файлы упорядочиваются по порядку загрузки
+        registry = JobRegistry()
+        job = registry.create()
+
+        def target(log_queue):
+            self.now += 2
+            report_file({"index": 1, "name": "b.gpx", "status": "skipped", "reason": "ошибка", "elapsed": 0.1})
+            report_file({"index": 0, "name": "a.gpx", "status": "processed", "reason": None, "elapsed": 0.2})
+            report_job(processed=1, skipped=1)
+
+        self.now = 1003.0
+        registry.run(job.id, target, job.log_queue)
+        data = job.to_dict()
+
+        self.assertEqual(data["state"], JOB_DONE)
+        self.assertEqual((data["processed"], data["skipped"], data["error"]), (1, 1, None))
+        self.assertEqual([outcome["name"] for outcome in data["files"]], ["a.gpx", "b.gpx"])
+        self.assertEqual((data["queue_wait"], data["duration"]), (3.0, 2.0))
+        self.assertEqual(data["created"], "1970-01-01T00:16:40+00:00")
+        self.assertNotIn("files", job.to_dict(include_files=False))
+
+    def test_cancel(self):
+        # Токен отмены виден задаче через check_cancelled, завершенную задачу отменить нельзя
+        registry = JobRegistry()
+        job = registry.create()
+        self.assertIs(registry.cancel(job.id), job)
+
+        def target(log_queue):
+            with self.assertRaises(JobCancelledError):
+                check_cancelled()
+
+        registry.run(job.id, target, job.log_queue)
+        check_cancelled()
+        self.assertTrue(job.to_dict()["cancelled"])
+        # Отмененная задача отличается от успешно завершенной
+        self.assertEqual(job.state, JOB_CANCELLED)
+        self.assertEqual(registry.stats()[JOB_CANCELLED], 1)
+
+        finished = self.run_job(registry)
+        registry.cancel(finished.id)
+        self.assertFalse(finished.report["cancelled"])
+        self.assertIsNone(registry.cancel("unknown"))
+
+    def test_report_outside_job(self):
+        # Вне задачи отчеты игнорируются
+        report_job(error="x")
+        report_file({"index": 0})
+
+    def test_list(self):
+        # Список задач начинается с новых, фильтр по состоянию учитывается в total
+        registry = JobRegistry()
+        done = self.run_job(registry)
+        self.now += 1
+        queued = [registry.create() for _ in range(3)]
+        for job in queued:
+            job.created = self.now
+            self.now += 1
+
+        total, page = registry.list(offset=1, limit=2)
+        self.assertEqual(total, 4)
+        self.assertEqual(page, [queued[1], queued[0]])
+        self.assertEqual(registry.list(state=JOB_DONE), (1, [done]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,7 @@
 import unittest
 import tempfile
 import os
+import io
 import zipfile
 from modules.prcs_kml import process_kml
 from modules.prcs_flow import ProcessingError
@@ -428,6 +429,19 @@ class TestPrcsKml(unittest.TestCase):
         finally:
             os.remove(kml_file)
 
+    def test_process_kml_from_memory(self):
+        # KML и KMZ в памяти разбираются без временного файла
+        kml_content = '''<?xml version="1.0" encoding="UTF-8"?>
+<kml xmlns="http://www.opengis.net/kml/2.2"><Placemark><name>P</name>
+<Point><coordinates>37.6173,55.7558,0</coordinates></Point></Placemark></kml>'''
+        kmz = io.BytesIO()
+        with zipfile.ZipFile(kmz, 'w') as zipf:
+            zipf.writestr('doc.kml', kml_content)
+
+        for source in (kml_content.encode('utf-8'), io.BytesIO(kmz.getvalue()), kmz.getvalue()):
+            result = process_kml(source, 'upload.kmz')
+            self.assertEqual([point['coords'] for point in result['points'].values()], [[37.6173, 55.7558]])
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,107 @@
+import unittest
+import os
+import threading
+from io import BytesIO
+from unittest.mock import patch
+from werkzeug.sansio.multipart import MultipartEncoder, Preamble, Field, File, Data, Epilogue
+from werkzeug.datastructures import Headers
+from modules.prcs_flow import ProcessingError
+from modules.prcs_multipart import UploadFeed, read_multipart_uploads
+
+BOUNDARY = b'test-boundary'
+
+
+def encode(parts):
+    # Тело multipart: пары (имя поля, имя файла, содержимое)
+    encoder = MultipartEncoder(BOUNDARY)
+    body = encoder.send_event(Preamble(data=b''))
+    for name, filename, content in parts:
+        if filename is None:
+            body += encoder.send_event(Field(name=name, headers=Headers()))
+        else:
+            body += encoder.send_event(File(name=name, filename=filename, headers=Headers()))
+        body += encoder.send_event(Data(data=content, more_data=False))
+    return body + encoder.send_event(Epilogue(data=b''))
+
+
+class ChunkedStream:
+    """Тело запроса, поступающее небольшими фрагментами; запоминает число файлов в feed при каждом чтении"""
+
+    def __init__(self, body, feed, size=7):
+        self.body = BytesIO(body)
+        self.feed = feed
+        self.size = size
+        self.seen = []
+
+    def read(self, _):
+        self.seen.append(len(self.feed))
+        return self.body.read(self.size)
+
+
+def accept(filename):
+    return filename if filename.endswith('.gpx') else None
+
+
+class TestReadMultipartUploads(unittest.TestCase):
+
+    def test_files_handed_over_while_receiving(self):
+        # Первый файл попадает в feed раньше, чем принято все тело
+        feed = UploadFeed()
+        body = encode([('note', None, b'text'), ('files', 'a.gpx', b'A' * 50),
+                       ('files', 'skip.exe', b'B' * 10), ('files', 'c.gpx', b'C' * 50)])
+        stream = ChunkedStream(body, feed)
+
+        self.assertEqual(read_multipart_uploads(stream, BOUNDARY, feed, 'job', accept), 2)
+
+        self.assertEqual(feed.wait(0, timeout=0)[0], [(b'A' * 50, 'a.gpx'), (b'C' * 50, 'c.gpx')])
+        self.assertIn(1, stream.seen)
+
+    def test_large_file_spilled_to_disk(self):
+        # Файл больше предела памяти записывается во временный файл
+        feed = UploadFeed()
+        with patch('modules.prcs_multipart.UPLOAD_MEMORY_LIMIT', 10):
+            read_multipart_uploads(BytesIO(encode([('files', 'a.gpx', b'A' * 100)])), BOUNDARY, feed, 'job', accept)
+
+        (path, filename), = feed.wait(0, timeout=0)[0]
+        self.assertEqual(filename, 'a.gpx')
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), b'A' * 100)
+        os.remove(path)
+
+    def test_truncated_body(self):
+        # Оборванное тело — ошибка приема; недогруженный файл не передается задаче, его временный файл удаляется
+        feed = UploadFeed()
+        body = encode([('files', 'a.gpx', b'A' * 20), ('files', 'b.gpx', b'B' * 100)])
+        with patch('modules.prcs_multipart.UPLOAD_MEMORY_LIMIT', 10), self.assertRaises(ProcessingError):
+            read_multipart_uploads(BytesIO(body[:-60]), BOUNDARY, feed, 'job', accept)
+
+        items, _ = feed.wait(0, timeout=0)
+        self.assertEqual([filename for _, filename in items], ['a.gpx'])
+        self.assertFalse(os.path.exists('/tmp/job_1_b.gpx'))
+        os.remove(items[0][0])
+
+
+class TestUploadFeed(unittest.TestCase):
+
+    def test_wait_wakes_on_add_and_close(self):
+        feed = UploadFeed()
+        threading.Timer(0.05, feed.add, args=(b'a', 'a.gpx')).start()
+        self.assertEqual(feed.wait(0, timeout=5), ([(b'a', 'a.gpx')], False))
+
+        threading.Timer(0.05, feed.close).start()
+        self.assertEqual(feed.wait(1, timeout=5), ([], True))
+
+    def test_discard_removes_late_files(self):
+        feed = UploadFeed()
+        feed.discard()
+        path = '/tmp/test_prcs_multipart_discard.gpx'
+        with open(path, 'wb') as f:
+            f.write(b'a')
+        feed.add(path, 'a.gpx')
+
+        self.assertEqual(len(feed), 0)
+        self.assertFalse(os.path.exists(path))
+
+
+if __name__ == '__main__':
+    unittest.main()
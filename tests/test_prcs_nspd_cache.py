@@ -0,0 +1,76 @@
+import unittest
+import os
+import tempfile
+from unittest.mock import patch
+from modules.prcs_nspd_cache import SQLiteNspdCache
+
+
+def border_result():
+    return {"paths": {"u1": [[37.0, 55.0], [37.1, 55.1]]}, "points": {"u1": {"coords": [37.0, 55.0], "desc": "МО"}},
+            "metadata": ["МО НСПД: 23:01-6.1"]}
+
+
+class TestSQLiteNspdCache(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'nspd.sqlite3')
+        self.cache = SQLiteNspdCache(self.path, ttl=60, max_entries=2)
+
+    def test_shared_between_instances(self):
+        # Результат, сохраненный одним процессом, доступен другому
+        self.cache.put("36278", "23:01-6.1", border_result())
+        result = SQLiteNspdCache(self.path).get("36278", "23:01-6.1")
+
+        self.assertEqual(result["metadata"], ["МО НСПД: 23:01-6.1"])
+        self.assertEqual(list(result["paths"].values()), [[[37.0, 55.0], [37.1, 55.1]]])
+        self.assertEqual(list(result["points"].values()), [{"coords": [37.0, 55.0], "desc": "МО"}])
+        self.assertIsNone(self.cache.get("36281", "23:01-6.1"))
+
+    def test_hit_gets_new_ids(self):
+        # Повторная загрузка добавляет объекты в index.json, а не перезаписывает прежние
+        self.cache.put("36278", "23:01-6.1", border_result())
+        first = self.cache.get("36278", "23:01-6.1")
+        second = self.cache.get("36278", "23:01-6.1")
+
+        self.assertNotIn("u1", first["paths"])
+        self.assertEqual(set(first["paths"]), set(first["points"]))
+        self.assertFalse(set(first["paths"]) & set(second["paths"]))
+
+    def test_expired_entry(self):
+        self.cache.put("36278", "23:01-6.1", border_result())
+        with patch('modules.prcs_nspd_cache.time.time', return_value=10 ** 10):
+            self.assertIsNone(self.cache.get("36278", "23:01-6.1"))
+        self.assertEqual(len(self.cache), 0)
+
+    def test_corrupt_entry_is_a_miss(self):
+        # Запись, которую не удается прочитать, удаляется, и номер запрашивается в НСПД заново
+        self.cache.put("36278", "a", border_result())
+        self.cache.put("36278", "b", border_result())
+        connection = self.cache._connection()
+        connection.execute("UPDATE nspd_cache SET result = '{\"paths\": ' WHERE registry_number = 'a'")
+        connection.execute("UPDATE nspd_cache SET result = '[1, 2]' WHERE registry_number = 'b'")
+
+        self.assertIsNone(self.cache.get("36278", "a"))
+        self.assertIsNone(self.cache.get("36278", "b"))
+        self.assertEqual(len(self.cache), 0)
+
+    def test_least_recently_used_evicted(self):
+        with patch('modules.prcs_nspd_cache.time.time') as mock_time:
+            for now, number in enumerate(["a", "b"]):
+                mock_time.return_value = 1000 + now
+                self.cache.put("36278", number, border_result())
+            mock_time.return_value = 1002
+            self.cache.get("36278", "a")
+            mock_time.return_value = 1003
+            self.cache.put("36278", "c", border_result())
+
+            self.assertEqual(len(self.cache), 2)
+            self.assertIsNotNone(self.cache.get("36278", "a"))
+            self.assertIsNone(self.cache.get("36278", "b"))
+            self.assertIsNotNone(self.cache.get("36278", "c"))
+
+
+if __name__ == '__main__':
+    unittest.main()
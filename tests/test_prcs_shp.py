@@ -327,6 +327,18 @@ class TestPrcsShp(unittest.TestCase):
         finally:
             os.remove(zip_path)
 
+    def test_process_zip_from_memory(self):
+        # ZIP-архив в памяти: pyogrio распознает архив без пути zip://
+        zip_path = self.create_shapefile_zip([Point(37.6173, 55.7558)], [{'title': 'T'}])
+        try:
+            with open(zip_path, 'rb') as f:
+                content = f.read()
+        finally:
+            os.remove(zip_path)
+
+        result = process_zip(content, 'upload.zip')
+        self.assertEqual(list(result['paths'].values()), [[[37.6173, 55.7558]]])
+
 
 if __name__ == '__main__':
     unittest.main()
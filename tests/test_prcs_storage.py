@@ -0,0 +1,174 @@
+import unittest
+import tempfile
+import shutil
+import os
+import subprocess
+import sys
+import threading
+from unittest.mock import MagicMock, patch
+from modules.prcs_storage import (
+    LocalStorage,
+    MemoryStorage,
+    YandexDiskStorage,
+    create_storage,
+    get_storage,
+    set_storage,
+    ensure_folder,
+    download_index_json_with_revision,
+    update_index_json,
+    INDEX_UPDATE_MAX_ATTEMPTS
+)
+from modules.prcs_upload import get_index_path
+from modules.prcs_flow import ProcessingError, IndexConflictError, REVISION_ABSENT
+
+
+class StorageContractMixin:
+    # Общие проверки интерфейса хранилища для всех реализаций
+
+    def make_storage(self):
+        raise NotImplementedError
+
+    def setUp(self):
+        self.storage = self.make_storage()
+
+    def test_empty_index(self):
+        # Пустое хранилище не содержит index.json
+        self.assertEqual(self.storage.get_index(), (None, REVISION_ABSENT))
+        self.assertIsNone(self.storage.revision())
+
+    def test_put_and_get_index(self):
+        # Записанный index.json читается вместе с новой ревизией
+        data = {"paths": {"id1": [[0, 0]]}, "points": {"id1": {"coords": [0, 0], "desc": "Тест"}}}
+        self.storage.put_index(data, if_revision=REVISION_ABSENT)
+
+        index, revision = self.storage.get_index()
+        self.assertEqual(index, data)
+        self.assertEqual(revision, self.storage.revision())
+        self.assertGreater(revision, REVISION_ABSENT)
+
+    def test_put_index_conflict(self):
+        # Устаревшая ревизия приводит к конфликту
+        self.storage.put_index({"paths": {}, "points": {}}, if_revision=REVISION_ABSENT)
+        _, revision = self.storage.get_index()
+        self.storage.put_index({"paths": {"a": []}, "points": {}}, if_revision=revision)
+
+        with self.assertRaises(IndexConflictError):
+            self.storage.put_index({"paths": {}, "points": {}}, if_revision=revision)
+        with self.assertRaises(IndexConflictError):
+            self.storage.put_index({"paths": {}, "points": {}}, if_revision=REVISION_ABSENT)
+
+    @patch('modules.prcs_storage.time.sleep')
+    def test_update_index_merges_concurrent_changes(self, mock_sleep):
+        # Конкурирующее изменение не теряется: данные объединяются повторно
+        stale_snapshot = self.storage.get_index()
+        self.storage.update_index({"paths": {"a": [[0, 0]]}, "points": {}})
+
+        attempts = self.storage.update_index({"paths": {"b": [[1, 1]]}, "points": {}}, stale_snapshot)
+
+        self.assertEqual(attempts, 2)
+        self.assertEqual(set(self.storage.get_index()[0]["paths"]), {"a", "b"})
+
+    def test_parallel_updates_do_not_lose_data(self):
+        # Параллельные задачи без глобальной блокировки не теряют данные друг друга
+        def worker(n):
+            self.storage.update_index({"paths": {f"p{n}": [[n, n]]}, "points": {}})
+
+        with patch('modules.prcs_storage.INDEX_UPDATE_MAX_ATTEMPTS', 50), \
+                patch('modules.prcs_storage.INDEX_UPDATE_BACKOFF_MAX', 0.01):
+            threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(len(self.storage.get_index()[0]["paths"]), 8)
+
+
+class TestMemoryStorage(StorageContractMixin, unittest.TestCase):
+
+    def make_storage(self):
+        return MemoryStorage()
+
+    def test_ensure_folder(self):
+        self.storage.ensure_folder("a/b")
+        self.assertIn("a/b", self.storage.folders)
+
+
+class TestLocalStorage(StorageContractMixin, unittest.TestCase):
+
+    def make_storage(self):
+        self.root = tempfile.mkdtemp()
+        return LocalStorage(self.root)
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def test_index_written_to_day_folder(self):
+        # index.json лежит по тому же пути, что и на Диске
+        self.storage.put_index({"paths": {}, "points": {}})
+        self.assertTrue(os.path.exists(os.path.join(self.root, get_index_path())))
+
+    def test_ensure_folder(self):
+        self.storage.ensure_folder("a/b")
+        self.assertTrue(os.path.isdir(os.path.join(self.root, "a/b")))
+
+    def test_module_imports_without_fcntl(self):
+        # В Windows нет fcntl: модуль импортируется и с хранилищем по умолчанию
+        code = "import sys; sys.modules['fcntl'] = None; import modules.prcs_storage"
+        result = subprocess.run([sys.executable, "-c", code], cwd=os.path.dirname(os.path.dirname(__file__)),
+                                capture_output=True, text=True)
+        self.assertEqual(result.returncode, 0, result.stderr)
+
+    def test_windows_lock(self):
+        # В Windows блокировка берется через msvcrt
+        msvcrt = MagicMock(LK_LOCK=1, LK_UNLCK=0)
+        with patch('modules.prcs_storage.os.name', 'nt'), patch.dict(sys.modules, {'msvcrt': msvcrt}):
+            self.storage.put_index({"paths": {}, "points": {}})
+            self.assertEqual(self.storage.get_index()[0], {"paths": {}, "points": {}})
+        modes = [call.args[1] for call in msvcrt.locking.call_args_list]
+        self.assertEqual(modes, [1, 0, 1, 0])
+
+
+class TestStorageSelection(unittest.TestCase):
+
+    def tearDown(self):
+        set_storage(None)
+
+    def test_create_storage(self):
+        self.assertIsInstance(create_storage('yandex'), YandexDiskStorage)
+        self.assertIsInstance(create_storage('memory'), MemoryStorage)
+
+    def test_create_storage_unknown(self):
+        with self.assertRaises(ProcessingError):
+            create_storage('ftp')
+
+    @patch('modules.prcs_storage.STORAGE_BACKEND', 'memory')
+    def test_get_storage_from_config(self):
+        set_storage(None)
+        self.assertIsInstance(get_storage(), MemoryStorage)
+        self.assertIs(get_storage(), get_storage())
+
+    def test_module_functions_use_selected_storage(self):
+        # Функции конвейера работают через выбранное хранилище
+        storage = MemoryStorage()
+        set_storage(storage)
+
+        ensure_folder("base")
+        update_index_json({"paths": {"a": [[0, 0]]}, "points": {}}, download_index_json_with_revision())
+
+        self.assertIn("base", storage.folders)
+        self.assertEqual(download_index_json_with_revision()[0]["paths"], {"a": [[0, 0]]})
+
+    @patch('modules.prcs_storage.time.sleep')
+    def test_update_index_gives_up(self, mock_sleep):
+        # Число повторов ограничено
+        storage = MemoryStorage()
+        with patch.object(storage, 'put_index', side_effect=IndexConflictError("conflict")) as mock_put:
+            with self.assertRaises(IndexConflictError):
+                storage.update_index({"paths": {}, "points": {}})
+
+        self.assertEqual(mock_put.call_count, INDEX_UPDATE_MAX_ATTEMPTS)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,8 @@
 import unittest
+import gzip
 import json
+import requests
+import threading
 from unittest.mock import patch, Mock, MagicMock
 from datetime import datetime
 from modules.prcs_upload import (
@@ -8,14 +11,23 @@ from modules.prcs_upload import (
     ensure_folder,
     download_index_json,
     upload_index_json,
+    get_index_revision,
+    get_client,
+    clear_folder_cache,
+    FolderCache,
+    YandexDiskClient,
+    download_index_json_with_revision,
     BASE_FOLDER_PATH,
     API_BASE_URL
 )
-from modules.prcs_flow import ProcessingError, ERR_NETWORK
+from modules.prcs_flow import ProcessingError, IndexConflictError, ERR_NETWORK, ERR_CONFLICT, REVISION_ABSENT
 
 
 class TestPrcsUpload(unittest.TestCase):
 
+    def setUp(self):
+        clear_folder_cache()
+
     def test_get_headers(self):
         # Проверка формирования http заголовков
         headers = get_headers()
@@ -25,6 +37,38 @@ class TestPrcsUpload(unittest.TestCase):
         self.assertTrue(headers['Authorization'].startswith('OAuth '))
         self.assertEqual(headers['Content-Type'], 'application/json')
 
+    def test_get_client_is_shared(self):
+        # Клиент с пулом соединений создается один раз
+        self.assertIs(get_client(), get_client())
+
+    def test_client_pool_and_retries(self):
+        # Пул соединений и повторы настраиваются на адаптере сессии
+        client = YandexDiskClient(pool_size=4, retries=2, backoff=0.1)
+        adapter = client.session.get_adapter("https://cloud-api.yandex.net")
+
+        self.assertEqual(adapter._pool_maxsize, 4)
+        self.assertEqual(adapter.max_retries.total, 2)
+        self.assertIn(503, adapter.max_retries.status_forcelist)
+        client.close()
+
+    def test_client_wraps_network_errors(self):
+        # Сетевые ошибки превращаются в ProcessingError
+        client = YandexDiskClient(retries=0)
+        with patch.object(client.session, 'request', side_effect=requests.ConnectionError("refused")):
+            with self.assertRaises(ProcessingError) as context:
+                client.get("https://cloud-api.yandex.net/v1/disk/resources")
+
+        self.assertEqual(context.exception.code, ERR_NETWORK)
+
+    def test_client_applies_default_timeout(self):
+        # Таймаут по умолчанию передается в сессию
+        client = YandexDiskClient(timeout=(1, 2))
+        with patch.object(client.session, 'request') as mock_request:
+            mock_request.return_value = Mock(status_code=200)
+            client.put("https://uploader.disk.yandex.net/upload", data=b"{}")
+
+        self.assertEqual(mock_request.call_args[1]['timeout'], (1, 2))
+
     @patch('modules.prcs_upload.datetime')
     def test_get_current_day_folder_path(self, mock_datetime):
         # Генерация пути к папке текущего дня
@@ -34,7 +78,7 @@ class TestPrcsUpload(unittest.TestCase):
 
         self.assertEqual(path, expected)
 
-    @patch('modules.prcs_upload.requests.get')
+    @patch('modules.prcs_upload.YandexDiskClient.get')
     def test_ensure_folder_already_exists(self, mock_get):
         # Проверка создания папки, если она уже существует
         mock_response = Mock()
@@ -43,8 +87,8 @@ class TestPrcsUpload(unittest.TestCase):
         ensure_folder("test/path")
         mock_get.assert_called_once()
 
-    @patch('modules.prcs_upload.requests.put')
-    @patch('modules.prcs_upload.requests.get')
+    @patch('modules.prcs_upload.YandexDiskClient.put')
+    @patch('modules.prcs_upload.YandexDiskClient.get')
     def test_ensure_folder_creates_new(self, mock_get, mock_put):
         # Проверка создания новой папки
         mock_get_response = Mock()
@@ -57,8 +101,8 @@ class TestPrcsUpload(unittest.TestCase):
         mock_get.assert_called_once()
         mock_put.assert_called_once()
 
-    @patch('modules.prcs_upload.requests.put')
-    @patch('modules.prcs_upload.requests.get')
+    @patch('modules.prcs_upload.YandexDiskClient.put')
+    @patch('modules.prcs_upload.YandexDiskClient.get')
     def test_ensure_folder_conflict(self, mock_get, mock_put):
         # Проверка обработки конфликта (409)
         mock_get_response = Mock()
@@ -70,8 +114,8 @@ class TestPrcsUpload(unittest.TestCase):
         ensure_folder("test/path")
         mock_put.assert_called_once()
 
-    @patch('modules.prcs_upload.requests.put')
-    @patch('modules.prcs_upload.requests.get')
+    @patch('modules.prcs_upload.YandexDiskClient.put')
+    @patch('modules.prcs_upload.YandexDiskClient.get')
     def test_ensure_folder_create_fails(self, mock_get, mock_put):
         # Проверка ошибки при создании папки
         mock_get_response = Mock()
@@ -88,7 +132,7 @@ class TestPrcsUpload(unittest.TestCase):
         self.assertEqual(context.exception.code, ERR_NETWORK)
         self.assertIn("Failed to create folder", context.exception.message)
 
-    @patch('modules.prcs_upload.requests.get')
+    @patch('modules.prcs_upload.YandexDiskClient.get')
     def test_ensure_folder_check_fails(self, mock_get):
         # Проверка ошибки при проверке папки
         mock_response = Mock()
@@ -102,7 +146,85 @@ class TestPrcsUpload(unittest.TestCase):
         self.assertEqual(context.exception.code, ERR_NETWORK)
         self.assertIn("Failed to check folder", context.exception.message)
 
-    @patch('modules.prcs_upload.requests.get')
+    @patch('modules.prcs_upload.YandexDiskClient.get')
+    def test_ensure_folder_cached(self, mock_get):
+        # Повторная проверка папки берется из кэша
+        mock_response = Mock()
+        mock_response.status_code = 200
+        mock_get.return_value = mock_response
+        ensure_folder("test/path")
+        ensure_folder("test/path")
+        mock_get.assert_called_once()
+
+    @patch('modules.prcs_upload.YandexDiskClient.get')
+    def test_ensure_folder_cache_kept_on_missing_index(self, mock_get):
+        # 404 на index.json (индекса дня еще нет) не сбрасывает кэш папок
+        folder_response = Mock()
+        folder_response.status_code = 200
+        missing_response = Mock()
+        missing_response.status_code = 404
+        mock_get.side_effect = [folder_response, missing_response, missing_response]
+
+        ensure_folder("test/path")
+        self.assertIsNone(get_index_revision())
+        self.assertIsNone(download_index_json())
+        ensure_folder("test/path")
+
+        self.assertEqual(mock_get.call_count, 3)
+
+    @patch('modules.prcs_upload.YandexDiskClient.get')
+    @patch('modules.prcs_upload.YandexDiskClient.put')
+    def test_ensure_folder_cache_cleared_on_missing_folder(self, mock_put, mock_get):
+        # 404 на проверку папки сбрасывает кэш: другие папки тоже могли быть удалены
+        folder_response = Mock()
+        folder_response.status_code = 200
+        missing_response = Mock()
+        missing_response.status_code = 404
+        mock_put.return_value = Mock(status_code=201)
+        mock_get.side_effect = [folder_response, missing_response, folder_response]
+
+        ensure_folder("test/path")
+        ensure_folder("test/other")
+        ensure_folder("test/path")
+
+        self.assertEqual(mock_get.call_count, 3)
+
+    @patch('modules.prcs_upload.datetime')
+    @patch('modules.prcs_upload.time.monotonic')
+    def test_folder_cache_ttl_and_day_rollover(self, mock_monotonic, mock_datetime):
+        # Запись кэша устаревает по TTL и при смене дня
+        cache = FolderCache(ttl=60)
+        mock_datetime.now.return_value = datetime(2025, 11, 30, 23, 59, 0)
+        mock_monotonic.return_value = 100.0
+        cache.add("a")
+        mock_monotonic.return_value = 150.0
+        self.assertTrue(cache.contains("a"))
+        mock_monotonic.return_value = 161.0
+        self.assertFalse(cache.contains("a"))
+
+        mock_monotonic.return_value = 200.0
+        cache.add("a")
+        mock_datetime.now.return_value = datetime(2025, 12, 1, 0, 0, 1)
+        self.assertFalse(cache.contains("a"))
+
+    @patch('modules.prcs_upload.YandexDiskClient.get')
+    @patch('modules.prcs_upload.ensure_folder')
+    def test_upload_index_json_missing_folder(self, mock_ensure, mock_get):
+        # Отсутствующая папка при получении ссылки на загрузку сбрасывает кэш
+        mock_get_response = Mock()
+        mock_get_response.status_code = 409
+        mock_get_response.text = "DiskPathDoesntExistsError"
+        mock_get_response.json.return_value = {"error": "DiskPathDoesntExistsError"}
+        mock_get.return_value = mock_get_response
+
+        with patch('modules.prcs_upload._folder_cache') as mock_cache:
+            with self.assertRaises(ProcessingError) as context:
+                upload_index_json({"paths": {}, "points": {}})
+
+        self.assertEqual(context.exception.code, ERR_NETWORK)
+        mock_cache.clear.assert_called_once()
+
+    @patch('modules.prcs_upload.YandexDiskClient.get')
     def test_download_index_json_success(self, mock_get):
         # Успешная загрузка index.json
         test_data = {"paths": {"id1": [[0, 0]]}, "points": {"id1": {"coords": [0, 0], "desc": "test"}}}
@@ -112,9 +234,11 @@ class TestPrcsUpload(unittest.TestCase):
         mock_link_response.status_code = 200
         mock_link_response.json.return_value = {"href": "http://download.url"}
         # Первый вызов: скачивание файла
+        content = json.dumps(test_data).encode('utf-8')
         mock_file_response = Mock()
         mock_file_response.status_code = 200
-        mock_file_response.json.return_value = test_data
+        mock_file_response.iter_content.return_value = [content[:10], content[10:]]
+        mock_file_response.raw.tell.return_value = len(content)
         mock_get.side_effect = [mock_link_response, mock_file_response]
 
         result = download_index_json()
@@ -122,7 +246,7 @@ class TestPrcsUpload(unittest.TestCase):
         self.assertEqual(result, test_data)
         self.assertEqual(mock_get.call_count, 2)
 
-    @patch('modules.prcs_upload.requests.get')
+    @patch('modules.prcs_upload.YandexDiskClient.get')
     def test_download_index_json_not_found(self, mock_get):
         # Загрузка index.json, когда файл не существует
         mock_response = Mock()
@@ -132,7 +256,7 @@ class TestPrcsUpload(unittest.TestCase):
 
         self.assertIsNone(result)
 
-    @patch('modules.prcs_upload.requests.get')
+    @patch('modules.prcs_upload.YandexDiskClient.get')
     def test_download_index_json_no_href(self, mock_get):
         # Отсутствует ссылка для скачивания
         mock_response = Mock()
@@ -145,7 +269,7 @@ class TestPrcsUpload(unittest.TestCase):
 
         self.assertIn("Failed to get download link", context.exception.message)
 
-    @patch('modules.prcs_upload.requests.get')
+    @patch('modules.prcs_upload.YandexDiskClient.get')
     def test_download_index_json_download_fails(self, mock_get):
         # Загрузка index.json, когда загрузка файла не удалась
         # Первый вызов: получение ссылки на загрузку
@@ -162,7 +286,7 @@ class TestPrcsUpload(unittest.TestCase):
 
         self.assertIn("Failed to download index.json content", context.exception.message)
 
-    @patch('modules.prcs_upload.requests.get')
+    @patch('modules.prcs_upload.YandexDiskClient.get')
     def test_download_index_json_invalid_json(self, mock_get):
         # Загрузка index.json, когда JSON некорректен
         # Первый вызов: получение ссылки на загрузку
@@ -172,7 +296,8 @@ class TestPrcsUpload(unittest.TestCase):
         # Второй вызов: некорректный JSON
         mock_file_response = Mock()
         mock_file_response.status_code = 200
-        mock_file_response.json.side_effect = json.JSONDecodeError("Invalid", "", 0)
+        mock_file_response.iter_content.return_value = [b'{"paths": ']
+        mock_file_response.raw.tell.return_value = 10
         mock_get.side_effect = [mock_link_response, mock_file_response]
 
         with self.assertRaises(ProcessingError) as context:
@@ -180,7 +305,7 @@ class TestPrcsUpload(unittest.TestCase):
 
         self.assertIn("Failed to parse existing index.json", context.exception.message)
 
-    @patch('modules.prcs_upload.requests.get')
+    @patch('modules.prcs_upload.YandexDiskClient.get')
     def test_download_index_json_check_fails(self, mock_get):
         # Загрузка index.json, когда проверка не удалась
         mock_response = Mock()
@@ -193,8 +318,8 @@ class TestPrcsUpload(unittest.TestCase):
 
         self.assertIn("Failed to check index.json", context.exception.message)
 
-    @patch('modules.prcs_upload.requests.put')
-    @patch('modules.prcs_upload.requests.get')
+    @patch('modules.prcs_upload.YandexDiskClient.put')
+    @patch('modules.prcs_upload.YandexDiskClient.get')
     @patch('modules.prcs_upload.ensure_folder')
     def test_upload_index_json_success(self, mock_ensure, mock_get, mock_put):
         # Успешная загрузка index.json
@@ -213,8 +338,8 @@ class TestPrcsUpload(unittest.TestCase):
         mock_get.assert_called_once()
         mock_put.assert_called_once()
 
-    @patch('modules.prcs_upload.requests.put')
-    @patch('modules.prcs_upload.requests.get')
+    @patch('modules.prcs_upload.YandexDiskClient.put')
+    @patch('modules.prcs_upload.YandexDiskClient.get')
     @patch('modules.prcs_upload.ensure_folder')
     def test_upload_index_json_no_href(self, mock_ensure, mock_get, mock_put):
         # Загрузка index.json, когда нет ссылки на загрузку
@@ -230,8 +355,8 @@ class TestPrcsUpload(unittest.TestCase):
 
         self.assertIn("Failed to get upload link", context.exception.message)
 
-    @patch('modules.prcs_upload.requests.put')
-    @patch('modules.prcs_upload.requests.get')
+    @patch('modules.prcs_upload.YandexDiskClient.put')
+    @patch('modules.prcs_upload.YandexDiskClient.get')
     @patch('modules.prcs_upload.ensure_folder')
     def test_upload_index_json_upload_fails(self, mock_ensure, mock_get, mock_put):
         # Загрузка index.json, когда загрузка не удалась
@@ -251,7 +376,7 @@ class TestPrcsUpload(unittest.TestCase):
 
         self.assertIn("Failed to upload index.json content", context.exception.message)
 
-    @patch('modules.prcs_upload.requests.get')
+    @patch('modules.prcs_upload.YandexDiskClient.get')
     @patch('modules.prcs_upload.ensure_folder')
     def test_upload_index_json_get_link_fails(self, mock_ensure, mock_get):
         # Загрузка index.json, когда получение ссылки на загрузку не удалась
@@ -267,8 +392,8 @@ class TestPrcsUpload(unittest.TestCase):
 
         self.assertIn("Failed to get upload link", context.exception.message)
 
-    @patch('modules.prcs_upload.requests.put')
-    @patch('modules.prcs_upload.requests.get')
+    @patch('modules.prcs_upload.YandexDiskClient.put')
+    @patch('modules.prcs_upload.YandexDiskClient.get')
     @patch('modules.prcs_upload.ensure_folder')
     def test_upload_index_json_accepts_202(self, mock_ensure, mock_get, mock_put):
         # Загрузка index.json, когда загрузка принимает 202 статус
@@ -286,8 +411,8 @@ class TestPrcsUpload(unittest.TestCase):
         # Should not raise exception
         upload_index_json(test_data)
 
-    @patch('modules.prcs_upload.requests.put')
-    @patch('modules.prcs_upload.requests.get')
+    @patch('modules.prcs_upload.YandexDiskClient.put')
+    @patch('modules.prcs_upload.YandexDiskClient.get')
     @patch('modules.prcs_upload.ensure_folder')
     def test_upload_index_json_utf8_encoding(self, mock_ensure, mock_get, mock_put):
         # Проверка, что загрузка корректно кодирует UTF-8 данные
@@ -306,6 +431,136 @@ class TestPrcsUpload(unittest.TestCase):
         self.assertIsInstance(uploaded_data, bytes)
         self.assertIn('Тест'.encode('utf-8'), uploaded_data)  # Поддержка Русского языка в UTF-8
 
+    @patch('modules.prcs_upload.YandexDiskClient.get')
+    def test_get_index_revision(self, mock_get):
+        # Получение ревизии index.json
+        mock_response = Mock()
+        mock_response.status_code = 200
+        mock_response.json.return_value = {"revision": 1700000000000000}
+        mock_get.return_value = mock_response
+
+        self.assertEqual(get_index_revision(), 1700000000000000)
+        self.assertIn("fields=revision", mock_get.call_args[0][0])
+
+    @patch('modules.prcs_upload.YandexDiskClient.get')
+    def test_get_index_revision_not_found(self, mock_get):
+        # Ревизия отсутствующего index.json
+        mock_response = Mock()
+        mock_response.status_code = 404
+        mock_get.return_value = mock_response
+
+        self.assertIsNone(get_index_revision())
+
+    @patch('modules.prcs_upload.download_index_json')
+    @patch('modules.prcs_upload.get_index_revision')
+    def test_download_index_json_with_revision(self, mock_revision, mock_download):
+        # Ревизия запрашивается до скачивания содержимого
+        mock_revision.return_value = 42
+        mock_download.return_value = {"paths": {}, "points": {}}
+
+        self.assertEqual(download_index_json_with_revision(), ({"paths": {}, "points": {}}, 42))
+
+    @patch('modules.prcs_upload.download_index_json')
+    @patch('modules.prcs_upload.get_index_revision')
+    def test_download_index_json_with_revision_absent(self, mock_revision, mock_download):
+        # Отсутствующий index.json не скачивается
+        mock_revision.return_value = None
+
+        self.assertEqual(download_index_json_with_revision(), (None, REVISION_ABSENT))
+        mock_download.assert_not_called()
+
+    @patch('modules.prcs_upload.YandexDiskClient.put')
+    @patch('modules.prcs_upload.YandexDiskClient.get')
+    @patch('modules.prcs_upload.get_index_revision')
+    @patch('modules.prcs_upload.ensure_folder')
+    def test_upload_index_json_revision_conflict(self, mock_ensure, mock_revision, mock_get, mock_put):
+        # Ревизия на диске изменилась после скачивания: проверка перед PUT останавливает загрузку
+        mock_revision.return_value = 43
+        mock_get.return_value = Mock(status_code=200)
+        mock_get.return_value.json.return_value = {"href": "http://upload.url"}
+
+        with self.assertRaises(IndexConflictError) as context:
+            upload_index_json({"paths": {}, "points": {}}, if_revision=42)
+
+        self.assertEqual(context.exception.code, ERR_CONFLICT)
+        mock_revision.assert_called_once()
+        mock_put.assert_not_called()
+
+    @patch('modules.prcs_upload.YandexDiskClient.put')
+    @patch('modules.prcs_upload.YandexDiskClient.get')
+    @patch('modules.prcs_upload.ensure_folder')
+    def test_upload_link_and_revision_requested_together(self, mock_ensure, mock_get, mock_put):
+        # Ссылка для загрузки и ревизия запрашиваются параллельно, PUT выполняется после обоих ответов
+        barrier = threading.Barrier(2, timeout=5)
+        link_response = Mock(status_code=200)
+        link_response.json.return_value = {"href": "http://upload.url"}
+        revision_response = Mock(status_code=200)
+        revision_response.json.return_value = {"revision": 42}
+
+        def get(url, **kwargs):
+            barrier.wait()
+            return revision_response if "fields=revision" in url else link_response
+
+        mock_get.side_effect = get
+        mock_put.return_value = Mock(status_code=201)
+        upload_index_json({"paths": {}, "points": {}}, if_revision=42)
+
+        self.assertEqual(mock_get.call_count, 2)
+        mock_put.assert_called_once()
+
+    @patch('modules.prcs_upload.YandexDiskClient.put')
+    @patch('modules.prcs_upload.YandexDiskClient.get')
+    @patch('modules.prcs_upload.ensure_folder')
+    def test_upload_index_json_absent_uses_no_overwrite(self, mock_ensure, mock_get, mock_put):
+        # Новый index.json загружается с overwrite=false, 409 означает конфликт
+        mock_get_response = Mock()
+        mock_get_response.status_code = 409
+        mock_get_response.text = "DiskResourceAlreadyExistsError"
+        mock_get.return_value = mock_get_response
+
+        with self.assertRaises(IndexConflictError):
+            upload_index_json({"paths": {}, "points": {}}, if_revision=REVISION_ABSENT)
+
+        self.assertIn("overwrite=false", mock_get.call_args[0][0])
+        mock_put.assert_not_called()
+
+    @patch('modules.prcs_upload.YandexDiskClient.get')
+    def test_download_index_json_logs_transfer(self, mock_get):
+        # Скачивание читает ответ потоково и пишет объем переданных данных в лог задачи
+        mock_link_response = Mock()
+        mock_link_response.status_code = 200
+        mock_link_response.json.return_value = {"href": "http://download.url"}
+        mock_file_response = Mock()
+        mock_file_response.status_code = 200
+        mock_file_response.iter_content.return_value = [b'{"paths": {}, "points": {}}' + b' ' * 10000]
+        mock_file_response.raw.tell.return_value = 100
+        mock_get.side_effect = [mock_link_response, mock_file_response]
+
+        with self.assertLogs('modules.prcs_upload.transfer', level='INFO') as logs:
+            download_index_json()
+
+        self.assertTrue(mock_get.call_args[1]['stream'])
+        self.assertIn("gzip", logs.output[0])
+        self.assertIn("сэкономлено", logs.output[0])
+
+    @patch('modules.prcs_upload.YANDEX_DISK_GZIP_UPLOAD', True)
+    @patch('modules.prcs_upload.YandexDiskClient.put')
+    @patch('modules.prcs_upload.YandexDiskClient.get')
+    @patch('modules.prcs_upload.ensure_folder')
+    def test_upload_index_json_gzip(self, mock_ensure, mock_get, mock_put):
+        # Сжатая загрузка отправляет gzip с Content-Encoding
+        test_data = {"paths": {}, "points": {"id1": {"coords": [0, 0], "desc": "Тест"}}}
+        mock_get_response = Mock()
+        mock_get_response.status_code = 200
+        mock_get_response.json.return_value = {"href": "http://upload.url"}
+        mock_get.return_value = mock_get_response
+        mock_put.return_value = Mock(status_code=201)
+
+        upload_index_json(test_data)
+
+        self.assertEqual(mock_put.call_args[1]['headers'], {"Content-Encoding": "gzip"})
+        self.assertEqual(json.loads(gzip.decompress(mock_put.call_args[1]['data'])), test_data)
+
 
 if __name__ == '__main__':
     unittest.main()
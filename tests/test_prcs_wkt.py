@@ -196,6 +196,16 @@ POINT (37.6200 55.7600)"""
 
         self.assertIn('Ошибка чтения файла', str(context.exception.message))
 
+    def test_process_wkt_from_memory(self):
+        # WKT в памяти, описание — из filename
+        result = process_wkt(b"# comment\nPOINT (37.6173 55.7558)\n", 'upload.wkt')
+        self.assertEqual(list(result['points'].values()), [{"coords": [37.6173, 55.7558], "desc": "upload.wkt"}])
+
+    def test_process_wkt_line_separators(self):
+        # Строки разделяются только переводами строк; \u2028 внутри комментария не начинает новую строку
+        result = process_wkt("# comment\u2028POINT (1 2)\r\nPOINT (3 4)\rPOINT (5 6)".encode('utf-8'), 'upload.wkt')
+        self.assertEqual([point["coords"] for point in result['points'].values()], [[3.0, 4.0], [5.0, 6.0]])
+
 
 if __name__ == '__main__':
     unittest.main()
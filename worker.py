@@ -0,0 +1,95 @@
+"""
+Обработчик очереди задач SQLite (JOB_QUEUE_BACKEND = "sqlite"). Запускается отдельно от веб-приложения, в любом
+числе процессов на той же машине:
+
+    python worker.py            # один процесс
+    python worker.py --threads 4
+
+Задачи, которые выполнял остановленный или упавший обработчик, возвращаются в очередь по истечении аренды.
+"""
+import argparse
+import logging
+import os
+import signal
+import socket
+import threading
+from typing import Any, Dict
+
+from config import WORKER_POLL_INTERVAL
+from modules.prcs_job_queue import SQLiteJobQueue, JOB_TARGETS, JOB_KIND_UPLOAD, get_job_queue, check_job_backends
+from modules.prcs_jobs import JobRegistry
+from modules.prcs_multipart import UploadFeed
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def run_job(job_queue: SQLiteJobQueue, job: Dict[str, Any], worker_id: str) -> None:
+    """Выполняет задачу из очереди, продлевая аренду и передавая задаче запрошенную отмену"""
+    registry = JobRegistry()
+    local_job = registry.create(job['id'])
+    # Повтор задачи, результаты которой уже сохранены, не сохраняет их второй раз
+    local_job.report['saved'] = job['saved']
+    local_job.on_saved = lambda: job_queue.mark_saved(job['id'])
+    finished = threading.Event()
+
+    def keep_lease() -> None:
+        while not finished.wait(job_queue.lease_timeout / 3):
+            if job_queue.heartbeat(job['id'], worker_id):
+                registry.cancel(job['id'])
+
+    lease_thread = threading.Thread(target=keep_lease, name=f"lease-{job['id']}", daemon=True)
+    lease_thread.start()
+    logger.info(f"Job {job['id']} ({job['kind']}) started, attempt {job['attempts']}")
+    try:
+        if job['cancel_requested']:
+            registry.cancel(job['id'])
+        args = job['args']
+        if job['kind'] == JOB_KIND_UPLOAD:
+            # Временные файлы удаляет очередь при завершении задачи: повтор после сбоя обработчика найдет их на месте
+            args = [UploadFeed.of(args[0], keep_files=True), *args[1:]]
+        # Лог задачи попадает в общий журнал SQLite и доступен SSE веб-приложения
+        registry.run(job['id'], JOB_TARGETS[job['kind']], local_job.log_queue, job['id'], *args)
+    except Exception as e:
+        logger.exception(f"Job {job['id']} failed")
+        local_job.report['error'] = str(e)
+    finally:
+        finished.set()
+        lease_thread.join()
+    job_queue.finish(job['id'], local_job.report)
+    logger.info(f"Job {job['id']} finished")
+
+
+def work(job_queue: SQLiteJobQueue, worker_id: str, stop: threading.Event) -> None:
+    while not stop.is_set():
+        job = job_queue.claim(worker_id)
+        if job is None:
+            stop.wait(WORKER_POLL_INTERVAL)
+            continue
+        run_job(job_queue, job, worker_id)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Обработчик очереди задач nmap_utils")
+    parser.add_argument('--threads', type=int, default=1, help="число задач, выполняемых одновременно")
+    options = parser.parse_args()
+    check_job_backends()
+
+    job_queue = get_job_queue()
+    stop = threading.Event()
+    # Остановка дожидается завершения выполняющихся задач
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    signal.signal(signal.SIGINT, lambda signum, frame: stop.set())
+
+    base_id = f"{socket.gethostname()}:{os.getpid()}"
+    threads = [threading.Thread(target=work, args=(job_queue, f"{base_id}:{n}", stop), name=f"worker-{n}")
+               for n in range(options.threads)]
+    for thread in threads:
+        thread.start()
+    logger.info(f"Worker {base_id} started with {options.threads} thread(s), queue {job_queue.path}")
+    for thread in threads:
+        thread.join()
+
+
+if __name__ == '__main__':
+    main()